@@ -1,24 +1,53 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+import asyncio
+import json
+import logging
+from contextlib import aclosing, asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-
-from sql_generator import generate_sql
-from sql_validator import (
-    is_safe_select,
-    has_unknown_tables,
-    has_unknown_columns,
-    server_preflight_ok,
-)
-from sql_rewriter import apply_column_mappings
-from repair_sql import repair_sql
 
-from db import run_query
-from config import STRICT_PREFLIGHT
+from sql_generator import agenerate_sql, agenerate_candidates
+from example_store import example_store
+from sql_validator import is_safe_select
+from validation_cache import validation_cache, preflight_batcher
+from sql_rewriter import apply_column_mappings
+from repair_sql import arepair_sql
+from local_repair import local_repair, local_repair_metrics
+from semantic_check import VALID, semantic_check_metrics
+from cost_guard import CostDecision, add_top, decide, estimate_cost
+from result_cache import QueryResult, result_cache
+
+import pandas as pd
+
+from db import RowStream, fetch_rows, pool_metrics, run_in_pool
+from export import EXPORT_FORMATS, arrow_available, make_encoder, sign_sql, verify_sql
+from llm import llm_metrics
+from sql_utils import stream_metrics
+from sql_cache import sql_cache, normalize_question
+from single_flight import SingleFlight
+from config import (
+    STRICT_PREFLIGHT,
+    SQL_CACHE_ENABLED,
+    BATCH_LLM_CONCURRENCY,
+    BATCH_DB_CONCURRENCY,
+    GENERATION_CANDIDATES,
+    COST_GUARD_ENABLED,
+    COST_GUARD_LOW_PRIORITY_CONCURRENCY,
+    RESULT_CACHE_ENABLED,
+    EXPORT_CHUNK_ROWS,
+    EXPORT_MAX_ROWS,
+    EXPORT_CONCURRENCY,
+)
 from sql_utils import extract_sql  # <-- already imported
 
+logger = logging.getLogger(__name__)
+
 # ---------------------------------------------------------
 # FastAPI Startup
 # ---------------------------------------------------------
@@ -38,25 +67,182 @@ class ChatSqlResp(BaseModel):
     validated: bool
     error: Optional[str] = None
     preview_markdown: Optional[str] = None
+    truncated: Optional[bool] = None  # True if the result had more than max_rows rows
+    cache: Optional[str] = None  # "exact" / "similar" when the SQL came from the cache
+    result_cached: Optional[bool] = None  # preview served from the result cache
+    # Result-set shape from preflight: [{"name", "type", "nullable"}, ...]
+    columns: Optional[List[Dict[str, Any]]] = None
+    # Cost guard estimate for execute=true: cost, rows, large_scans, actions, reason
+    cost_estimate: Optional[Dict[str, Any]] = None
+    # Pass to /export with `sql` to download the full result (validated SQL only)
+    export_token: Optional[str] = None
 
 
 MAX_REPAIR_ATTEMPTS = 1
 
+# Identical concurrent questions share one pipeline run
+chat_flight = SingleFlight()
+
+# Per-stage concurrency caps, set for requests coming from /chat_sql/batch
+# (interactive /chat_sql requests run uncapped)
+_stage_limits: ContextVar[Optional[Dict[str, asyncio.Semaphore]]] = ContextVar(
+    "stage_limits", default=None
+)
+BATCH_STAGE_LIMITS = {
+    "llm": asyncio.Semaphore(BATCH_LLM_CONCURRENCY),
+    "db": asyncio.Semaphore(BATCH_DB_CONCURRENCY),
+}
+
+# DB pool that executes the query: /chat_sql/batch items use "batch", so
+# they don't compete with interactive requests for connections
+_exec_pool: ContextVar[str] = ContextVar("exec_pool", default="interactive")
+
+# Queries the cost guard routes to the low-priority path run one (or a few)
+# at a time instead of alongside everything else
+low_priority_slots = asyncio.Semaphore(COST_GUARD_LOW_PRIORITY_CONCURRENCY)
+
+
+@asynccontextmanager
+async def _stage(kind: str) -> AsyncIterator[None]:
+    """Hold a slot of the 'llm' / 'db' stage cap, if the request has caps."""
+    limits = _stage_limits.get()
+    if limits is None:
+        yield
+        return
+    async with limits[kind]:
+        yield
+
+
+async def _preflight(sql: str):
+    """
+    Server preflight on the DB executor (or a no-op if disabled). Cached
+    outcomes come straight from validation_cache without touching the DB,
+    as does SQL the local semantic check can fully judge; concurrent
+    misses share one batched round trip (preflight_batcher).
+    """
+    if not STRICT_PREFLIGHT:
+        return True, "ok"
+    local = validation_cache.local_verdict(sql)
+    if local is not None:
+        return local
+    result = validation_cache.cached_preflight(sql)
+    if result is None:
+        async with _stage("db"):
+            result = await preflight_batcher.preflight(sql)
+    return result.preflight_ok, result.preflight_msg
+
+
+async def _cost_check(sql: str, max_rows: int) -> Optional[CostDecision]:
+    """Estimated plan -> cost guard decision; None if the estimate fails."""
+    try:
+        async with _stage("db"):
+            estimate = await run_in_pool("preflight", estimate_cost, sql)
+    except Exception as ex:
+        logger.warning("Cost estimate failed, executing without the guard: %s", ex)
+        return None
+    return decide(sql, estimate, max_rows)
+
+
+@asynccontextmanager
+async def _priority(low: bool) -> AsyncIterator[None]:
+    if not low:
+        yield
+        return
+    async with low_priority_slots:
+        yield
+
+
+def _apply_local_repair(sql: str) -> str:
+    """Deterministic catalog-driven fixes (local_repair), if any apply."""
+    fixed, notes = local_repair(sql)
+    if fixed is None:
+        return sql
+    logger.info("Local repair: %s", "; ".join(notes))
+    return fixed
+
+
+def _render_preview(result: QueryResult, max_rows: int) -> str:
+    df = pd.DataFrame.from_records(result.rows(max_rows), columns=list(result.names))
+    return df.to_markdown(index=False)
+
+
+def _execute_preview(sql: str, max_rows: int, pool: str) -> Tuple[QueryResult, str]:
+    """
+    Blocking: run the query on `pool`, fetch only the first max_rows (the
+    statement is cancelled past that) and render them as markdown.
+    """
+    names, rows, truncated = fetch_rows(sql, max_rows, pool)
+    result = QueryResult.from_rows(names, rows, truncated)
+    return result, _render_preview(result, max_rows)
+
 
 # ---------------------------------------------------------
 # Main Endpoint
 # ---------------------------------------------------------
 
 @app.post("/chat_sql", response_model=ChatSqlResp)
-def chat_sql(req: ChatSqlReq):
+async def chat_sql(req: ChatSqlReq):
+    """
+    Async end to end: the LLM calls are awaited on the async clients and
+    blocking DB work (preflight, execution) runs on the bounded DB
+    executor, so a slow LLM call doesn't hold a threadpool slot.
+    """
+    return await _run_chat_sql(req, batch=False)
+
+
+async def _run_chat_sql(req: ChatSqlReq, batch: bool) -> ChatSqlResp:
     question = req.question.strip()
     execute = req.execute
     max_rows = max(1, min(req.max_rows, 500))
 
+    # Concurrent duplicates (same normalized question + flags, same request
+    # class) await the first request's run and share its ChatSqlResp
+    key = (normalize_question(question), execute, max_rows, batch)
+    resp = await chat_flight.do(key, lambda: _chat_sql_as(batch, question, execute, max_rows))
+    if resp.validated and resp.export_token is None:
+        resp.export_token = sign_sql(resp.sql)
+    return resp
+
+
+async def _chat_sql_as(batch: bool, question: str, execute: bool, max_rows: int) -> ChatSqlResp:
+    """
+    Run the pipeline with the stage caps and execution pool of its request
+    class. They are set here, inside the flight's own task, rather than
+    inherited from whichever caller happened to start the flight.
+    """
+    _stage_limits.set(BATCH_STAGE_LIMITS if batch else None)
+    _exec_pool.set("batch" if batch else "interactive")
+    return await _chat_sql(question, execute, max_rows)
+
+
+async def _chat_sql(question: str, execute: bool, max_rows: int) -> ChatSqlResp:
+    """The /chat_sql pipeline for one (coalesced) question."""
+    # -----------------------------------------------------
+    # 0) Cached SQL for this (or a reworded) question: already
+    #    validated + preflighted against the current schema
+    # -----------------------------------------------------
+    cached = sql_cache.get(question) if SQL_CACHE_ENABLED else None
+    if cached is not None:
+        sql, tier = cached
+        return await _respond(sql, execute, max_rows, cache=tier)
+
+    # -----------------------------------------------------
+    # 1-6) N candidates at once: first one that fully validates wins
+    # -----------------------------------------------------
+    if GENERATION_CANDIDATES > 1:
+        sql, ok, msg, final = await _first_valid_candidate(question, GENERATION_CANDIDATES)
+        if final:
+            # Unsafe SQL or unknown objects: same outcome as steps 2 / 4-5 below
+            return ChatSqlResp(sql=sql, executed=False, validated=False, error=msg)
+        if not ok and sql:
+            sql, ok, msg = await _repair_loop(question, sql, ok, msg)
+        return await _finish(question, sql, ok, msg, execute, max_rows)
+
     # -----------------------------------------------------
     # 1) Generate SQL from natural-language question
     # -----------------------------------------------------
-    raw_sql = generate_sql(question)
+    async with _stage("llm"):
+        raw_sql = await agenerate_sql(question)
     # 🔑 Normalize here so everything downstream sees *clean* SQL
     sql = extract_sql(raw_sql)
 
@@ -78,61 +264,76 @@ def chat_sql(req: ChatSqlReq):
     if changed:
         sql = rewritten_sql
 
-    # -----------------------------------------------------
-    # 4) Table-level validation
-    # -----------------------------------------------------
-    has_bad_tables, bad_tables = has_unknown_tables(sql)
-    if has_bad_tables:
-        return ChatSqlResp(
-            sql=sql,
-            executed=False,
-            validated=False,
-            error=f"Query referenced unknown tables: {', '.join(bad_tables)}"
-        )
+    # Mechanical mistakes (near-miss columns, YEAR(OrderDateKey), wrong or
+    # missing FK joins) are fixed locally instead of via an LLM repair
+    sql = _apply_local_repair(sql)
 
     # -----------------------------------------------------
-    # 5) Column-level validation
+    # 4) + 5) Table- and column-level validation (cached per SQL)
     # -----------------------------------------------------
-    has_bad_cols, bad_cols = has_unknown_columns(sql)
-    if has_bad_cols:
-        pretty = [f"{tbl}.{col} (alias {alias})" for (tbl, alias, col) in bad_cols]
+    validation = validation_cache.validate(sql)
+    if validation.unknown_tables or validation.unknown_columns:
         return ChatSqlResp(
             sql=sql,
             executed=False,
             validated=False,
-            error="Query referenced unknown columns: " + ", ".join(pretty)
+            error=validation.error,
         )
 
     # -----------------------------------------------------
-    # 6) SQL Server Preflight (compile-only)
+    # 6) Join keys vs. real FKs, then SQL Server Preflight (compile-only)
     # -----------------------------------------------------
-    ok, msg = server_preflight_ok(sql) if STRICT_PREFLIGHT else (True, "ok")
+    if validation.bad_joins:
+        # Caught locally: go straight to repair, no preflight round trip
+        ok, msg = False, validation.error
+    else:
+        ok, msg = await _preflight(sql)
+
+    sql, ok, msg = await _repair_loop(question, sql, ok, msg)
+    return await _finish(question, sql, ok, msg, execute, max_rows)
+
+
+async def _repair_loop(question: str, sql: str, ok: bool, msg: str) -> Tuple[str, bool, str]:
+    """Attempt LLM repair while preflight (or the join-key check) fails."""
     attempts = 0
 
-    # Attempt LLM repair if preflight fails
     while not ok and attempts < MAX_REPAIR_ATTEMPTS:
         attempts += 1
 
-        repaired_raw = repair_sql(question, sql, msg)
+        async with _stage("llm"):
+            repaired_raw = await arepair_sql(question, sql, msg)
         # 🔑 Normalize repaired SQL as well
         repaired = extract_sql(repaired_raw)
 
         if not is_safe_select(repaired):
             break
 
-        # Validate repaired table list
-        has_bad_tables, bad_tables = has_unknown_tables(repaired)
-        if has_bad_tables:
-            break
+        repaired = _apply_local_repair(repaired)
 
-        # Validate repaired columns
-        has_bad_cols, bad_cols = has_unknown_columns(repaired)
-        if has_bad_cols:
+        # Validate repaired tables and columns
+        validation = validation_cache.validate(repaired)
+        if validation.unknown_tables or validation.unknown_columns:
             break
 
         sql = repaired
-        ok, msg = server_preflight_ok(sql) if STRICT_PREFLIGHT else (True, "ok")
 
+        if validation.bad_joins:
+            ok, msg = False, validation.error
+            continue
+
+        ok, msg = await _preflight(sql)
+
+    return sql, ok, msg
+
+
+async def _finish(
+    question: str,
+    sql: str,
+    ok: bool,
+    msg: str,
+    execute: bool,
+    max_rows: int,
+) -> ChatSqlResp:
     if not ok:
         return ChatSqlResp(
             sql=sql,
@@ -142,22 +343,167 @@ def chat_sql(req: ChatSqlReq):
         )
 
     # -----------------------------------------------------
-    # 7) SQL validated successfully → return or execute
+    # 7) SQL validated successfully → cache, return or execute
     # -----------------------------------------------------
+    # Only cache SQL that was actually checked: with STRICT_PREFLIGHT off,
+    # _preflight() lets everything through, so require a certain local verdict
+    if SQL_CACHE_ENABLED and (STRICT_PREFLIGHT or validation_cache.validate(sql).semantic == VALID):
+        sql_cache.put(question, sql)
+
+    return await _respond(sql, execute, max_rows)
+
+
+# ---------------------------------------------------------
+# Multi-candidate generation
+# ---------------------------------------------------------
+
+async def _validate_candidate(sql: str) -> Tuple[str, bool, str, bool]:
+    """
+    Steps 2-6 for one candidate: (sql after rewrites, ok, error message,
+    final). final marks failures the single-candidate path returns as is
+    instead of repairing: unsafe SQL and unknown tables / columns.
+    """
+    sql = extract_sql(sql)
+    if not is_safe_select(sql):
+        return sql, False, "Blocked: generated SQL is not a safe SELECT statement.", True
+
+    sql, _ = apply_column_mappings(sql)
+    sql = _apply_local_repair(sql)
+
+    validation = validation_cache.validate(sql)
+    if validation.unknown_tables or validation.unknown_columns:
+        return sql, False, validation.error, True
+    if not validation.local_ok:
+        return sql, False, validation.error, False
+
+    ok, msg = await _preflight(sql)
+    return sql, ok, msg, False
+
+
+async def _first_valid_candidate(question: str, n: int) -> Tuple[str, bool, str, bool]:
+    """
+    Generate n candidates and validate each one as soon as it arrives
+    (local checks, then preflight, all concurrently). Returns the first
+    candidate that fully validates and cancels the rest (generations
+    still running and pending preflights). If none does, returns the
+    first failure so the caller can repair it, or return it as is when it
+    is final (see _validate_candidate).
+    """
+    results: asyncio.Queue = asyncio.Queue()
+    checks: List[asyncio.Task] = []
+
+    async def check(sql: str) -> None:
+        try:
+            await results.put(await _validate_candidate(sql))
+        except Exception as ex:
+            await results.put((sql, False, f"Validation failed: {ex}", False))
+
+    async def produce() -> None:
+        count = 0
+        try:
+            async with _stage("llm"):
+                async with aclosing(agenerate_candidates(question, n)) as candidates:
+                    async for sql in candidates:
+                        count += 1
+                        checks.append(asyncio.ensure_future(check(sql)))
+        finally:
+            await results.put(count)
+
+    producer = asyncio.ensure_future(produce())
+    first_failure: Optional[Tuple[str, bool, str, bool]] = None
+    expected: Optional[int] = None
+    received = 0
+
+    try:
+        while expected is None or received < expected:
+            item = await results.get()
+            if isinstance(item, int):
+                expected = item
+                continue
+            received += 1
+            if item[1]:
+                return item
+            if first_failure is None:
+                first_failure = item
+
+        if first_failure is None:
+            # Surface generation errors (nothing to repair without a candidate)
+            await producer
+            return "", False, "The LLM returned no SQL candidates.", False
+        return first_failure
+    finally:
+        producer.cancel()
+        for t in checks:
+            t.cancel()
+
+
+async def _respond(
+    sql: str,
+    execute: bool,
+    max_rows: int,
+    cache: Optional[str] = None,
+) -> ChatSqlResp:
+    """Response for validated SQL, executing it first if requested."""
+    columns = validation_cache.columns(sql)
     if not execute:
         return ChatSqlResp(
             sql=sql,
             executed=False,
             validated=True,
             error=None,
+            cache=cache,
+            columns=columns,
         )
 
     # -----------------------------------------------------
-    # 8) Execute the query
+    # 8) Result already cached for this SQL and data version?
+    # -----------------------------------------------------
+    version = None
+    if RESULT_CACHE_ENABLED:
+        if result_cache.probe_due():
+            async with _stage("db"):
+                await run_in_pool("preflight", result_cache.probe)
+        cached, version = result_cache.get(sql, max_rows)
+        if cached is not None:
+            return ChatSqlResp(
+                sql=sql,
+                executed=True,
+                validated=True,
+                error=None,
+                preview_markdown=_render_preview(cached, max_rows),
+                truncated=cached.truncated or cached.row_count > max_rows,
+                cache=cache,
+                result_cached=True,
+                columns=columns,
+            )
+
+    # -----------------------------------------------------
+    # 9) Cost guard (estimated plan), then execute the query
     # -----------------------------------------------------
+    decision = await _cost_check(sql, max_rows) if COST_GUARD_ENABLED else None
+    cost = decision.to_dict() if decision is not None else None
+    if decision is not None and decision.reject:
+        return ChatSqlResp(
+            sql=sql,
+            executed=False,
+            validated=True,
+            error=f"Blocked by cost guard: {cost['reason']}",
+            cache=cache,
+            columns=columns,
+            cost_estimate=cost,
+        )
+
+    exec_sql = sql
+    if decision is not None and decision.top is not None:
+        exec_sql = add_top(sql, decision.top) or sql
+
     try:
-        df = run_query(sql)
-        preview = df.head(max_rows).to_markdown(index=False)
+        async with _priority(decision is not None and decision.low_priority):
+            async with _stage("db"):
+                pool = _exec_pool.get()
+                result, preview = await run_in_pool(pool, _execute_preview, exec_sql, max_rows, pool)
+        if RESULT_CACHE_ENABLED:
+            result_cache.put(sql, version, result)
 
         return ChatSqlResp(
             sql=sql,
@@ -165,6 +511,11 @@ def chat_sql(req: ChatSqlReq):
             validated=True,
             error=None,
             preview_markdown=preview,
+            truncated=result.truncated,
+            cache=cache,
+            result_cached=False if RESULT_CACHE_ENABLED else None,
+            columns=columns,
+            cost_estimate=cost,
         )
     except Exception as ex:
         return ChatSqlResp(
@@ -173,9 +524,174 @@ def chat_sql(req: ChatSqlReq):
             validated=True,
             error=f"Execution failed: {ex}",
             preview_markdown=None,
+            cache=cache,
+            columns=columns,
+            cost_estimate=cost,
         )
 
 
+# ---------------------------------------------------------
+# Batch Endpoint
+# ---------------------------------------------------------
+
+class ChatSqlBatchReq(BaseModel):
+    items: List[ChatSqlReq]
+
+
+async def _batch_results(items: List[ChatSqlReq]) -> AsyncIterator[str]:
+    """
+    Run all items concurrently (LLM and DB stages capped separately by
+    BATCH_STAGE_LIMITS) and yield one NDJSON line per item as it finishes.
+    """
+    tasks: Dict[asyncio.Task, int] = {
+        asyncio.ensure_future(_run_chat_sql(item, batch=True)): i for i, item in enumerate(items)
+    }
+
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                line: Dict = {"index": tasks[task]}
+                try:
+                    line.update(task.result().model_dump())
+                except Exception as ex:
+                    line.update(
+                        sql="",
+                        executed=False,
+                        validated=False,
+                        error=f"Failed: {ex}",
+                    )
+                yield json.dumps(line) + "\n"
+    finally:
+        # Client went away: don't keep working on the rest
+        for task in pending:
+            task.cancel()
+
+
+@app.post("/chat_sql/batch")
+async def chat_sql_batch(req: ChatSqlBatchReq):
+    """
+    Many questions in one call. Results stream back as NDJSON in
+    completion order; each line carries the item's `index` plus the
+    usual ChatSqlResp fields.
+    """
+    return StreamingResponse(_batch_results(req.items), media_type="application/x-ndjson")
+
+
+# ---------------------------------------------------------
+# Export Endpoint
+# ---------------------------------------------------------
+
+class ExportReq(BaseModel):
+    sql: str  # exactly as /chat_sql returned it
+    token: str  # its export_token
+    format: str = "csv"  # csv | ndjson | arrow
+    max_rows: Optional[int] = None  # None = EXPORT_MAX_ROWS
+
+
+# Exports hold a DB connection for as long as the client reads
+export_slots = asyncio.Semaphore(max(1, EXPORT_CONCURRENCY))
+
+
+async def _export_stream(sql: str, fmt: str, max_rows: int) -> AsyncIterator[bytes]:
+    """
+    Run `sql` and yield the encoded result chunk by chunk (EXPORT_CHUNK_ROWS
+    rows at a time). The next chunk is only fetched once the previous one
+    was sent, so a slow client slows the cursor down instead of rows
+    piling up in memory. The statement is cancelled if the client leaves.
+
+    The export slot and the DB connection are only taken once the body is
+    iterated, and released when it ends, so a response whose body is never
+    read holds neither. Execution errors therefore happen after the 200
+    headers went out: they abort the response instead of getting a status.
+    """
+    async with export_slots:
+        try:
+            stream = await run_in_pool("batch", RowStream, sql, max_rows, "batch")
+        except Exception as ex:
+            logger.warning("Export failed to start: %s", ex)
+            raise
+        try:
+            encoder = make_encoder(fmt, stream.description)
+            yield encoder.begin()
+            while True:
+                rows = await run_in_pool("batch", stream.fetch, EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                yield encoder.encode(rows)
+            yield encoder.end()
+            logger.info("Exported %d rows as %s", stream.rows_read, fmt)
+        finally:
+            # Blocking (cancels the statement, returns the connection): run it
+            # on the pool, and finish it even if this task is being cancelled
+            await asyncio.shield(run_in_pool("batch", stream.close))
+
+
+def _export_error(status: int, error: str) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"ok": False, "error": error})
+
+
+@app.post("/export")
+async def export(req: ExportReq):
+    """
+    Full result of SQL /chat_sql validated, streamed as CSV, NDJSON or
+    Arrow IPC record batches (chunked transfer). Only SQL this service
+    produced is run: `token` must be the export_token /chat_sql returned
+    with it. The SQL still goes through the same safety, schema and
+    preflight checks (the schema may have changed since), but no repair.
+    """
+    fmt = req.format.lower()
+    if fmt not in EXPORT_FORMATS:
+        return _export_error(400, f"Unknown format {req.format!r}, expected one of {sorted(EXPORT_FORMATS)}.")
+    if fmt == "arrow" and not arrow_available():
+        return _export_error(400, "Arrow export needs pyarrow ('pip install pyarrow').")
+
+    if not verify_sql(req.sql, req.token):
+        return _export_error(403, "Unknown SQL: export the sql and export_token /chat_sql returned.")
+    sql = req.sql.strip().rstrip(";")
+    if not is_safe_select(sql):
+        return _export_error(400, "Blocked: SQL is not a safe SELECT statement.")
+    validation = validation_cache.validate(sql)
+    if not validation.local_ok:
+        return _export_error(400, validation.error)
+    ok, msg = await _preflight(sql)
+    if not ok:
+        return _export_error(400, f"Preflight failed: {msg}")
+
+    if COST_GUARD_ENABLED:
+        decision = await _cost_check(sql, EXPORT_CHUNK_ROWS)
+        if decision is not None and decision.reject:
+            return _export_error(400, f"Blocked by cost guard: {decision.to_dict()['reason']}")
+
+    max_rows = req.max_rows if req.max_rows is not None else EXPORT_MAX_ROWS
+    ext = "arrows" if fmt == "arrow" else fmt
+    return StreamingResponse(
+        _export_stream(sql, fmt, max(0, max_rows)),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="export.{ext}"'},
+    )
+
+
+# ---------------------------------------------------------
+# Few-shot examples
+# ---------------------------------------------------------
+
+class ExampleReq(BaseModel):
+    question: str
+    sql: str
+    explanation: str = ""
+
+
+@app.post("/examples")
+def add_example(req: ExampleReq):
+    """Add a vetted question → SQL pair to the few-shot example bank."""
+    if not is_safe_select(req.sql):
+        return {"ok": False, "error": "Example SQL is not a safe SELECT statement."}
+    ex = example_store.add(req.question, req.sql, req.explanation)
+    return {"ok": True, "id": ex.id, "examples": len(example_store)}
+
+
 # ---------------------------------------------------------
 # Health Check
 # ---------------------------------------------------------
@@ -183,3 +699,19 @@ def chat_sql(req: ChatSqlReq):
 @app.get("/")
 def health():
     return {"ok": True, "message": "SQL Chat Assistant is running."}
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "llm": llm_metrics(),
+        "streaming": stream_metrics(),
+        "sql_cache": sql_cache.metrics(),
+        "single_flight": chat_flight.metrics(),
+        "local_repair": local_repair_metrics(),
+        "validation_cache": validation_cache.metrics(),
+        "result_cache": result_cache.metrics(),
+        "semantic_check": semantic_check_metrics(),
+        "preflight_batches": preflight_batcher.metrics(),
+        "db_pools": pool_metrics(),
+    }
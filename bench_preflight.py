@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Preflight benchmark: one sp_describe_first_result_set round trip per
+statement ('serial') vs. TRY/CATCH batches of many statements ('batched').
+
+Uses the gold_sql of every record in the gold set, optionally with
+broken copies mixed in (--broken) to show that one failing statement
+doesn't abort the rest of its batch. The validation cache is bypassed,
+so every run really goes to SQL Server.
+
+    python bench_preflight.py --input gold_eval.json --batch-size 32 --repeat 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sql_validator import server_preflight, server_preflight_many
+
+
+Outcome = Tuple[bool, str, List[Dict]]
+
+
+def load_statements(path: Path, broken: bool) -> List[str]:
+    with path.open("r", encoding="utf-8") as f:
+        records = json.load(f)
+    sqls = [r["gold_sql"].strip() for r in records if r.get("gold_sql")]
+    if broken:
+        # Same statements with an unknown column: must fail individually
+        sqls += [s.replace("SELECT", "SELECT NoSuchColumn,", 1) for s in sqls]
+    return sqls
+
+
+def run_serial(sqls: List[str]) -> Tuple[float, int, List[Outcome]]:
+    t0 = time.perf_counter()
+    outcomes = [server_preflight(s) for s in sqls]
+    return time.perf_counter() - t0, len(sqls), outcomes
+
+
+def run_batched(sqls: List[str], batch_size: int) -> Tuple[float, int, List[Outcome]]:
+    t0 = time.perf_counter()
+    outcomes: List[Outcome] = []
+    round_trips = 0
+    for start in range(0, len(sqls), batch_size):
+        outcomes += server_preflight_many(sqls[start:start + batch_size])
+        round_trips += 1
+    return time.perf_counter() - t0, round_trips, outcomes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark serial vs. batched preflight.")
+    parser.add_argument("--input", type=str, default="gold_eval.json", help="Gold JSON file.")
+    parser.add_argument("--batch-size", type=int, default=32, help="Statements per batch.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per mode.")
+    parser.add_argument(
+        "--broken",
+        action="store_true",
+        help="Also preflight a broken copy of every statement.",
+    )
+    args = parser.parse_args()
+
+    sqls = load_statements(Path(args.input), args.broken)
+    print(f"Preflighting {len(sqls)} statements, x{args.repeat} per mode ...")
+
+    # Warm up the pool / SQL Server plan cache so neither mode pays for it
+    server_preflight(sqls[0])
+
+    serial = [run_serial(sqls) for _ in range(args.repeat)]
+    batched = [run_batched(sqls, args.batch_size) for _ in range(args.repeat)]
+
+    # Same verdict per statement either way
+    same = all(
+        a[0] == b[0]
+        for a, b in zip(serial[-1][2], batched[-1][2])
+    ) and all(
+        a[2] == b[2]
+        for a, b in zip(serial[-1][2], batched[-1][2])
+        if a[0]
+    )
+    ok = sum(1 for o in batched[-1][2] if o[0])
+
+    print("\n=== Preflight benchmark ===")
+    print(f"Statements:   {len(sqls)}  (ok {ok}, failed {len(sqls) - ok})")
+    for name, runs in (("serial", serial), ("batched", batched)):
+        timings = [r[0] for r in runs]
+        print(
+            f"{name:>8}: {runs[0][1]:4d} round trips  "
+            f"median {statistics.median(timings):8.3f}s  "
+            f"per stmt {statistics.median(timings) / len(sqls) * 1000:7.2f}ms"
+        )
+    speedup = statistics.median(r[0] for r in serial) / statistics.median(r[0] for r in batched)
+    print(f"Speedup (serial / batched): {speedup:.1f}x")
+    print(f"Same outcomes:              {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+Startup-time benchmark: per-table inspector introspection ('live') vs.
+set-based catalog-view introspection ('bulk').
+
+Creates a throwaway schema with N synthetic tables (each with a FK to the
+previous one), times SchemaService construction with both sources, checks
+that they build the same catalog, then drops the schema again.
+
+    python bench_schema_load.py --tables 3000 --columns 12 --repeat 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import text
+
+from db import engine
+from schema_service import SchemaService
+
+
+BENCH_SCHEMA = "sqlassist_bench"
+DDL_CHUNK = 200
+
+
+def _table_name(i: int) -> str:
+    return f"BenchTable{i:05d}"
+
+
+def create_bench_schema(n_tables: int, n_columns: int) -> None:
+    stmts: List[str] = []
+    for i in range(n_tables):
+        cols = ["[Id] int NOT NULL PRIMARY KEY"]
+        cols += [f"[Col{c:03d}] nvarchar(50) NULL" for c in range(n_columns)]
+        if i > 0:
+            cols.append(
+                f"[ParentId] int NULL REFERENCES [{BENCH_SCHEMA}].[{_table_name(i - 1)}] ([Id])"
+            )
+        stmts.append(
+            f"CREATE TABLE [{BENCH_SCHEMA}].[{_table_name(i)}] ({', '.join(cols)});"
+        )
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"CREATE SCHEMA [{BENCH_SCHEMA}]")
+    for start in range(0, len(stmts), DDL_CHUNK):
+        with engine.begin() as conn:
+            conn.exec_driver_sql("\n".join(stmts[start:start + DDL_CHUNK]))
+
+
+def drop_bench_schema() -> None:
+    with engine.connect() as conn:
+        names = [
+            r[0] for r in conn.execute(
+                text(
+                    "SELECT t.name FROM sys.tables t "
+                    "WHERE t.schema_id = SCHEMA_ID(:s) ORDER BY t.name DESC"
+                ),
+                {"s": BENCH_SCHEMA},
+            )
+        ]
+    # Reverse creation order so each table's referencing table is gone first
+    for start in range(0, len(names), DDL_CHUNK):
+        chunk = names[start:start + DDL_CHUNK]
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "\n".join(f"DROP TABLE [{BENCH_SCHEMA}].[{n}];" for n in chunk)
+            )
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            f"IF SCHEMA_ID('{BENCH_SCHEMA}') IS NOT NULL DROP SCHEMA [{BENCH_SCHEMA}]"
+        )
+
+
+def time_source(source: str, n_tables: int, repeat: int) -> tuple[list[float], SchemaService]:
+    timings: List[float] = []
+    svc = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        svc = SchemaService(engine, source=source, schema=BENCH_SCHEMA, max_tables=n_tables)
+        timings.append(time.perf_counter() - t0)
+    return timings, svc
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark schema catalog loading.")
+    parser.add_argument("--tables", type=int, default=2000, help="Synthetic tables to create.")
+    parser.add_argument("--columns", type=int, default=10, help="Extra columns per table.")
+    parser.add_argument("--repeat", type=int, default=3, help="Loads per source.")
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help=f"Keep the [{BENCH_SCHEMA}] schema afterwards (skip setup if it exists).",
+    )
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        exists = conn.execute(
+            text("SELECT SCHEMA_ID(:s)"), {"s": BENCH_SCHEMA}
+        ).scalar() is not None
+
+    if not exists:
+        print(f"Creating {args.tables} tables in [{BENCH_SCHEMA}] ...")
+        create_bench_schema(args.tables, args.columns)
+
+    try:
+        results = {}
+        for source in ("bulk", "live"):
+            print(f"Loading catalog with source={source!r} x{args.repeat} ...")
+            results[source] = time_source(source, args.tables, args.repeat)
+
+        bulk_svc = results["bulk"][1]
+        live_svc = results["live"][1]
+        same = (
+            bulk_svc.tables == live_svc.tables
+            and bulk_svc.cols_by_table == live_svc.cols_by_table
+            and bulk_svc.col_nullable == live_svc.col_nullable
+            and bulk_svc.fk_pairs == live_svc.fk_pairs
+        )
+
+        print("\n=== Schema load benchmark ===")
+        print(f"Tables:  {len(bulk_svc.tables)}")
+        print(f"Columns: {sum(len(c) for c in bulk_svc.cols_by_table.values())}")
+        print(f"FK pairs: {len(bulk_svc.fk_pairs)}")
+        for source, (timings, _) in results.items():
+            print(
+                f"{source:>5}: median {statistics.median(timings):8.3f}s  "
+                f"min {min(timings):8.3f}s  max {max(timings):8.3f}s"
+            )
+        speedup = statistics.median(results["live"][0]) / statistics.median(results["bulk"][0])
+        print(f"Speedup (live / bulk): {speedup:.1f}x")
+        print(f"Catalogs identical:    {same}")
+    finally:
+        if not args.keep:
+            print(f"\nDropping [{BENCH_SCHEMA}] ...")
+            drop_bench_schema()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,172 @@ LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")  # 'openai' or 'local'
 LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4.1-mini")
 LLM_ENDPOINT = os.getenv("LLM_ENDPOINT", "http://localhost:8001/v1/chat/completions")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+# Local HTTP backend transport: keep-alive pool size, max concurrent requests
+# on the LLM server (others queue), and total deadline per request (seconds).
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "16"))
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", "120"))
+# Stream completions in the async pipeline and stop as soon as the SQL is
+# complete (skips generating the "explanation" field).
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+
+# Multi-candidate generation: ask for N SQL candidates at once (n= on
+# OpenAI, parallel calls on the local backend), validate them concurrently
+# and keep the first one that passes (1 = single generation + repair).
+GENERATION_CANDIDATES = int(os.getenv("GENERATION_CANDIDATES", "1"))
+CANDIDATE_TEMPERATURE = float(os.getenv("CANDIDATE_TEMPERATURE", "0.7"))
+
+# Few-shot examples: the FEW_SHOT_K examples closest to the question that
+# fit in FEW_SHOT_TOKEN_BUDGET, from a bank seeded with these JSON files
+# (relative to the repo root).
+FEW_SHOT_K = int(os.getenv("FEW_SHOT_K", "3"))
+FEW_SHOT_TOKEN_BUDGET = int(os.getenv("FEW_SHOT_TOKEN_BUDGET", "600"))
+FEW_SHOT_SEED_FILES = [
+    p.strip()
+    for p in os.getenv("FEW_SHOT_SEED_FILES", "few_shot_examples.json,gold_eval.json").split(",")
+    if p.strip()
+]
+
+# Question → SQL cache in front of generation. Only validated SQL is
+# stored; entries expire after the TTL (seconds) and on schema change. The
+# similarity tier also reuses SQL for reworded questions whose char-trigram
+# TF-IDF cosine similarity is at least the threshold and whose content words
+# (all but filler words, negations included) are the same.
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000"))
+SQL_CACHE_TTL_SECONDS = float(os.getenv("SQL_CACHE_TTL_SECONDS", "86400"))
+SQL_CACHE_SIMILARITY = os.getenv("SQL_CACHE_SIMILARITY", "false").lower() == "true"
+SQL_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("SQL_CACHE_SIMILARITY_THRESHOLD", "0.8"))
+
+# Named DB connection pools (db.py): each has its own engine, worker threads
+# and session settings, so a slow query can't starve preflights.
+#   preflight   = compile-only preflight, estimated plans, metadata probes
+#   interactive = /chat_sql execution
+#   batch       = /chat_sql/batch execution, /export, eval
+# Per pool, DB_POOL_<NAME>_...:
+#   SIZE / MAX_OVERFLOW    = connections kept / extra under load
+#   TIMEOUT                = seconds to wait for a free connection
+#   ISOLATION              = '' (server default) | read_committed | read_uncommitted | snapshot
+#   LOCK_TIMEOUT_MS        = SET LOCK_TIMEOUT (-1 = wait indefinitely)
+def _db_pool(name: str, size: int, max_overflow: int, timeout: float, isolation: str, lock_timeout_ms: int) -> dict:
+    prefix = f"DB_POOL_{name.upper()}_"
+    return {
+        "size": int(os.getenv(prefix + "SIZE", str(size))),
+        "max_overflow": int(os.getenv(prefix + "MAX_OVERFLOW", str(max_overflow))),
+        "timeout": float(os.getenv(prefix + "TIMEOUT", str(timeout))),
+        "isolation": os.getenv(prefix + "ISOLATION", isolation).lower(),
+        "lock_timeout_ms": int(os.getenv(prefix + "LOCK_TIMEOUT_MS", str(lock_timeout_ms))),
+    }
+
+
+DB_POOLS = {
+    "preflight": _db_pool("preflight", 4, 4, 5, "", 5000),
+    "interactive": _db_pool("interactive", 8, 8, 10, "", -1),
+    "batch": _db_pool("batch", 4, 4, 60, "", -1),
+}
+# Engine used for schema introspection, fingerprints and scripts (db.engine)
+DB_POOL_DEFAULT_SIZE = int(os.getenv("DB_POOL_DEFAULT_SIZE", "5"))
+DB_POOL_DEFAULT_MAX_OVERFLOW = int(os.getenv("DB_POOL_DEFAULT_MAX_OVERFLOW", "10"))
+DB_POOL_DEFAULT_TIMEOUT = float(os.getenv("DB_POOL_DEFAULT_TIMEOUT", "30"))
+# Every pooled connection starts with SET NOCOUNT ON (SQL Server only)
+DB_SESSION_NOCOUNT = os.getenv("DB_SESSION_NOCOUNT", "true").lower() == "true"
+# Pre-ping costs a round trip per checkout; recycling old connections
+# instead catches most dead ones (0 = never recycle). Off by default,
+# including for db.engine, which used to pre-ping every checkout.
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+# Optional read-only replica: the pools in DB_READ_REPLICA_POOLS connect
+# there instead of DATABASE_URL
+DB_READ_REPLICA_URL = os.getenv("DB_READ_REPLICA_URL", "")
+DB_READ_REPLICA_POOLS = [
+    p.strip() for p in os.getenv("DB_READ_REPLICA_POOLS", "interactive,batch").split(",") if p.strip()
+]
+
+# /chat_sql/batch: max items in the LLM stage (generation / repair) and in
+# the DB stage (preflight / execution) at once, across all batch requests
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", "4"))
+
+# Parsed SQL structures kept in the sql_parser LRU cache
+SQL_PARSE_CACHE_SIZE = int(os.getenv("SQL_PARSE_CACHE_SIZE", "1024"))
+
+# Validation outcomes (local checks + preflight result-set shape) cached per
+# normalized SQL and schema fingerprint; 0 disables the cache
+VALIDATION_CACHE_MAX_ENTRIES = int(os.getenv("VALIDATION_CACHE_MAX_ENTRIES", "4096"))
+
+# Static semantic check (semantic_check.py) before preflight: SQL it can
+# fully judge skips the SQL Server round trip, only "unsure" SQL is sent
+LOCAL_SEMANTIC_CHECK = os.getenv("LOCAL_SEMANTIC_CHECK", "true").lower() == "true"
+
+# Concurrent preflights arriving within the window are sent to SQL Server as
+# one TRY/CATCH batch of up to PREFLIGHT_BATCH_SIZE statements (window 0 = off)
+PREFLIGHT_BATCH_SIZE = int(os.getenv("PREFLIGHT_BATCH_SIZE", "32"))
+PREFLIGHT_BATCH_WINDOW_MS = float(os.getenv("PREFLIGHT_BATCH_WINDOW_MS", "5"))
+
+# Estimated-cost guard before execute=true runs a query (SHOWPLAN_XML):
+# reject at REJECT_COST, run on the low-priority path (LOW_PRIORITY_CONCURRENCY
+# queries at once) at LOW_PRIORITY_COST or when MAX_LARGE_SCANS tables of at
+# least LARGE_TABLE_ROWS rows are scanned, add TOP (max_rows + 1) at TOP_ROWS
+# estimated rows. 0 disables a threshold.
+COST_GUARD_ENABLED = os.getenv("COST_GUARD_ENABLED", "false").lower() == "true"
+COST_GUARD_REJECT_COST = float(os.getenv("COST_GUARD_REJECT_COST", "500"))
+COST_GUARD_LOW_PRIORITY_COST = float(os.getenv("COST_GUARD_LOW_PRIORITY_COST", "50"))
+COST_GUARD_TOP_ROWS = float(os.getenv("COST_GUARD_TOP_ROWS", "100000"))
+COST_GUARD_LARGE_TABLE_ROWS = float(os.getenv("COST_GUARD_LARGE_TABLE_ROWS", "1000000"))
+COST_GUARD_MAX_LARGE_SCANS = int(os.getenv("COST_GUARD_MAX_LARGE_SCANS", "2"))
+COST_GUARD_LOW_PRIORITY_CONCURRENCY = int(os.getenv("COST_GUARD_LOW_PRIORITY_CONCURRENCY", "1"))
+
+# Executed results (the row-limited preview) cached per normalized SQL, as
+# columns. Entries expire after TTL_SECONDS and are evicted LRU beyond
+# MAX_BYTES. RESULT_CACHE_INVALIDATION also drops them after a warehouse load:
+#   'ttl'        = TTL only
+#   'load_probe' = LOAD_PROBE_SQL returns a value that changes with every load
+#                  (e.g. SELECT MAX(LoadCompletedAt) FROM etl.LoadLog)
+#   'table_changes' = row count + last insert/update/delete time of each table
+#                  the query reads (partition stats + index usage stats)
+# The probe runs at most every PROBE_SECONDS (0 = before every lookup), so
+# results can stay stale for up to PROBE_SECONDS after a load.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "false").lower() == "true"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+RESULT_CACHE_INVALIDATION = os.getenv("RESULT_CACHE_INVALIDATION", "ttl").lower()
+RESULT_CACHE_LOAD_PROBE_SQL = os.getenv("RESULT_CACHE_LOAD_PROBE_SQL", "")
+RESULT_CACHE_PROBE_SECONDS = float(os.getenv("RESULT_CACHE_PROBE_SECONDS", "60"))
+
+# POST /export streams full results EXPORT_CHUNK_ROWS rows at a time;
+# at most EXPORT_CONCURRENCY exports hold a DB connection at once.
+# EXPORT_MAX_ROWS caps rows per export (0 = no cap).
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "0"))
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "2"))
+
+# /export only runs SQL that /chat_sql returned, proven by the
+# export_token it signs with this key (HMAC-SHA256). Unset = a random key
+# per process: tokens then don't survive a restart or work across workers.
+EXPORT_SIGNING_KEY = os.getenv("EXPORT_SIGNING_KEY", "")
 
 # Misc
 MAX_SCHEMA_TABLES = int(os.getenv("MAX_SCHEMA_TABLES", "80"))
 MAX_SCHEMA_COLS_PER_TABLE = int(os.getenv("MAX_SCHEMA_COLS_PER_TABLE", "80"))
 STRICT_PREFLIGHT = os.getenv("STRICT_PREFLIGHT", "true").lower() == "true"
+
+# Schema catalog
+# 'live' = introspect the DB via SQLAlchemy (round trips per table),
+# 'bulk' = read the sys.* catalog views in two set-based queries,
+# 'ddl'  = compile the CREATE TABLE / FOREIGN KEY scripts in SCHEMA_DDL_DIR
+#          (no DB round trips at startup).
+SCHEMA_SOURCE = os.getenv("SCHEMA_SOURCE", "live").lower()
+SCHEMA_DDL_DIR = os.getenv("SCHEMA_DDL_DIR", os.path.join(os.path.dirname(__file__), "data"))
+# When loading from DDL, compare against the live catalog in the background
+# and log any drift.
+SCHEMA_DRIFT_CHECK = os.getenv("SCHEMA_DRIFT_CHECK", "false").lower() == "true"
+# Compiled catalog is persisted here and reused on the next start if the
+# schema fingerprint still matches (empty = no snapshot).
+SCHEMA_SNAPSHOT_PATH = os.getenv("SCHEMA_SNAPSHOT_PATH", ".schema_snapshot.json")
+# How often to re-check the schema fingerprint and hot-reload (0 = never).
+SCHEMA_REFRESH_SECONDS = float(os.getenv("SCHEMA_REFRESH_SECONDS", "60"))
+
+# Schema pruning: send only the tables relevant to the question (plus FK
+# bridge tables) to the LLM instead of the whole schema_text.
+SCHEMA_PRUNING = os.getenv("SCHEMA_PRUNING", "false").lower() == "true"
+SCHEMA_PRUNE_TOP_K = int(os.getenv("SCHEMA_PRUNE_TOP_K", "4"))
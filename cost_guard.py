@@ -0,0 +1,173 @@
+# cost_guard.py
+
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from config import (
+    COST_GUARD_REJECT_COST,
+    COST_GUARD_LOW_PRIORITY_COST,
+    COST_GUARD_TOP_ROWS,
+    COST_GUARD_LARGE_TABLE_ROWS,
+    COST_GUARD_MAX_LARGE_SCANS,
+)
+from db import estimated_plan
+from sql_parser import parse_sql
+
+
+SHOWPLAN_NS = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+
+# Physical operators that read a whole table / index
+SCAN_OPS = {
+    "Table Scan", "Clustered Index Scan", "Index Scan",
+    "Columnstore Index Scan", "Clustered Columnstore Index Scan",
+}
+
+
+# ---------------------------------------------------------
+# 1) Plan estimate
+# ---------------------------------------------------------
+
+@dataclass
+class PlanEstimate:
+    cost: float  # estimated subtree cost of the statement
+    rows: float  # estimated rows returned
+    large_scans: List[str] = field(default_factory=list)  # scanned tables >= COST_GUARD_LARGE_TABLE_ROWS
+
+
+def _float(value: Optional[str]) -> float:
+    try:
+        return float(value) if value is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+def parse_showplan(xml: str, large_table_rows: float = COST_GUARD_LARGE_TABLE_ROWS) -> PlanEstimate:
+    """
+    Read the estimate out of SHOWPLAN_XML: StatementSubTreeCost and
+    StatementEstRows of the (last) statement, plus every scan operator
+    over a table with at least `large_table_rows` rows.
+    """
+    root = ET.fromstring(xml)
+    stmts = list(root.iter(f"{SHOWPLAN_NS}StmtSimple"))
+    if not stmts:
+        raise ValueError("showplan has no statement")
+    stmt = stmts[-1]
+
+    large: List[str] = []
+    for op in stmt.iter(f"{SHOWPLAN_NS}RelOp"):
+        if op.get("PhysicalOp") not in SCAN_OPS:
+            continue
+        rows = _float(op.get("TableCardinality")) or _float(op.get("EstimatedRowsRead"))
+        if rows < large_table_rows:
+            continue
+        obj = next(op.iter(f"{SHOWPLAN_NS}Object"), None)
+        if obj is not None:
+            table = (obj.get("Table") or "?").strip("[]")
+            if table not in large:
+                large.append(table)
+
+    return PlanEstimate(
+        cost=_float(stmt.get("StatementSubTreeCost")),
+        rows=_float(stmt.get("StatementEstRows")),
+        large_scans=large,
+    )
+
+
+def estimate_cost(sql: str) -> PlanEstimate:
+    """Blocking: fetch the estimated plan from SQL Server and parse it."""
+    return parse_showplan(estimated_plan(sql))
+
+
+# ---------------------------------------------------------
+# 2) Decision
+# ---------------------------------------------------------
+
+@dataclass
+class CostDecision:
+    estimate: PlanEstimate
+    reject: bool = False
+    low_priority: bool = False
+    top: Optional[int] = None  # TOP (n) added to the executed SQL
+    reasons: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        """What ChatSqlResp.cost_estimate carries."""
+        actions = [name for name, on in (
+            ("reject", self.reject),
+            ("low_priority", self.low_priority),
+            ("top", self.top is not None),
+        ) if on]
+        return {
+            "cost": round(self.estimate.cost, 4),
+            "rows": self.estimate.rows,
+            "large_scans": self.estimate.large_scans,
+            "actions": actions,
+            "reason": "; ".join(self.reasons),
+        }
+
+
+def add_top(sql: str, n: int) -> Optional[str]:
+    """
+    Insert TOP (n) after the outer SELECT [ALL | DISTINCT]. None if the
+    query already has a TOP there, pages with OFFSET ... FETCH (which
+    can't be combined with TOP), or is a set operation (UNION, ...)
+    where a single TOP wouldn't cap the result.
+    """
+    parsed = parse_sql(sql)
+    if any(c in ("UNION", "EXCEPT", "INTERSECT") for c, _ in parsed.clauses):
+        return None
+    toks = parsed.tokens
+    if any(t.depth == 0 and t.upper in ("OFFSET", "FETCH") for t in toks):
+        return None
+    idx = next(
+        (i for i, t in enumerate(toks) if t.depth == 0 and t.upper == "SELECT"),
+        None,
+    )
+    if idx is None:
+        return None
+    after = idx + 1
+    if after < len(toks) and toks[after].upper in ("ALL", "DISTINCT"):
+        after += 1
+    if after < len(toks) and toks[after].upper == "TOP":
+        return None
+    at = toks[after - 1].end
+    return sql[:at] + f" TOP ({n})" + sql[at:]
+
+
+def decide(
+    sql: str,
+    estimate: PlanEstimate,
+    max_rows: int,
+    reject_cost: float = COST_GUARD_REJECT_COST,
+    low_priority_cost: float = COST_GUARD_LOW_PRIORITY_COST,
+    top_rows: float = COST_GUARD_TOP_ROWS,
+    max_large_scans: int = COST_GUARD_MAX_LARGE_SCANS,
+) -> CostDecision:
+    """
+    Thresholds, most severe first:
+      - cost >= reject_cost                    -> reject
+      - cost >= low_priority_cost, or at least
+        max_large_scans large-table scans      -> low-priority execution
+      - estimated rows >= top_rows             -> add TOP (max_rows + 1);
+        the preview never shows more rows anyway
+    """
+    d = CostDecision(estimate=estimate)
+    if reject_cost > 0 and estimate.cost >= reject_cost:
+        d.reject = True
+        d.reasons.append(f"estimated cost {estimate.cost:g} >= {reject_cost:g}")
+        return d
+
+    if low_priority_cost > 0 and estimate.cost >= low_priority_cost:
+        d.low_priority = True
+        d.reasons.append(f"estimated cost {estimate.cost:g} >= {low_priority_cost:g}")
+    if max_large_scans > 0 and len(estimate.large_scans) >= max_large_scans:
+        d.low_priority = True
+        d.reasons.append(f"scans {len(estimate.large_scans)} large tables ({', '.join(estimate.large_scans)})")
+
+    if top_rows > 0 and estimate.rows >= top_rows:
+        # max_rows + 1 so the preview can still tell it was truncated
+        if add_top(sql, max_rows + 1) is not None:
+            d.top = max_rows + 1
+            d.reasons.append(f"estimated {estimate.rows:g} rows >= {top_rows:g}")
+    return d
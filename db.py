@@ -1,20 +1,476 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 import pandas as pd
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL,
+    DB_POOLS,
+    DB_POOL_DEFAULT_SIZE,
+    DB_POOL_DEFAULT_MAX_OVERFLOW,
+    DB_POOL_DEFAULT_TIMEOUT,
+    DB_SESSION_NOCOUNT,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_READ_REPLICA_URL,
+    DB_READ_REPLICA_POOLS,
+)
 
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set. Please configure it in your environment.")
 
 
-engine: Engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+def _pool_options(url: str, size: int, max_overflow: int, timeout: float) -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS if DB_POOL_RECYCLE_SECONDS > 0 else -1,
+    }
+    # SQLite (local smoke tests) doesn't use a sized QueuePool
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(pool_size=size, max_overflow=max_overflow, pool_timeout=timeout)
+    return options
+
+
+# Schema introspection, fingerprints, scripts
+engine: Engine = create_engine(
+    DATABASE_URL,
+    **_pool_options(DATABASE_URL, DB_POOL_DEFAULT_SIZE, DB_POOL_DEFAULT_MAX_OVERFLOW, DB_POOL_DEFAULT_TIMEOUT),
+)
+
+T = TypeVar("T")
+
+
+# ---------------------------------------------------------
+# Named pools
+# ---------------------------------------------------------
+
+ISOLATION_LEVELS = {
+    "read_committed": "READ COMMITTED",
+    "read_uncommitted": "READ UNCOMMITTED",
+    "snapshot": "SNAPSHOT",
+}
+
+
+class DbPool:
+    """
+    One named connection pool: its own engine (size / overflow / timeout),
+    a worker thread per connection, and session settings applied once to
+    every new connection (SET NOCOUNT ON, isolation level, LOCK_TIMEOUT).
+    Blocking DB work from async code runs on the pool's threads, so
+    hundreds of requests can wait on the LLM while only size + overflow
+    of them hold a connection of this pool at once.
+
+    Checkouts are timed, so /metrics can show how long work waited for a
+    connection in this pool.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        size: int,
+        max_overflow: int,
+        timeout: float,
+        isolation: str = "",
+        lock_timeout_ms: int = -1,
+    ):
+        if isolation and isolation not in ISOLATION_LEVELS:
+            raise ValueError(f"DB_POOL_{name.upper()}_ISOLATION must be one of {sorted(ISOLATION_LEVELS)}, got {isolation!r}")
+        self.name = name
+        self.replica = url != DATABASE_URL
+        self.engine: Engine = create_engine(url, **_pool_options(url, size, max_overflow, timeout))
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, size + max_overflow), thread_name_prefix=f"db-{name}"
+        )
+
+        self.session_sql: List[str] = []
+        if DB_SESSION_NOCOUNT:
+            self.session_sql.append("SET NOCOUNT ON")
+        if isolation:
+            self.session_sql.append(f"SET TRANSACTION ISOLATION LEVEL {ISOLATION_LEVELS[isolation]}")
+        if lock_timeout_ms >= 0:
+            self.session_sql.append(f"SET LOCK_TIMEOUT {int(lock_timeout_ms)}")
+        if self.session_sql and self.engine.dialect.name == "mssql":
+            event.listen(self.engine, "connect", self._init_session)
+
+        self._lock = threading.Lock()
+        self._waits: deque = deque(maxlen=1000)  # recent checkout waits (seconds)
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+
+    def _init_session(self, dbapi_conn: Any, _record: Any) -> None:
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute("; ".join(self.session_sql))
+        finally:
+            cursor.close()
+
+    def _timed(self, checkout: Callable[[], T]) -> T:
+        t0 = time.perf_counter()
+        try:
+            conn = checkout()
+        except PoolTimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise
+        waited = time.perf_counter() - t0
+        with self._lock:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._waits.append(waited)
+        return conn
+
+    def raw_connection(self) -> Any:
+        """Pooled DBAPI connection (close() returns it to the pool)."""
+        return self._timed(self.engine.raw_connection)
+
+    def connect(self) -> Connection:
+        """Pooled SQLAlchemy connection, for pandas / text() queries."""
+        return self._timed(self.engine.connect)
 
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run a blocking DB call on this pool's threads."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
 
-def run_query(sql: str) -> pd.DataFrame:
+    def metrics(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        with self._lock:
+            waits = sorted(self._waits)
+            out: Dict[str, Any] = {
+                "replica": self.replica,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_ms_avg": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_ms_p95": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 3) if waits else 0.0,
+                "wait_ms_max": round(waits[-1] * 1000, 3) if waits else 0.0,
+            }
+        for key in ("size", "checkedout", "overflow"):
+            fn = getattr(pool, key, None)
+            if fn is not None:
+                out[key] = fn()
+        return out
+
+
+pools: Dict[str, DbPool] = {
+    name: DbPool(
+        name,
+        DB_READ_REPLICA_URL if DB_READ_REPLICA_URL and name in DB_READ_REPLICA_POOLS else DATABASE_URL,
+        **settings,
+    )
+    for name, settings in DB_POOLS.items()
+}
+
+
+def pool_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: p.metrics() for name, p in pools.items()}
+
+
+async def run_in_pool(name: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking DB call on the threads of pools[name]."""
+    return await pools[name].run(fn, *args, **kwargs)
+
+
+# ---------------------------------------------------------
+# Queries
+# ---------------------------------------------------------
+
+def run_query(sql: str, pool: str = "batch") -> pd.DataFrame:
     """Run a SQL query and return a pandas DataFrame."""
-    with engine.connect() as conn:
+    with pools[pool].connect() as conn:
         df = pd.read_sql(text(sql), conn)
     return df
+
+
+def fetch_rows(sql: str, max_rows: int, pool: str = "interactive") -> Tuple[List[str], List[tuple], bool]:
+    """
+    Run `sql` and read at most max_rows + 1 rows with fetchmany, so only
+    what the caller shows crosses the wire (not the whole result through
+    pandas). If there are more, the statement is cancelled server-side.
+
+    Returns (column names, rows[:max_rows], truncated).
+    """
+    conn = pools[pool].raw_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            names = [d[0] for d in cursor.description]
+            rows = cursor.fetchmany(max_rows + 1)
+            truncated = len(rows) > max_rows
+            if truncated:
+                # pyodbc: SQLCancel stops the rest of the result being produced
+                cancel = getattr(cursor, "cancel", None)
+                if cancel is not None:
+                    cancel()
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+    return names, [tuple(r) for r in rows[:max_rows]], truncated
+
+
+class RowStream:
+    """
+    One query's result read chunk by chunk from an open cursor, for
+    results too large to hold in memory. The pooled connection stays
+    checked out until the stream is exhausted or closed.
+
+    Blocking; fetch() may run on any of the pool's threads, one at a time.
+    close() can be called while a fetch is in progress: it cancels the
+    statement first, then waits for the fetch to return.
+    """
+
+    def __init__(self, sql: str, max_rows: int = 0, pool: str = "batch"):
+        self.max_rows = max_rows  # 0 = no limit
+        self.rows_read = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._conn = pools[pool].raw_connection()
+        try:
+            self._cursor = self._conn.cursor()
+            self._cursor.execute(sql)
+            self.description = self._cursor.description
+        except Exception:
+            self._conn.close()
+            raise
+
+    def fetch(self, n: int) -> List[tuple]:
+        """Up to n more rows; [] once the result (or max_rows) is exhausted."""
+        with self._lock:
+            if self._closed:
+                return []
+            if self.max_rows:
+                n = min(n, self.max_rows - self.rows_read)
+            rows = self._cursor.fetchmany(n) if n > 0 else []
+            self.rows_read += len(rows)
+            done = not rows or (self.max_rows and self.rows_read >= self.max_rows)
+        if done:
+            self.close()
+        return [tuple(r) for r in rows]
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        # Stop the server producing the rest of the result (pyodbc SQLCancel)
+        cancel = getattr(self._cursor, "cancel", None)
+        if cancel is not None:
+            try:
+                cancel()
+            except Exception:
+                pass
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._cursor.close()
+            finally:
+                self._conn.close()
+
+
+def _param_marker() -> str:
+    return "?" if engine.dialect.paramstyle == "qmark" else "%s"
+
+
+def _result_columns(fields: List[str], rows: List[tuple]) -> List[Dict[str, Any]]:
+    """sp_describe_first_result_set rows -> [{"name", "type", "nullable"}, ...]."""
+    out = []
+    for row in rows:
+        rec = dict(zip(fields, row))
+        if rec.get("is_hidden"):
+            continue
+        out.append({
+            "name": rec["name"],
+            "type": rec["system_type_name"],
+            "nullable": bool(rec["is_nullable"]),
+        })
+    return out
+
+
+def describe_first_result_set(sql: str, pool: str = "preflight") -> List[Dict[str, Any]]:
+    """
+    Compile `sql` without running it (sp_describe_first_result_set) and
+    return its result-set shape: [{"name", "type", "nullable"}, ...].
+
+    Goes straight to a pooled DBAPI cursor with `sql` bound as the @tsql
+    parameter: no string-escaped DECLARE batch (the call is the same text
+    every time, so SQL Server can reuse its plan) and no DataFrame.
+    Compile errors are raised as the driver's exception.
+    """
+    conn = pools[pool].raw_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXEC sp_describe_first_result_set @tsql = {_param_marker()}", (sql,))
+            fields = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    finally:
+        # Back to the pool (rolled back), not closed
+        conn.close()
+
+    return _result_columns(fields, rows)
+
+
+# Per-statement error result inside a batch (the CATCH branch)
+BATCH_ERROR_FIELD = "preflight_error"
+
+
+def describe_first_result_sets(
+    sqls: List[str], pool: str = "preflight"
+) -> List[Tuple[bool, str, List[Dict[str, Any]]]]:
+    """
+    describe_first_result_set for many statements in ONE round trip.
+
+    Sends a single batch with one TRY/CATCH-wrapped
+    sp_describe_first_result_set call per statement, each bound as a
+    parameter, and reads exactly one result set per statement with
+    nextset(): the described columns, or the error the CATCH selected.
+    One statement failing doesn't abort the rest.
+
+    Returns [(ok, message, columns), ...] in input order. Errors that
+    abort the whole batch (connection loss, timeouts) are raised.
+    """
+    if not sqls:
+        return []
+
+    marker = _param_marker()
+    parts = ["SET NOCOUNT ON;"]
+    for _ in sqls:
+        parts.append(
+            f"BEGIN TRY EXEC sp_describe_first_result_set @tsql = {marker}; END TRY "
+            f"BEGIN CATCH SELECT CONCAT('Msg ', ERROR_NUMBER(), ': ', ERROR_MESSAGE()) "
+            f"AS {BATCH_ERROR_FIELD}; END CATCH;"
+        )
+    batch = "\n".join(parts)
+
+    results: List[Tuple[bool, str, List[Dict[str, Any]]]] = []
+    conn = pools[pool].raw_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(batch, tuple(sqls))
+            for i in range(len(sqls)):
+                if i > 0 and not cursor.nextset():
+                    raise RuntimeError(f"Preflight batch returned {i} result sets for {len(sqls)} statements")
+                fields = [d[0] for d in cursor.description]
+                rows = cursor.fetchall()
+                if fields == [BATCH_ERROR_FIELD]:
+                    results.append((False, str(rows[0][0]), []))
+                else:
+                    results.append((True, "ok", _result_columns(fields, rows)))
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+    return results
+
+
+def estimated_plan(sql: str, pool: str = "preflight") -> str:
+    """
+    Estimated execution plan XML for `sql` (SET SHOWPLAN_XML ON: the query
+    is compiled, not run). The connection is reset before it goes back to
+    the pool, or discarded if that fails.
+    """
+    conn = pools[pool].raw_connection()
+    clean = False
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET SHOWPLAN_XML ON")
+            try:
+                cursor.execute(sql)
+                row = cursor.fetchone()
+            finally:
+                cursor.execute("SET SHOWPLAN_XML OFF")
+                clean = True
+        finally:
+            cursor.close()
+    finally:
+        if not clean:
+            # Still in SHOWPLAN mode (or broken): don't hand it to the next query
+            conn.invalidate()
+        conn.close()
+
+    if row is None or row[0] is None:
+        raise RuntimeError("SHOWPLAN_XML returned no plan")
+    return str(row[0])
+
+
+def fetch_scalar(sql: str, pool: str = "preflight") -> Any:
+    """First column of the first row of `sql` (None if there are no rows)."""
+    conn = pools[pool].raw_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+    return None if row is None else row[0]
+
+
+TABLE_VERSIONS_SQL = """
+SELECT s.name AS schema_name, o.name AS table_name,
+       SUM(p.row_count) AS row_count, MAX(u.last_user_update) AS last_user_update
+FROM sys.objects o
+JOIN sys.schemas s ON s.schema_id = o.schema_id
+JOIN sys.dm_db_partition_stats p ON p.object_id = o.object_id AND p.index_id IN (0, 1)
+LEFT JOIN (
+    SELECT object_id, MAX(last_user_update) AS last_user_update
+    FROM sys.dm_db_index_usage_stats
+    WHERE database_id = DB_ID()
+    GROUP BY object_id
+) u ON u.object_id = o.object_id
+WHERE o.type = 'U'
+GROUP BY s.name, o.name
+"""
+
+
+def table_versions(pool: str = "preflight") -> Dict[str, Tuple[int, Optional[str]]]:
+    """
+    Change fingerprint of every user table: (row count, time of the last
+    insert / update / delete on any of its indexes), from
+    sys.dm_db_partition_stats and sys.dm_db_index_usage_stats (metadata
+    only, no table is read). Keyed by lower-cased bare table name and by
+    schema.table.
+
+    The usage stats are cleared when the database restarts or goes
+    offline; the last update then reads as None until the next write, so
+    a restart changes every fingerprint rather than hiding a change.
+    """
+    conn = pools[pool].raw_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(TABLE_VERSIONS_SQL)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+    versions: Dict[str, Tuple[int, Optional[str]]] = {}
+    for schema, table, count, updated in rows:
+        version = (int(count or 0), updated.isoformat() if updated is not None else None)
+        versions[f"{schema}.{table}".lower()] = version
+        versions.setdefault(table.lower(), version)
+    return versions
+
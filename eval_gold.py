@@ -5,25 +5,31 @@ from __future__ import annotations
 import argparse
 import json
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 
 # Load env like app.py
 load_dotenv()
 
-from sql_generator import generate_sql
+from sql_generator import generate_sql, build_generation_prompt
 from sql_validator import (
     is_safe_select,
+    extract_tables,
     has_unknown_tables,
     has_unknown_columns,
-    server_preflight_ok,
+    has_bad_join_keys,
+    describe_bad_joins,
 )
+from validation_cache import validation_cache
 from sql_rewriter import apply_column_mappings
 from repair_sql import repair_sql
 from db import run_query
 from config import STRICT_PREFLIGHT
 from sql_utils import extract_sql  # 🔑 NEW: use same extractor as app.py
+from llm import estimate_tokens
+from schema_service import schema_service
+from schema_retriever import get_retriever
 
 
 MAX_REPAIR_ATTEMPTS = 1
@@ -45,6 +51,20 @@ def execute_sql(sql: str) -> Tuple[bool, Any, str | None]:
         return False, None, str(ex)
 
 
+def _preflight(sql: str) -> Tuple[bool, str]:
+    """
+    Preflight through validation_cache: the local semantic check decides
+    what it can, reruns skip the DB.
+    """
+    if not STRICT_PREFLIGHT:
+        return True, "ok"
+    local = validation_cache.local_verdict(sql)
+    if local is not None:
+        return local
+    result = validation_cache.preflight(sql)
+    return result.preflight_ok, result.preflight_msg
+
+
 def compare_results(gold_df, model_df) -> bool:
     """
     Compare two result DataFrames.
@@ -80,10 +100,12 @@ def compare_results(gold_df, model_df) -> bool:
         return False
 
 
-def eval_one_record(rec: Dict[str, Any]) -> Dict[str, Any]:
+def eval_one_record(rec: Dict[str, Any], prune_schema: Optional[bool] = None) -> Dict[str, Any]:
     """
     Evaluate a single gold record against the current pipeline.
 
+    prune_schema is passed through to generate_sql (None = SCHEMA_PRUNING).
+
     Expected keys in rec (some may be missing initially):
       - id               (optional, for logging)
       - question         (required)
@@ -116,7 +138,8 @@ def eval_one_record(rec: Dict[str, Any]) -> Dict[str, Any]:
     # -----------------------------------------------------
     # 2) Generate model SQL from question
     # -----------------------------------------------------
-    model_sql_raw = generate_sql(question)
+    # The example bank is seeded from this gold set: hold this question out
+    model_sql_raw = generate_sql(question, prune_schema=prune_schema, exclude_examples=(question,))
     # 🔑 Normalize LLM output to bare SQL (strip fences, explanation, etc.)
     model_sql = extract_sql(model_sql_raw)
     rec["model_sql"] = model_sql
@@ -172,14 +195,19 @@ def eval_one_record(rec: Dict[str, Any]) -> Dict[str, Any]:
         return rec
 
     # -----------------------------------------------------
-    # 7) SQL Server preflight (compile-only) with repair loop
+    # 7) Join keys vs. FKs + SQL Server preflight, with repair loop
     # -----------------------------------------------------
-    ok, msg = server_preflight_ok(model_sql) if STRICT_PREFLIGHT else (True, "ok")
+    has_bad_joins, bad_joins = has_bad_join_keys(model_sql)
+    if has_bad_joins:
+        ok, msg = False, describe_bad_joins(bad_joins)
+        print("  ✗", msg)
+    else:
+        ok, msg = _preflight(model_sql)
     attempts = 0
 
     while not ok and attempts < MAX_REPAIR_ATTEMPTS:
         attempts += 1
-        print("  Preflight failed; attempting repair...")
+        print("  Validation failed; attempting repair...")
 
         repaired_raw = repair_sql(question, model_sql, msg)
         # 🔑 Normalize repaired SQL as well
@@ -205,7 +233,14 @@ def eval_one_record(rec: Dict[str, Any]) -> Dict[str, Any]:
         model_sql = repaired
         rec["model_sql"] = model_sql
         print("  Repair produced new SQL.")
-        ok, msg = server_preflight_ok(model_sql) if STRICT_PREFLIGHT else (True, "ok")
+
+        has_bad_joins, bad_joins = has_bad_join_keys(model_sql)
+        if has_bad_joins:
+            ok, msg = False, describe_bad_joins(bad_joins)
+            print("  ✗", msg)
+            continue
+
+        ok, msg = _preflight(model_sql)
 
     if not ok:
         rec["validated"] = False
@@ -249,6 +284,79 @@ def eval_one_record(rec: Dict[str, Any]) -> Dict[str, Any]:
     return rec
 
 
+def prompt_tokens(question: str, prune_schema: bool) -> int:
+    system, user = build_generation_prompt(question, prune_schema, exclude_examples=(question,))
+    return estimate_tokens(system) + estimate_tokens(user)
+
+
+def eval_schema_pruning(data: List[Dict[str, Any]], tokens_only: bool) -> Dict[str, Any]:
+    """
+    Compare the full-schema prompt with the pruned-schema prompt.
+
+    Always reports prompt tokens per question and whether the pruned
+    schema still contains every table the gold SQL uses (retrieval
+    recall). Unless tokens_only, also runs the full pipeline in both
+    modes and reports validation / execution / result-match accuracy.
+    """
+    retriever = get_retriever(schema_service.catalog)
+    rows: List[Dict[str, Any]] = []
+
+    for rec in data:
+        question = rec["question"]
+        gold_tables = sorted(extract_tables(rec["gold_sql"]) & schema_service.tables)
+        selected = retriever.select_tables(question)
+        row = {
+            "id": rec.get("id"),
+            "question": question,
+            "full_tokens": prompt_tokens(question, prune_schema=False),
+            "pruned_tokens": prompt_tokens(question, prune_schema=True),
+            "gold_tables": gold_tables,
+            "selected_tables": selected,
+            "missing_tables": [t for t in gold_tables if t not in selected],
+        }
+
+        if not tokens_only:
+            for mode, prune in (("full", False), ("pruned", True)):
+                result = eval_one_record(dict(rec), prune_schema=prune)
+                row[f"{mode}_validated"] = bool(result.get("validated"))
+                row[f"{mode}_exec_ok"] = bool(result.get("model_exec_ok"))
+                row[f"{mode}_result_match"] = bool(result.get("result_match"))
+                row[f"{mode}_sql"] = result.get("model_sql")
+
+        rows.append(row)
+
+    total = len(rows) or 1
+    full_avg = sum(r["full_tokens"] for r in rows) / total
+    pruned_avg = sum(r["pruned_tokens"] for r in rows) / total
+    summary: Dict[str, Any] = {
+        "records": len(rows),
+        "avg_full_prompt_tokens": round(full_avg, 1),
+        "avg_pruned_prompt_tokens": round(pruned_avg, 1),
+        "prompt_token_reduction_pct": round(100 * (1 - pruned_avg / full_avg), 1) if full_avg else 0.0,
+        "gold_table_recall": sum(1 for r in rows if not r["missing_tables"]),
+    }
+    if not tokens_only:
+        for mode in ("full", "pruned"):
+            for metric in ("validated", "exec_ok", "result_match"):
+                summary[f"{mode}_{metric}"] = sum(1 for r in rows if r[f"{mode}_{metric}"])
+
+    print("\n=== Schema pruning ===")
+    print(f"Total records:                {summary['records']}")
+    print(f"Avg prompt tokens (full):     {summary['avg_full_prompt_tokens']}")
+    print(f"Avg prompt tokens (pruned):   {summary['avg_pruned_prompt_tokens']}")
+    print(f"Prompt token reduction:       {summary['prompt_token_reduction_pct']}%")
+    print(f"Gold tables fully retrieved:  {summary['gold_table_recall']}")
+    for r in rows:
+        if r["missing_tables"]:
+            print(f"  ✗ ID {r['id']}: missing {', '.join(r['missing_tables'])}")
+    if not tokens_only:
+        print(f"{'':30}{'full':>8}{'pruned':>8}")
+        for metric in ("validated", "exec_ok", "result_match"):
+            print(f"{metric:30}{summary['full_' + metric]:>8}{summary['pruned_' + metric]:>8}")
+
+    return {"summary": summary, "records": rows}
+
+
 # ---------------------------------------------------------
 # Main CLI
 # ---------------------------------------------------------
@@ -264,13 +372,29 @@ def main() -> None:
     parser.add_argument(
         "--output",
         type=str,
-        default="gold_eval_results.json",
-        help="Path to output JSON file with updated records.",
+        default=None,
+        help="Path to output JSON file with updated records "
+             "(default: gold_eval_results.json, or gold_eval_schema_pruning.json "
+             "with --schema-pruning).",
+    )
+    parser.add_argument(
+        "--schema-pruning",
+        action="store_true",
+        help="Compare full vs. pruned schema prompts: prompt tokens and accuracy.",
+    )
+    parser.add_argument(
+        "--tokens-only",
+        action="store_true",
+        help="With --schema-pruning: only measure prompt tokens and table recall "
+             "(no LLM or DB calls).",
     )
 
     args = parser.parse_args()
     input_path = Path(args.input)
-    output_path = Path(args.output)
+    default_output = (
+        "gold_eval_schema_pruning.json" if args.schema_pruning else "gold_eval_results.json"
+    )
+    output_path = Path(args.output or default_output)
 
     if not input_path.exists():
         raise SystemExit(f"Input file not found: {input_path}")
@@ -282,6 +406,14 @@ def main() -> None:
     total = len(data)
     print(f"Loaded {total} records.")
 
+    if args.schema_pruning:
+        report = eval_schema_pruning(data, tokens_only=args.tokens_only)
+        print(f"\nWriting schema pruning report to {output_path} ...")
+        with output_path.open("w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print("Done.")
+        return
+
     updated: List[Dict[str, Any]] = []
     match_count = 0
     valid_count = 0
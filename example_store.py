@@ -0,0 +1,231 @@
+# example_store.py
+
+import itertools
+import json
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from config import FEW_SHOT_K, FEW_SHOT_TOKEN_BUDGET, FEW_SHOT_SEED_FILES
+from llm import estimate_tokens
+from sql_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+
+WORD_RE = re.compile(r"[a-z]+")
+
+# Words that say nothing about the query pattern
+STOPWORDS = {
+    "a", "an", "and", "the", "of", "for", "by", "in", "on", "to", "per", "with",
+    "what", "which", "is", "are", "me", "show", "list", "give",
+}
+
+
+def _tokens(question: str) -> List[str]:
+    """Unigrams + bigrams of the normalized question (numbers dropped)."""
+    words = [w for w in WORD_RE.findall(normalize_question(question)) if w not in STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+@dataclass
+class Example:
+    id: str
+    question: str
+    sql: str
+    explanation: str = ""
+
+    def render(self, number: int) -> str:
+        answer = {"sql": self.sql}
+        if self.explanation:
+            answer["explanation"] = self.explanation
+        return (
+            f"Example {number}\n"
+            f"Question: {self.question}\n"
+            f"Answer:\n{json.dumps(answer, indent=2)}"
+        )
+
+
+class ExampleStore:
+    """
+    Few-shot example bank for the generation prompt.
+
+    Seeded from curated examples and gold_eval.json (question + gold_sql),
+    extendable at runtime with add(). select() picks the examples closest
+    to a question (TF-IDF cosine over word uni/bigrams, through an
+    inverted index so cost follows the matching examples, not the bank
+    size) that fit a token budget.
+    """
+
+    def __init__(self):
+        self._examples: Dict[str, Example] = {}
+        self._by_question: Dict[str, str] = {}
+        self._tf: Dict[str, Counter] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._df: Counter = Counter()
+        self._ids = itertools.count(1)  # generated ids are never reused
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._examples)
+
+    # -----------------------------------------------------
+    # Loading / adding
+    # -----------------------------------------------------
+
+    def add(self, question: str, sql: str, explanation: str = "", id: Optional[str] = None) -> Example:
+        """
+        Add (or replace) an example. Examples are unique per normalized
+        question; the newer one wins. An explicit `id` also replaces the
+        example that had that id; without one a fresh "ex-N" id is used.
+        """
+        norm = normalize_question(question)
+        with self._lock:
+            old = self._by_question.get(norm)
+            if old is not None:
+                self._remove(old)
+
+            if id is None:
+                id = next(i for i in (f"ex-{n}" for n in self._ids) if i not in self._examples)
+            elif id in self._examples:
+                self._remove(id)
+            ex = Example(id=id, question=question, sql=sql.strip(), explanation=explanation)
+
+            tf = Counter(_tokens(question))
+            self._examples[ex.id] = ex
+            self._by_question[norm] = ex.id
+            self._tf[ex.id] = tf
+            for tok in tf:
+                self._df[tok] += 1
+                self._postings.setdefault(tok, set()).add(ex.id)
+            return ex
+
+    def _remove(self, ex_id: str) -> None:
+        ex = self._examples.pop(ex_id)
+        self._by_question.pop(normalize_question(ex.question), None)
+        for tok in self._tf.pop(ex_id):
+            self._df[tok] -= 1
+            if self._df[tok] <= 0:
+                del self._df[tok]
+            ids = self._postings.get(tok)
+            if ids is not None:
+                ids.discard(ex_id)
+                if not ids:
+                    del self._postings[tok]
+
+    def load_file(self, path: str) -> int:
+        """
+        Load examples from a JSON list. Accepts the example format
+        (question, sql, explanation) and gold_eval.json records
+        (question, gold_sql). Existing examples for the same question are
+        kept. Returns how many were added.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load examples from %s: %s", path, e)
+            return 0
+
+        added = 0
+        prefix = Path(path).stem
+        for i, rec in enumerate(records):
+            question = rec.get("question")
+            sql = rec.get("sql") or rec.get("gold_sql")
+            if not question or not sql:
+                continue
+            if normalize_question(question) in self._by_question:
+                continue
+            self.add(question, sql, rec.get("explanation", ""), id=str(rec.get("id") or f"{prefix}-{i + 1}"))
+            added += 1
+        return added
+
+    # -----------------------------------------------------
+    # Selection
+    # -----------------------------------------------------
+
+    def _weight(self, tok: str, count: int, n_docs: int) -> float:
+        idf = math.log((1 + n_docs) / (1 + self._df.get(tok, 0))) + 1.0
+        return (1.0 + math.log(count)) * idf
+
+    def ranked(self, question: str, exclude: Iterable[str] = ()) -> List[Example]:
+        """Examples sharing a token with the question, most similar first."""
+        skip = {normalize_question(q) for q in exclude}
+        q_tf = Counter(_tokens(question))
+
+        with self._lock:
+            n_docs = len(self._examples)
+            q_vec = {t: self._weight(t, c, n_docs) for t, c in q_tf.items()}
+            q_norm = math.sqrt(sum(w * w for w in q_vec.values())) or 1.0
+
+            candidates: Set[str] = set()
+            for tok in q_tf:
+                candidates.update(self._postings.get(tok, ()))
+
+            scored = []
+            for ex_id in candidates:
+                ex = self._examples[ex_id]
+                if normalize_question(ex.question) in skip:
+                    continue
+                d_vec = {t: self._weight(t, c, n_docs) for t, c in self._tf[ex_id].items()}
+                d_norm = math.sqrt(sum(w * w for w in d_vec.values())) or 1.0
+                dot = sum(w * d_vec.get(t, 0.0) for t, w in q_vec.items())
+                scored.append((-dot / (q_norm * d_norm), ex.id, ex))
+
+        scored.sort(key=lambda s: (s[0], s[1]))
+        return [ex for _, _, ex in scored]
+
+    def select(
+        self,
+        question: str,
+        k: int = FEW_SHOT_K,
+        token_budget: int = FEW_SHOT_TOKEN_BUDGET,
+        exclude: Iterable[str] = (),
+    ) -> List[Example]:
+        """
+        Up to k of the closest examples whose rendered text fits in
+        token_budget. The closest one is always included so the model
+        still sees the answer format. `exclude` holds questions to leave
+        out (the eval holds out the question under test).
+        """
+        ranked = self.ranked(question, exclude)
+        if not ranked:
+            # No overlap at all: fall back to the first examples in the bank
+            skip = {normalize_question(q) for q in exclude}
+            ranked = [ex for ex in self._examples.values() if normalize_question(ex.question) not in skip]
+
+        picked: List[Example] = []
+        used = 0
+        for ex in ranked:
+            if len(picked) >= k:
+                break
+            cost = estimate_tokens(ex.render(len(picked) + 1))
+            if picked and used + cost > token_budget:
+                continue
+            picked.append(ex)
+            used += cost
+        return picked
+
+
+def render_examples(examples: List[Example]) -> str:
+    return "\n\n".join(ex.render(i) for i, ex in enumerate(examples, 1))
+
+
+def _seeded_store() -> ExampleStore:
+    store = ExampleStore()
+    base = Path(__file__).resolve().parent
+    for name in FEW_SHOT_SEED_FILES:
+        path = Path(name)
+        if not path.is_absolute():
+            path = base / path
+        if path.exists():
+            store.load_file(str(path))
+    return store
+
+
+example_store = _seeded_store()
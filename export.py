@@ -0,0 +1,177 @@
+# export.py
+
+import csv
+import datetime as dt
+import decimal
+import hashlib
+import hmac
+import io
+import json
+import secrets
+from typing import Any, Dict, List, Optional, Sequence
+
+from config import EXPORT_SIGNING_KEY
+
+
+# format -> media type
+EXPORT_FORMATS: Dict[str, str] = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+# ---------------------------------------------------------
+# 1) Encoders: header, one chunk of rows, trailer -> bytes
+# ---------------------------------------------------------
+
+class Encoder:
+    """Turns a stream of row chunks into bytes, one piece per chunk."""
+
+    def __init__(self, description: Sequence[tuple]):
+        self.names = [d[0] for d in description]
+
+    def begin(self) -> bytes:
+        return b""
+
+    def encode(self, rows: List[tuple]) -> bytes:
+        raise NotImplementedError
+
+    def end(self) -> bytes:
+        return b""
+
+
+class CsvEncoder(Encoder):
+    def _write(self, rows: List[Sequence[Any]]) -> bytes:
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator="\n").writerows(rows)
+        return buf.getvalue().encode("utf-8")
+
+    def begin(self) -> bytes:
+        return self._write([self.names])
+
+    def encode(self, rows: List[tuple]) -> bytes:
+        return self._write(rows)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, decimal.Decimal):
+        return str(value)  # keep exact money / numeric values
+    if isinstance(value, (dt.datetime, dt.date, dt.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return str(value)
+
+
+class NdjsonEncoder(Encoder):
+    def encode(self, rows: List[tuple]) -> bytes:
+        lines = [
+            json.dumps(dict(zip(self.names, row)), default=_json_default, ensure_ascii=False)
+            for row in rows
+        ]
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class ArrowEncoder(Encoder):
+    """
+    Arrow IPC stream: the schema is derived from cursor.description
+    (DBAPI type codes are Python types for pyodbc), then one record batch
+    per chunk. Needs pyarrow.
+    """
+
+    def __init__(self, description: Sequence[tuple]):
+        super().__init__(description)
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise ImportError("pyarrow package is required for Arrow export. Install with 'pip install pyarrow'.") from e
+        self.pa = pa
+        self.schema = pa.schema([pa.field(d[0], self._arrow_type(d)) for d in description])
+        self._buf = io.BytesIO()
+        self._writer = None
+
+    def _arrow_type(self, d: tuple) -> Any:
+        pa = self.pa
+        type_code, precision, scale = d[1], d[4], d[5]
+        if type_code is bool:
+            return pa.bool_()
+        if type_code is int:
+            return pa.int64()
+        if type_code is float:
+            return pa.float64()
+        if type_code is decimal.Decimal and precision and precision <= 38:
+            return pa.decimal128(precision, scale or 0)
+        if type_code is dt.datetime:
+            return pa.timestamp("us")
+        if type_code is dt.date:
+            return pa.date32()
+        if type_code is dt.time:
+            return pa.time64("us")
+        if type_code in (bytes, bytearray):
+            return pa.binary()
+        return pa.string()
+
+    def _take(self) -> bytes:
+        data = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return data
+
+    def begin(self) -> bytes:
+        self._writer = self.pa.ipc.new_stream(self._buf, self.schema)
+        return self._take()
+
+    def encode(self, rows: List[tuple]) -> bytes:
+        pa = self.pa
+        arrays = []
+        for i, field in enumerate(self.schema):
+            col = [r[i] for r in rows]
+            if pa.types.is_string(field.type):
+                col = [None if v is None else str(v) for v in col]
+            arrays.append(pa.array(col, type=field.type))
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        return self._take()
+
+    def end(self) -> bytes:
+        self._writer.close()
+        return self._take()
+
+
+ENCODERS = {
+    "csv": CsvEncoder,
+    "ndjson": NdjsonEncoder,
+    "arrow": ArrowEncoder,
+}
+
+
+def make_encoder(fmt: str, description: Sequence[tuple]) -> Encoder:
+    """Encoder for one of EXPORT_FORMATS; ImportError if arrow lacks pyarrow."""
+    if fmt not in ENCODERS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {sorted(ENCODERS)}")
+    return ENCODERS[fmt](description)
+
+
+def arrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# ---------------------------------------------------------
+# 2) Export tokens: /export only runs SQL /chat_sql produced
+# ---------------------------------------------------------
+
+_SIGNING_KEY = EXPORT_SIGNING_KEY.encode("utf-8") or secrets.token_bytes(32)
+
+
+def sign_sql(sql: str) -> str:
+    """Export token for `sql` exactly as /chat_sql returned it."""
+    return hmac.new(_SIGNING_KEY, sql.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def verify_sql(sql: str, token: Optional[str]) -> bool:
+    """True if `token` is sign_sql(sql), i.e. this service produced `sql`."""
+    return bool(token) and hmac.compare_digest(sign_sql(sql), token)
@@ -0,0 +1,189 @@
+# join_graph.py
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from schema_catalog import SchemaCatalog
+
+
+@dataclass(frozen=True)
+class JoinStep:
+    """
+    One hop of a join chain:
+
+        JOIN <right_table> ON <left_table>.<left_column> = <right_table>.<right_column>
+
+    For composite keys, `columns` holds every (left_column, right_column)
+    pair of the FK.
+    """
+    left_table: str
+    right_table: str
+    columns: Tuple[Tuple[str, str], ...]
+
+    def __str__(self) -> str:
+        cond = " AND ".join(
+            f"{self.left_table}.{lc} = {self.right_table}.{rc}" for lc, rc in self.columns
+        )
+        return f"JOIN {self.right_table} ON {cond}"
+
+
+class JoinGraph:
+    """
+    The catalog's FK relationships compiled into an undirected table graph
+    with precomputed shortest join paths between every pair of tables.
+
+    Built once per catalog version (see SchemaService), so path lookups
+    and join-key checks at request time are dictionary reads.
+
+    Example:
+        graph.path("FactInternetSales", "DimProductCategory")
+        -> ["FactInternetSales", "DimProduct",
+            "DimProductSubcategory", "DimProductCategory"]
+    """
+
+    def __init__(self, catalog: SchemaCatalog):
+        self.catalog = catalog
+
+        # (table1, table2) -> {(column1, column2), ...}, both directions
+        self.edge_keys: Dict[Tuple[str, str], Set[Tuple[str, str]]] = {}
+        self.adjacency: Dict[str, List[str]] = {info.name: [] for info in catalog.iter_tables()}
+
+        for t1, c1, t2, c2 in catalog.fk_pairs:
+            if t1 == t2:
+                # self-references (parent keys) never bridge two tables
+                continue
+            keys = self.edge_keys.setdefault((t1, t2), set())
+            if not keys and t2 not in self.adjacency.setdefault(t1, []):
+                self.adjacency[t1].append(t2)
+            keys.add((c1, c2))
+
+        for neighbours in self.adjacency.values():
+            neighbours.sort()
+
+        # source -> {table: previous table on a shortest path from source}
+        self._prev: Dict[str, Dict[str, Optional[str]]] = {
+            t: self._bfs(t) for t in self.adjacency
+        }
+
+    def _bfs(self, source: str) -> Dict[str, Optional[str]]:
+        prev: Dict[str, Optional[str]] = {source: None}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for nxt in self.adjacency.get(node, ()):
+                if nxt not in prev:
+                    prev[nxt] = node
+                    queue.append(nxt)
+        return prev
+
+    # -----------------------------------------------------
+    # Paths
+    # -----------------------------------------------------
+
+    def _canonical(self, table: str) -> Optional[str]:
+        info = self.catalog.table(table)
+        return info.name if info is not None else None
+
+    def path(self, source: str, target: str) -> Optional[List[str]]:
+        """Shortest table path source → target (inclusive), or None."""
+        src, dst = self._canonical(source), self._canonical(target)
+        if src is None or dst is None:
+            return None
+        prev = self._prev.get(src, {src: None})
+        if dst not in prev:
+            return None
+
+        out: List[str] = []
+        node: Optional[str] = dst
+        while node is not None:
+            out.append(node)
+            node = prev[node]
+        out.reverse()
+        return out
+
+    def join_keys(self, left: str, right: str) -> Set[Tuple[str, str]]:
+        """FK column pairs (left_column, right_column) between two tables."""
+        return self.edge_keys.get((left, right), set())
+
+    def _step(self, left: str, right: str) -> JoinStep:
+        keys = self.edge_keys[(left, right)]
+        left_info = self.catalog.table(left)
+
+        # Several FKs between the same two tables (OrderDateKey / DueDateKey /
+        # ShipDateKey → DateKey): take the one declared first on the left.
+        def ordinal(pair: Tuple[str, str]) -> Tuple[int, Tuple[str, str]]:
+            col = left_info.column(pair[0]) if left_info is not None else None
+            return (col.ordinal if col is not None else 1 << 30, pair)
+
+        first = min(keys, key=ordinal)
+        # fk_pairs doesn't keep constraint boundaries: same-named pairs are
+        # taken as one composite key (SalesOrderNumber + SalesOrderLineNumber),
+        # anything else as an alternative FK.
+        columns = [first] + sorted(
+            p for p in keys if p != first and p[0] == p[1] and first[0] == first[1]
+        )
+        return JoinStep(left, right, tuple(columns))
+
+    def join_chain(self, tables: Iterable[str]) -> Tuple[List[JoinStep], List[str]]:
+        """
+        JOIN steps connecting all `tables`, starting from the first one.
+
+        Each remaining table is attached through the shortest path from
+        any table already in the chain, so bridge tables are added as
+        needed. Returns (steps, unreachable_tables).
+        """
+        wanted = [t for t in (self._canonical(t) for t in tables) if t is not None]
+        wanted = list(dict.fromkeys(wanted))
+        if not wanted:
+            return [], []
+
+        in_chain: List[str] = [wanted[0]]
+        steps: List[JoinStep] = []
+        unreachable: List[str] = []
+
+        for target in wanted[1:]:
+            if target in in_chain:
+                continue
+            best: Optional[List[str]] = None
+            for start in in_chain:
+                p = self.path(start, target)
+                if p is not None and (best is None or len(p) < len(best)):
+                    best = p
+            if best is None:
+                unreachable.append(target)
+                continue
+            for left, right in zip(best, best[1:]):
+                if right not in in_chain:
+                    steps.append(self._step(left, right))
+                    in_chain.append(right)
+
+        return steps, unreachable
+
+    # -----------------------------------------------------
+    # Join predicate checks
+    # -----------------------------------------------------
+
+    def is_fk_join(self, t1: str, c1: str, t2: str, c2: str) -> Optional[bool]:
+        """
+        Is `t1.c1 = t2.c2` a real FK join?
+
+          True  – the column pair is an FK between the two tables
+          False – the tables are FK-related, but through other columns
+                  (a wrong-key join)
+          None  – no FK between the tables; can't tell (e.g. joins on
+                  shared dimension keys between two facts)
+        """
+        a, b = self._canonical(t1), self._canonical(t2)
+        if a is None or b is None or a == b:
+            return None
+        keys = self.edge_keys.get((a, b))
+        if not keys:
+            return None
+
+        ca = self.catalog.column(a, c1)
+        cb = self.catalog.column(b, c2)
+        if ca is None or cb is None:
+            # unknown columns are reported by column validation
+            return None
+        return (ca.name, cb.name) in keys
@@ -1,24 +1,92 @@
+import asyncio
+import json
 import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List
 
-from config import LLM_PROVIDER, LLM_MODEL, LLM_ENDPOINT, OPENAI_API_KEY
+from config import (
+    LLM_PROVIDER,
+    LLM_MODEL,
+    LLM_ENDPOINT,
+    OPENAI_API_KEY,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_IN_FLIGHT,
+    LLM_REQUEST_DEADLINE,
+)
 
 class LLM(ABC):
     @abstractmethod
     def generate(self, system: str, messages: List[Dict]) -> str:
         ...
 
+    async def agenerate(self, system: str, messages: List[Dict], temperature: float = 0.1) -> str:
+        """
+        Async variant used by the async /chat_sql pipeline. Backends with a
+        native async client override this; the default runs generate() in
+        a worker thread so it never blocks the event loop.
+        """
+        return await asyncio.to_thread(self.generate, system, messages)
+
+    async def acandidates(
+        self,
+        system: str,
+        messages: List[Dict],
+        n: int,
+        temperature: float = 0.7,
+    ) -> AsyncIterator[str]:
+        """
+        n independent completions, yielded as each one finishes. Closing
+        the iterator early cancels the ones still running. The default
+        makes n parallel agenerate() calls; failed calls are skipped
+        unless all of them fail.
+        """
+        tasks = [
+            asyncio.ensure_future(self.agenerate(system, messages, temperature))
+            for _ in range(n)
+        ]
+        error: Exception | None = None
+        yielded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    content = await next_done
+                except Exception as ex:
+                    error = ex
+                    continue
+                yielded += 1
+                yield content
+            if not yielded and error is not None:
+                raise error
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def astream(self, system: str, messages: List[Dict]) -> AsyncIterator[str]:
+        """
+        Stream the completion as text chunks. Closing the iterator early
+        (aclose()) cancels the rest of the generation. Backends without
+        streaming yield the whole agenerate() result as one chunk.
+        """
+        yield await self.agenerate(system, messages)
+
+    def metrics(self) -> Dict:
+        """Backend-specific pool / queue metrics (empty if not tracked)."""
+        return {}
+
 # --- OpenAI backend ---
 
 class OpenAIBackend(LLM):
     def __init__(self, model: str, api_key: str | None):
         try:
-            from openai import OpenAI
+            from openai import OpenAI, AsyncOpenAI
         except ImportError as e:
             raise ImportError("openai package is required for OpenAIBackend. Install with 'pip install openai'.") from e
 
         self.client = OpenAI(api_key=api_key or None)
+        self.aclient = AsyncOpenAI(api_key=api_key or None)
         self.model = model
 
     def generate(self, system: str, messages: List[Dict]) -> str:
@@ -30,26 +98,115 @@ class OpenAIBackend(LLM):
         )
         return resp.choices[0].message.content or ""
 
+    async def agenerate(self, system: str, messages: List[Dict], temperature: float = 0.1) -> str:
+        full_msgs = [{"role": "system", "content": system}] + messages
+        resp = await self.aclient.chat.completions.create(
+            model=self.model,
+            messages=full_msgs,
+            temperature=temperature,
+        )
+        return resp.choices[0].message.content or ""
+
+    async def acandidates(
+        self,
+        system: str,
+        messages: List[Dict],
+        n: int,
+        temperature: float = 0.7,
+    ) -> AsyncIterator[str]:
+        # One request with n= : the prompt is only processed (and billed) once
+        full_msgs = [{"role": "system", "content": system}] + messages
+        resp = await self.aclient.chat.completions.create(
+            model=self.model,
+            messages=full_msgs,
+            temperature=temperature,
+            n=n,
+        )
+        for choice in resp.choices:
+            yield choice.message.content or ""
+
+    async def astream(self, system: str, messages: List[Dict]) -> AsyncIterator[str]:
+        full_msgs = [{"role": "system", "content": system}] + messages
+        stream = await self.aclient.chat.completions.create(
+            model=self.model,
+            messages=full_msgs,
+            temperature=0.1,
+            stream=True,
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closes the HTTP response, which stops generation server-side
+            await stream.close()
+
 # --- Local HTTP backend (Ollama / vLLM / LM Studio, etc.) ---
 
 class LocalHTTPBackend(LLM):
-    def __init__(self, model: str, endpoint: str):
+    """
+    Chat-completions client for a self-hosted server (vLLM, Ollama, ...).
+
+    - Keep-alive connection pools (requests.Session for generate(),
+      httpx.AsyncClient for agenerate()), at most max_connections each.
+    - At most max_in_flight requests on the server, shared by the sync
+      and async paths (eval scripts plus the server in one process); the
+      rest queue for a slot.
+    - One deadline per request covering queue wait + HTTP call; a request
+      that can't get a slot in time fails with TimeoutError.
+    - metrics() reports pool and queue state for tuning against GPU batch
+      capacity.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        endpoint: str,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        deadline: float = LLM_REQUEST_DEADLINE,
+    ):
         import requests
+        from requests.adapters import HTTPAdapter
+
         self.model = model
         self.endpoint = endpoint
-        self._requests = requests
+        self.max_connections = max_connections
+        self.max_in_flight = max_in_flight
+        self.deadline = deadline
 
-    def generate(self, system: str, messages: List[Dict]) -> str:
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max_connections,
+            pool_block=True,
+        )
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        self._aclient = None
+
+        # In-flight limit shared by threads and the event loop
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._max_queued = 0
+        self._requests_total = 0
+        self._errors = 0
+        self._queue_timeouts = 0
+        self._queue_wait_total = 0.0
+
+    def _payload(self, system: str, messages: List[Dict], temperature: float = 0.1) -> Dict:
         full_msgs = [{"role": "system", "content": system}] + messages
-        payload = {
+        return {
             "model": self.model,
             "messages": full_msgs,
-            "temperature": 0.1,
+            "temperature": temperature,
         }
-        r = self._requests.post(self.endpoint, json=payload, timeout=120)
-        r.raise_for_status()
-        data = r.json()
 
+    @staticmethod
+    def _content(data: Dict) -> str:
         # Adjust if your local server uses a different schema
         if "choices" in data:
             return data["choices"][0]["message"]["content"]
@@ -57,8 +214,242 @@ class LocalHTTPBackend(LLM):
             return data["message"]
         return str(data)
 
+    # --- queue / in-flight bookkeeping ---
+
+    def _enqueue(self) -> None:
+        with self._stats_lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+    def _dequeue(self, waited: float, acquired: bool) -> None:
+        with self._stats_lock:
+            self._queued -= 1
+            self._queue_wait_total += waited
+            if acquired:
+                self._in_flight += 1
+                self._requests_total += 1
+            else:
+                self._queue_timeouts += 1
+
+    def _finish(self, failed: bool) -> None:
+        with self._stats_lock:
+            self._in_flight -= 1
+            if failed:
+                self._errors += 1
+
+    def _queue_timeout(self, waited: float) -> TimeoutError:
+        return TimeoutError(
+            f"LLM request waited {waited:.1f}s for one of {self.max_in_flight} "
+            f"in-flight slots (deadline {self.deadline:g}s)"
+        )
+
+    @contextmanager
+    def _slot(self) -> Iterator[float]:
+        """Hold an in-flight slot (threads); yields the seconds left of the deadline."""
+        start = time.monotonic()
+        self._enqueue()
+        acquired = self._slots.acquire(timeout=self.deadline)
+        waited = time.monotonic() - start
+        self._dequeue(waited, acquired)
+        if not acquired:
+            raise self._queue_timeout(waited)
+
+        failed = False
+        try:
+            yield max(self.deadline - waited, 1.0)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._slots.release()
+            self._finish(failed)
+
+    async def _aacquire(self, timeout: float) -> bool:
+        """
+        Take a slot of the shared semaphore without blocking the event loop:
+        poll with a short backoff rather than waiting on a thread, so a
+        cancelled waiter can never end up holding a slot.
+        """
+        end = time.monotonic() + timeout
+        delay = 0.005
+        while not self._slots.acquire(blocking=False):
+            left = end - time.monotonic()
+            if left <= 0:
+                return False
+            await asyncio.sleep(min(delay, left))
+            delay = min(delay * 2, 0.05)
+        return True
+
+    @asynccontextmanager
+    async def _aslot(self) -> AsyncIterator[float]:
+        """Hold an in-flight slot (event loop); yields the seconds left of the deadline."""
+        if self._aclient is None:
+            try:
+                import httpx
+            except ImportError as e:
+                raise ImportError("httpx package is required for async LocalHTTPBackend. Install with 'pip install httpx'.") from e
+            self._aclient = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=self.deadline,
+            )
+
+        start = time.monotonic()
+        self._enqueue()
+        try:
+            acquired = await self._aacquire(self.deadline)
+        except BaseException:  # cancelled while queued
+            with self._stats_lock:
+                self._queued -= 1
+            raise
+        waited = time.monotonic() - start
+        self._dequeue(waited, acquired)
+        if not acquired:
+            raise self._queue_timeout(waited)
+
+        failed = False
+        try:
+            yield max(self.deadline - waited, 1.0)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._slots.release()
+            self._finish(failed)
+
+    def generate(self, system: str, messages: List[Dict]) -> str:
+        payload = self._payload(system, messages)
+        with self._slot() as remaining:
+            r = self._session.post(self.endpoint, json=payload, timeout=remaining)
+            r.raise_for_status()
+            return self._content(r.json())
+
+    async def agenerate(self, system: str, messages: List[Dict], temperature: float = 0.1) -> str:
+        payload = self._payload(system, messages, temperature)
+        async with self._aslot() as remaining:
+            r = await self._aclient.post(self.endpoint, json=payload, timeout=remaining)
+            r.raise_for_status()
+            return self._content(r.json())
+
+    @staticmethod
+    def _stream_piece(line: str) -> str | None:
+        """
+        Text delta from one line of a streamed response: OpenAI-style SSE
+        ("data: {...choices[0].delta...}") or Ollama-style NDJSON
+        ({"message": {"content": ...}}). None for keep-alives / [DONE].
+        """
+        line = line.strip()
+        if line.startswith("data:"):
+            line = line[5:].strip()
+        if not line or line == "[DONE]":
+            return None
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return None
+
+        if data.get("choices"):
+            choice = data["choices"][0]
+            part = choice.get("delta") or choice.get("message") or {}
+            return part.get("content")
+        if isinstance(data.get("message"), dict):
+            return data["message"].get("content")
+        return data.get("response")
+
+    async def astream(self, system: str, messages: List[Dict]) -> AsyncIterator[str]:
+        payload = self._payload(system, messages)
+        payload["stream"] = True
+        async with self._aslot() as remaining:
+            deadline_at = time.monotonic() + remaining
+            async with self._aclient.stream(
+                "POST", self.endpoint, json=payload, timeout=remaining
+            ) as r:
+                r.raise_for_status()
+                async for line in r.aiter_lines():
+                    if time.monotonic() > deadline_at:
+                        raise TimeoutError(
+                            f"LLM stream exceeded its deadline ({self.deadline:g}s)"
+                        )
+                    piece = self._stream_piece(line)
+                    if piece:
+                        yield piece
+
+    def metrics(self) -> Dict:
+        with self._stats_lock:
+            waits = self._requests_total + self._queue_timeouts
+            out: Dict = {
+                "backend": "local",
+                "max_connections": self.max_connections,
+                "max_in_flight": self.max_in_flight,
+                "deadline_seconds": self.deadline,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "max_queued": self._max_queued,
+                "requests": self._requests_total,
+                "errors": self._errors,
+                "queue_timeouts": self._queue_timeouts,
+                "avg_queue_wait_ms": round(1000 * self._queue_wait_total / waits, 2) if waits else 0.0,
+            }
+
+        # Pool state (best effort; these are library internals)
+        try:
+            pools = self._adapter.poolmanager.pools
+            conns = [pools[k] for k in pools.keys()]
+            out["sync_pool"] = {
+                "hosts": len(conns),
+                "connections_opened": sum(p.num_connections for p in conns),
+                "idle": sum(
+                    sum(1 for c in p.pool.queue if c is not None)
+                    for p in conns if p.pool is not None
+                ),
+            }
+        except Exception:
+            pass
+        try:
+            if self._aclient is not None:
+                pool = self._aclient._transport._pool
+                conns = list(pool.connections)
+                out["async_pool"] = {
+                    "connections": len(conns),
+                    "idle": sum(1 for c in conns if c.is_idle()),
+                }
+        except Exception:
+            pass
+
+        return out
+
+# --- Token estimate (prompt budgeting / eval reporting) ---
+
+_encoder = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate prompt tokens for `text`. Uses tiktoken when installed,
+    otherwise the usual ~4 characters per token rule of thumb.
+    """
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoder = False
+
+    if _encoder:
+        return len(_encoder.encode(text))
+    return (len(text) + 3) // 4
+
 _llm_instance: LLM | None = None
 
+
+def llm_metrics() -> Dict:
+    """Metrics of the LLM backend, if one has been created yet."""
+    return _llm_instance.metrics() if _llm_instance is not None else {}
+
+
 def get_llm() -> LLM:
     global _llm_instance
     if _llm_instance is not None:
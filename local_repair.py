@@ -0,0 +1,435 @@
+# local_repair.py
+
+import difflib
+import logging
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from schema_retriever import _identifier_tokens
+from schema_service import schema_service
+from sql_parser import ColumnRef, ParsedSql, insert_joins, parse_sql, replace_spans
+from sql_validator import (
+    _extract_alias_to_table,
+    has_unknown_tables,
+    has_unknown_columns,
+    has_bad_join_keys,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------
+# 1) SQL shape helpers
+# ---------------------------------------------------------
+
+# YEAR(x.OrderDateKey) / MONTH(...) / DATEPART(year, ...)
+DATE_FUNCTIONS = {"YEAR": "year", "MONTH": "month"}
+
+DATE_PARTS = {
+    "year": "CalendarYear", "yyyy": "CalendarYear", "yy": "CalendarYear",
+    "quarter": "CalendarQuarter", "qq": "CalendarQuarter", "q": "CalendarQuarter",
+    "month": "MonthNumberOfYear", "mm": "MonthNumberOfYear", "m": "MonthNumberOfYear",
+}
+
+DATE_TABLE = "DimDate"
+DATE_KEY = "DateKey"
+
+# Column-name similarity needed for an edit-distance fix, and the margin
+# over the runner-up so the pick is unambiguous
+MIN_RATIO = 0.85
+MIN_MARGIN = 0.1
+
+
+def _is_simple_select(sql: str) -> bool:
+    """One SELECT ... FROM with no CTEs or subqueries: safe to add JOINs."""
+    return parse_sql(sql).is_simple_select
+
+
+def _aliases(sql: str) -> Dict[str, str]:
+    """alias -> canonical table name, for tables the catalog knows."""
+    catalog = schema_service.catalog
+    out: Dict[str, str] = {}
+    for alias, table in _extract_alias_to_table(sql).items():
+        info = catalog.table(table)
+        if info is not None:
+            out[alias] = info.name
+    return out
+
+
+def _new_alias(table: str, taken: Set[str]) -> str:
+    """DimProductCategory -> 'dpc' (then 'dpc2', ...), unique in the query."""
+    base = "".join(t[0] for t in re.findall(r"[A-Z][a-z]*|\d+", table)).lower() or "t"
+    lowered = {a.lower() for a in taken}
+    alias, i = base, 2
+    while alias in lowered:
+        alias, i = f"{base}{i}", i + 1
+    return alias
+
+
+def _add_joins(sql: str, joins: List[str]) -> str:
+    """New JOINs go before the first WHERE / GROUP BY / ORDER BY / HAVING."""
+    return insert_joins(sql, joins)
+
+
+def _refs(parsed: ParsedSql, alias: str, column: str) -> List[ColumnRef]:
+    """Column references alias.column (any quoting / case) in the parsed SQL."""
+    return [
+        c for c in parsed.columns
+        if c.qualifier.lower() == alias.lower() and c.column.lower() == column.lower()
+    ]
+
+
+def _equalities(parsed: ParsedSql) -> List[Tuple[ColumnRef, ColumnRef]]:
+    """a.x = b.y comparisons anywhere in the statement (ON or WHERE)."""
+    by_end = {c.end: c for c in parsed.columns}
+    by_start = {c.start: c for c in parsed.columns}
+    toks = parsed.tokens
+    out = []
+    for k in range(1, len(toks) - 1):
+        if toks[k].value != "=":
+            continue
+        left, right = by_end.get(toks[k - 1].end), by_start.get(toks[k + 1].start)
+        if left is not None and right is not None:
+            out.append((left, right))
+    return out
+
+
+def _date_function_calls(parsed: ParsedSql) -> List[Tuple[int, int, str, ColumnRef]]:
+    """
+    (start, end, datepart, column ref) for YEAR(a.col), MONTH(a.col) and
+    DATEPART(part, a.col) calls whose only argument is a column reference.
+    Literals and comments are never tokens, so they are never matched.
+    """
+    toks = parsed.tokens
+    by_start = {c.start: c for c in parsed.columns}
+    calls = []
+    for i, tok in enumerate(toks):
+        if tok.kind != "word" or i + 1 >= len(toks) or toks[i + 1].value != "(":
+            continue
+        j = i + 2
+        if tok.upper in DATE_FUNCTIONS:
+            part = DATE_FUNCTIONS[tok.upper]
+        elif tok.upper == "DATEPART":
+            if j + 1 >= len(toks) or toks[j].kind != "word" or toks[j + 1].value != ",":
+                continue
+            part = toks[j].value.lower()
+            j += 2
+        else:
+            continue
+        if part not in DATE_PARTS or j >= len(toks):
+            continue
+        ref = by_start.get(toks[j].start)
+        if ref is None:
+            continue
+        # The first token after the reference must close the call
+        k = next((x for x in range(j, len(toks)) if toks[x].start >= ref.end), None)
+        if k is None or toks[k].value != ")":
+            continue
+        calls.append((tok.start, toks[k].end, part, ref))
+    return calls
+
+
+# ---------------------------------------------------------
+# 2) Rules
+# ---------------------------------------------------------
+
+def _fix_date_functions(sql: str, notes: List[str]) -> str:
+    """
+    YEAR(fis.OrderDateKey) = 2004  ->  d.CalendarYear = 2004, joining
+    DimDate on that key if the query doesn't already.
+    """
+    catalog = schema_service.catalog
+    graph = catalog.join_graph
+    date_info = catalog.table(DATE_TABLE)
+    if graph is None or date_info is None:
+        return sql
+
+    parsed = parse_sql(sql)
+    aliases = _aliases(sql)
+    joins: List[str] = []
+    edits: List[Tuple[int, int, str]] = []
+    # key column "alias.Column" -> DimDate alias used for it
+    date_alias_for: Dict[str, str] = {}
+
+    for start, end, part, ref in _date_function_calls(parsed):
+        target_col = DATE_PARTS[part]
+        if not date_info.has_column(target_col):
+            continue
+        alias = ref.qualifier
+        table = next((t for a, t in aliases.items() if a.lower() == alias.lower()), None)
+        if table is None:
+            continue
+        column = catalog.column(table, ref.column)
+        if column is None:
+            continue
+
+        if table == DATE_TABLE and column.name == DATE_KEY:
+            date_alias = alias
+        else:
+            if (column.name, DATE_KEY) not in graph.join_keys(table, DATE_TABLE):
+                continue
+            key = f"{alias}.{column.name}".lower()
+            date_alias = date_alias_for.get(key)
+            if date_alias is None:
+                date_alias = _existing_date_join(parsed, alias, column.name, aliases)
+            if date_alias is None:
+                if not parsed.is_simple_select:
+                    continue
+                date_alias = _new_alias(DATE_TABLE, set(aliases) | set(date_alias_for.values()))
+                joins.append(
+                    f"JOIN {DATE_TABLE} AS {date_alias} "
+                    f"ON {alias}.{column.name} = {date_alias}.{DATE_KEY}"
+                )
+            date_alias_for[key] = date_alias
+
+        notes.append(f"{sql[start:end]} -> {date_alias}.{target_col}")
+        edits.append((start, end, f"{date_alias}.{target_col}"))
+
+    new_sql = replace_spans(sql, edits)
+    if joins:
+        new_sql = _add_joins(new_sql, joins)
+    return new_sql
+
+
+def _existing_date_join(
+    parsed: ParsedSql, alias: str, column: str, aliases: Dict[str, str]
+) -> Optional[str]:
+    """Alias of a DimDate already joined on alias.column, if any."""
+    date_aliases = {a.lower(): a for a, t in aliases.items() if t == DATE_TABLE}
+    for left, right in _equalities(parsed):
+        for mine, other in ((left, right), (right, left)):
+            if (
+                mine.qualifier.lower() == alias.lower()
+                and mine.column.lower() == column.lower()
+                and other.column.lower() == DATE_KEY.lower()
+                and other.qualifier.lower() in date_aliases
+            ):
+                return date_aliases[other.qualifier.lower()]
+    return None
+
+
+def _fix_join_keys(sql: str, notes: List[str]) -> str:
+    """
+    fis.ProductKey = c.CustomerKey  ->  fis.CustomerKey = c.CustomerKey,
+    when the FK between the two tables is unambiguous.
+    """
+    has_bad, bad = has_bad_join_keys(sql)
+    if not has_bad:
+        return sql
+
+    catalog = schema_service.catalog
+    graph = catalog.join_graph
+    aliases = _aliases(sql)
+
+    for t1, c1, t2, c2 in bad:
+        keys = sorted(graph.join_keys(t1, t2))
+        # Keep whichever side already names an FK column, if that pins it down
+        pinned = [k for k in keys if k[0] == c1] or [k for k in keys if k[1] == c2]
+        choice = pinned if len(pinned) == 1 else keys
+        if len(choice) != 1:
+            continue
+        k1, k2 = choice[0]
+
+        aliases_lower = {a.lower(): t for a, t in aliases.items()}
+        edits = []
+        for left, right in parse_sql(sql).join_predicates:
+            if (
+                aliases_lower.get(left.qualifier.lower()) == t1
+                and aliases_lower.get(right.qualifier.lower()) == t2
+                and left.column.lower() == c1.lower()
+                and right.column.lower() == c2.lower()
+            ):
+                a1, a2 = left.qualifier, right.qualifier
+                edits.append((left.start, right.end, f"{a1}.{k1} = {a2}.{k2}"))
+                notes.append(f"{a1}.{c1} = {a2}.{c2} -> {a1}.{k1} = {a2}.{k2}")
+        sql = replace_spans(sql, edits)
+    return sql
+
+
+def _closest_column(names: List[str], column: str) -> Optional[str]:
+    """
+    Confident match for an unknown column among a table's columns:
+
+      - the only column whose name tokens include all of the unknown
+        name's tokens (ProductName -> EnglishProductName; among the
+        English/Spanish/French variants the English one)
+      - otherwise the most similar name by edit distance, if it is close
+        enough and clearly ahead of the runner-up
+    """
+    tokens = set(_identifier_tokens(column))
+    supersets = [n for n in names if tokens and tokens <= set(_identifier_tokens(n))]
+    if len(supersets) > 1:
+        english = [n for n in supersets if n.startswith("English")]
+        if len(english) == 1:
+            supersets = english
+    if len(supersets) == 1:
+        return supersets[0]
+    if supersets:
+        return None
+
+    ratios = sorted(
+        ((difflib.SequenceMatcher(None, column.lower(), n.lower()).ratio(), n) for n in names),
+        reverse=True,
+    )
+    if not ratios or ratios[0][0] < MIN_RATIO:
+        return None
+    if len(ratios) > 1 and ratios[0][0] - ratios[1][0] < MIN_MARGIN:
+        return None
+    return ratios[0][1]
+
+
+def _fix_unknown_columns(sql: str, notes: List[str]) -> str:
+    """
+    For each alias.column that has_unknown_columns reports, in order:
+
+      1. the column exists (exactly) on one other table in the query
+         -> use that table's alias
+      2. a close match on the alias's own table -> use it
+      3. the column exists on one table reachable over the FK graph
+         -> add the bridge JOINs and use the new alias
+    """
+    has_bad, bad = has_unknown_columns(sql)
+    if not has_bad:
+        return sql
+
+    catalog = schema_service.catalog
+
+    for table, alias, col in dict.fromkeys(bad):
+        aliases = _aliases(sql)
+
+        owners = [a for a, t in aliases.items() if a.lower() != alias.lower() and catalog.has_column(t, col)]
+        if len({aliases[a] for a in owners}) == 1 and len(owners) == 1:
+            fixed_col = catalog.column(aliases[owners[0]], col).name
+            replacement = f"{owners[0]}.{fixed_col}"
+        else:
+            info = catalog.table(table)
+            match = _closest_column(info.column_names, col) if info is not None else None
+            if match is not None:
+                replacement = f"{alias}.{match}"
+            else:
+                bridge = _bridge_column(sql, table, alias, col, aliases)
+                if bridge is None:
+                    continue
+                new_alias, fixed_col, joins = bridge
+                sql = _add_joins(sql, joins)
+                replacement = f"{new_alias}.{fixed_col}"
+                notes.append("added " + "; ".join(joins))
+
+        # Re-parse: the bridge JOINs above shift offsets
+        refs = _refs(parse_sql(sql), alias, col)
+        if refs:
+            notes.append(f"{alias}.{col} -> {replacement}")
+            sql = replace_spans(sql, [(r.start, r.end, replacement) for r in refs])
+
+    return sql
+
+
+def _bridge_target(column: str, table: str) -> Optional[str]:
+    """The single table nearest to `table` over the FK graph that has `column`."""
+    catalog = schema_service.catalog
+    graph = catalog.join_graph
+    if graph is None:
+        return None
+
+    best: List[Tuple[int, str]] = []
+    for t in catalog.tables_with_column(column):
+        if t == table:
+            continue
+        path = graph.path(table, t)
+        if path is not None:
+            best.append((len(path), t))
+    best.sort()
+    if not best or (len(best) > 1 and best[0][0] == best[1][0]):
+        return None
+    return best[0][1]
+
+
+def _bridge_column(
+    sql: str,
+    table: str,
+    alias: str,
+    column: str,
+    aliases: Dict[str, str],
+) -> Optional[Tuple[str, str, List[str]]]:
+    """(alias of the table holding `column`, its column name, JOINs to add) or None."""
+    if not _is_simple_select(sql):
+        return None
+    target = _bridge_target(column, table)
+    if target is None:
+        return None
+    if target in aliases.values():
+        # Already joined: rule 1 didn't fire, so it's ambiguous
+        return None
+
+    steps, unreachable = schema_service.catalog.join_graph.join_chain([table, target])
+    if unreachable:
+        return None
+
+    alias_of = {table: alias}
+    for a, t in aliases.items():
+        alias_of.setdefault(t, a)
+    taken = set(aliases)
+    joins: List[str] = []
+    for step in steps:
+        left = alias_of[step.left_table]
+        if step.right_table in alias_of:
+            continue
+        right = _new_alias(step.right_table, taken)
+        taken.add(right)
+        alias_of[step.right_table] = right
+        cond = " AND ".join(f"{left}.{lc} = {right}.{rc}" for lc, rc in step.columns)
+        joins.append(f"JOIN {step.right_table} AS {right} ON {cond}")
+
+    return alias_of[target], schema_service.catalog.column(target, column).name, joins
+
+
+# ---------------------------------------------------------
+# 3) Entry point
+# ---------------------------------------------------------
+
+_stats: Counter = Counter()
+
+
+def local_repair_metrics() -> Dict[str, int]:
+    return dict(_stats)
+
+
+def local_repair(sql: str) -> Tuple[Optional[str], List[str]]:
+    """
+    Deterministic, catalog-driven fixes for mechanical SQL mistakes:
+
+      - YEAR/MONTH/DATEPART on a *DateKey -> DimDate join + CalendarYear etc.
+      - wrong FK columns in a JOIN between FK-related tables
+      - unknown columns: wrong alias, near-miss names, missing bridge joins
+
+    Returns (fixed_sql, notes) when at least one fix applied and the
+    result passes table, column and join-key validation; (None, []) when
+    there was nothing to fix or no confident fix (caller falls back to
+    the LLM repair).
+    """
+    notes: List[str] = []
+    fixed = sql
+    try:
+        fixed = _fix_date_functions(fixed, notes)
+        fixed = _fix_join_keys(fixed, notes)
+        fixed = _fix_unknown_columns(fixed, notes)
+    except Exception as ex:
+        logger.warning("Local repair failed: %s", ex)
+        _stats["errors"] += 1
+        return None, []
+
+    if not notes:
+        return None, []
+
+    _stats["attempts"] += 1
+    if (
+        has_unknown_tables(fixed)[0]
+        or has_unknown_columns(fixed)[0]
+        or has_bad_join_keys(fixed)[0]
+    ):
+        _stats["rejected"] += 1
+        return None, []
+
+    _stats["fixed"] += 1
+    return fixed, notes
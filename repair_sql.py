@@ -1,23 +1,17 @@
 # repair_sql.py
 
-from typing import Any
+from typing import Any, Tuple
 import json
 
+from config import LLM_STREAMING
 from llm import get_llm
-from schema_service import schema_service
-from sql_utils import extract_sql 
+from schema_retriever import schema_context
+from sql_utils import astream_sql, extract_sql
+from sql_validator import extract_tables
 
 
-def repair_sql(question: str, bad_sql: str, error_message: str) -> str:
-    """
-    Ask the LLM to repair an invalid SQL statement.
-
-    - Keeps semantics aligned with the original question as much as possible.
-    - Fixes unknown columns / wrong joins / misuse of DateKey/OrderDateKey.
-    - Ensures the result is ONE safe SELECT (CTEs allowed).
-    """
-    llm = get_llm()
-
+def build_repair_prompt(question: str, bad_sql: str, error_message: str) -> Tuple[str, str]:
+    """Build the (system, user) prompt pair for a repair request."""
     system = (
         "You are a senior SQL Server T-SQL expert. "
         "Your job is to REPAIR a broken SELECT query so it compiles "
@@ -40,7 +34,7 @@ The database or validator returned this error message:
 
 Use ONLY the following schema info to choose tables, columns, and joins:
 
-{schema_service.schema_text}
+{schema_context(question, extra_tables=extract_tables(bad_sql))}
 
 Key schema & modelling rules (very important):
 - FactInternetSales / FactResellerSales use OrderDateKey (INT) which joins to DimDate.DateKey (INT).
@@ -83,6 +77,20 @@ Your task:
 - Never use INSERT/UPDATE/DELETE/ALTER/DROP/TRUNCATE/EXEC/CREATE/MERGE.
 """
 
+    return system, user
+
+
+def repair_sql(question: str, bad_sql: str, error_message: str) -> str:
+    """
+    Ask the LLM to repair an invalid SQL statement.
+
+    - Keeps semantics aligned with the original question as much as possible.
+    - Fixes unknown columns / wrong joins / misuse of DateKey/OrderDateKey.
+    - Ensures the result is ONE safe SELECT (CTEs allowed).
+    """
+    llm = get_llm()
+
+    system, user = build_repair_prompt(question, bad_sql, error_message)
     raw = llm.generate(system, [{"role": "user", "content": user}])
 
     if not isinstance(raw, str):
@@ -90,3 +98,21 @@ Your task:
 
     sql = extract_sql(raw)
     return sql.strip()
+
+
+async def arepair_sql(question: str, bad_sql: str, error_message: str) -> str:
+    """Async variant of repair_sql for the async /chat_sql pipeline."""
+    llm = get_llm()
+
+    system, user = build_repair_prompt(question, bad_sql, error_message)
+    messages = [{"role": "user", "content": user}]
+    if LLM_STREAMING:
+        return await astream_sql(llm, system, messages)
+
+    raw = await llm.agenerate(system, messages)
+
+    if not isinstance(raw, str):
+        raw = str(raw)
+
+    sql = extract_sql(raw)
+    return sql.strip()
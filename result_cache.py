@@ -0,0 +1,310 @@
+# result_cache.py
+
+import logging
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_INVALIDATION,
+    RESULT_CACHE_LOAD_PROBE_SQL,
+    RESULT_CACHE_PROBE_SECONDS,
+)
+from db import fetch_scalar, table_versions
+from schema_service import schema_service
+from sql_parser import normalize_sql, parse_sql
+
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_MODES = ("ttl", "load_probe", "table_changes")
+
+
+# ---------------------------------------------------------
+# 1) Columnar result
+# ---------------------------------------------------------
+
+@dataclass
+class QueryResult:
+    """
+    Row-limited result of one executed query, stored column by column
+    (one tuple per column) rather than as a DataFrame or row dicts.
+    """
+    names: Tuple[str, ...]
+    columns: Tuple[tuple, ...]
+    truncated: bool  # the query had more rows than were kept
+
+    @classmethod
+    def from_rows(cls, names: List[str], rows: List[tuple], truncated: bool) -> "QueryResult":
+        return cls(
+            names=tuple(names),
+            columns=tuple(tuple(r[i] for r in rows) for i in range(len(names))),
+            truncated=truncated,
+        )
+
+    @property
+    def row_count(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def rows(self, limit: Optional[int] = None) -> List[tuple]:
+        cols = [c[:limit] for c in self.columns]
+        return list(zip(*cols))
+
+    def nbytes(self) -> int:
+        """Approximate in-memory size (tuples plus their values)."""
+        total = sys.getsizeof(self.columns) + sum(sys.getsizeof(n) for n in self.names)
+        for col in self.columns:
+            total += sys.getsizeof(col) + sum(sys.getsizeof(v) for v in col)
+        return total
+
+
+# ---------------------------------------------------------
+# 2) Cache
+# ---------------------------------------------------------
+
+@dataclass
+class ResultEntry:
+    result: QueryResult
+    version: Any  # data version the result was read at (see ResultCache._version)
+    created_at: float
+    nbytes: int
+    hits: int = 0
+
+
+class ResultCache:
+    """
+    Normalized SQL → executed (row-limited) result.
+
+    Entries expire after ttl seconds and are evicted LRU once the cache
+    holds more than max_bytes. Each entry also records the data version it
+    was read at, and is dropped when that no longer matches:
+
+      - 'load_probe': the value of probe_sql (e.g. the last load time in
+        an ETL log table), shared by every entry
+      - 'table_changes': for each table the query reads, its row count and
+        the time of its last insert / update / delete (db.table_versions)
+      - 'ttl': no version, entries only expire
+
+    The version is re-read from SQL Server at most every probe_seconds,
+    via probe() (blocking, so the caller runs it on the DB pool when
+    probe_due()), so a result can be served for up to probe_seconds after
+    a load. If a probe fails, nothing is served or stored until one
+    succeeds. The whole cache is dropped when the schema fingerprint changes.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        ttl: float = RESULT_CACHE_TTL_SECONDS,
+        invalidation: str = RESULT_CACHE_INVALIDATION,
+        probe_sql: str = RESULT_CACHE_LOAD_PROBE_SQL,
+        probe_seconds: float = RESULT_CACHE_PROBE_SECONDS,
+    ):
+        if invalidation not in INVALIDATION_MODES:
+            raise ValueError(f"RESULT_CACHE_INVALIDATION must be one of {INVALIDATION_MODES}, got {invalidation!r}")
+        if invalidation == "load_probe" and not probe_sql:
+            raise ValueError("RESULT_CACHE_INVALIDATION=load_probe needs RESULT_CACHE_LOAD_PROBE_SQL")
+
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.invalidation = invalidation
+        self.probe_sql = probe_sql
+        self.probe_seconds = probe_seconds
+
+        self._entries: "OrderedDict[str, ResultEntry]" = OrderedDict()
+        self._bytes = 0
+        self._fingerprint: Optional[str] = None
+        self._lock = threading.Lock()
+
+        # Last probe: load marker or {table: (rows, last update)}; None = unknown (not run / failed)
+        self._load_marker: Any = None
+        self._table_versions: Optional[Dict[str, Tuple[int, Optional[str]]]] = None
+        self._probed_at: Optional[float] = None  # when the last probe was claimed (probe_due)
+
+        self._stats = Counter()
+
+    # -----------------------------------------------------
+    # Bookkeeping
+    # -----------------------------------------------------
+
+    def _check_schema(self) -> None:
+        fp = schema_service.catalog.fingerprint
+        if fp != self._fingerprint:
+            if self._entries:
+                self._stats["invalidations"] += len(self._entries)
+            self._clear()
+            self._fingerprint = fp
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    # -----------------------------------------------------
+    # Data version
+    # -----------------------------------------------------
+
+    def probe_due(self) -> bool:
+        """
+        True if the caller should run probe() before the next get(). The
+        probe slot is claimed under the lock, so of many concurrent callers
+        only one gets True per probe_seconds.
+        """
+        if self.invalidation == "ttl":
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if self._probed_at is not None and now - self._probed_at < self.probe_seconds:
+                return False
+            self._probed_at = now
+            return True
+
+    def probe(self) -> None:
+        """Blocking: re-read the load marker / table change fingerprints."""
+        with self._lock:
+            self._stats["probes"] += 1
+        try:
+            if self.invalidation == "load_probe":
+                marker = fetch_scalar(self.probe_sql)
+                with self._lock:
+                    if marker != self._load_marker and self._load_marker is not None and self._entries:
+                        # New load: every entry was read before it
+                        logger.info(
+                            "Result cache: load marker %r -> %r, dropping %d entries",
+                            self._load_marker, marker, len(self._entries),
+                        )
+                        self._stats["invalidations"] += len(self._entries)
+                        self._clear()
+                    self._load_marker = marker if marker is not None else "<none>"
+            else:
+                versions = table_versions()
+                with self._lock:
+                    self._table_versions = versions
+        except Exception as ex:
+            logger.warning("Result cache probe failed: %s", ex)
+            with self._lock:
+                self._stats["probe_errors"] += 1
+                self._load_marker = None
+                self._table_versions = None
+
+    def _version(self, sql: str) -> Any:
+        """
+        Data version `sql` would be read at, from the last probe. None
+        when unknown (probe failed, or a table the probe didn't see), in
+        which case the result is neither served nor stored.
+        """
+        if self.invalidation == "ttl":
+            return "ttl"
+        if self.invalidation == "load_probe":
+            return self._load_marker
+        if self._table_versions is None:
+            return None
+
+        version = []
+        for t in sorted(parse_sql(sql).tables, key=lambda t: (t.schema or "", t.name)):
+            if t.is_cte:
+                continue
+            key = f"{t.schema}.{t.name}".lower() if t.schema else t.name.lower()
+            table_version = self._table_versions.get(key)
+            if table_version is None:
+                return None
+            version.append((key, table_version))
+        return tuple(version)
+
+    # -----------------------------------------------------
+    # Lookups / inserts
+    # -----------------------------------------------------
+
+    def get(self, sql: str, max_rows: int) -> Tuple[Optional[QueryResult], Any]:
+        """
+        (result, version): the cached result if it is current and holds
+        enough rows for max_rows (else None), and the data version to
+        pass to put() after executing the query instead.
+        """
+        key = normalize_sql(sql)
+        now = time.monotonic()
+
+        with self._lock:
+            self._check_schema()
+            version = self._version(sql)
+
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and now - entry.created_at > self.ttl:
+                self._remove(key)
+                self._stats["expired"] += 1
+                entry = None
+            if entry is not None and (version is None or entry.version != version):
+                self._remove(key)
+                self._stats["invalidations"] += 1
+                entry = None
+            if entry is not None and entry.result.truncated and entry.result.row_count < max_rows:
+                # Cached with a smaller max_rows: not enough rows to answer
+                entry = None
+
+            if entry is None:
+                self._stats["misses"] += 1
+                return None, version
+
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self._stats["hits"] += 1
+            return entry.result, version
+
+    def put(self, sql: str, version: Any, result: QueryResult) -> None:
+        """Cache the result of executing `sql`, read at `version` (from get())."""
+        if version is None:
+            return
+        nbytes = result.nbytes()
+        if nbytes > self.max_bytes:
+            with self._lock:
+                self._stats["too_large"] += 1
+            return
+
+        key = normalize_sql(sql)
+        with self._lock:
+            self._check_schema()
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = ResultEntry(
+                result=result,
+                version=version,
+                created_at=time.monotonic(),
+                nbytes=nbytes,
+            )
+            self._bytes += nbytes
+
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            out = {
+                "enabled": RESULT_CACHE_ENABLED,
+                "invalidation": self.invalidation,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+            for k in ("hits", "misses", "expired", "invalidations", "evictions",
+                      "too_large", "probes", "probe_errors"):
+                out[k] = self._stats[k]
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+        return out
+
+
+result_cache = ResultCache()
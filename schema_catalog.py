@@ -0,0 +1,211 @@
+# schema_catalog.py
+
+import sys
+from typing import Dict, Iterable, Iterator, KeysView, List, Optional, Sequence, Set, Tuple
+
+
+class ColumnInfo:
+    """One column of a catalog table. Names are interned."""
+
+    __slots__ = ("name", "table", "type", "nullable", "ordinal")
+
+    def __init__(self, name: str, table: str, type: str, nullable: bool, ordinal: int):
+        self.name = name
+        self.table = table
+        self.type = type
+        self.nullable = nullable
+        self.ordinal = ordinal
+
+    def __repr__(self) -> str:
+        null = "NULL" if self.nullable else "NOT NULL"
+        return f"ColumnInfo({self.table}.{self.name} {self.type} {null})"
+
+
+class TableInfo:
+    """
+    One catalog table: columns in declaration order plus hash lookups by
+    exact name and by lower-cased name (SQL Server's default collation is
+    case-insensitive, but we always hand back the canonical casing).
+    """
+
+    __slots__ = ("name", "columns", "_by_name", "_by_lower")
+
+    def __init__(self, name: str, columns: Sequence[ColumnInfo]):
+        self.name = name
+        self.columns: Tuple[ColumnInfo, ...] = tuple(columns)
+        self._by_name: Dict[str, ColumnInfo] = {c.name: c for c in self.columns}
+        self._by_lower: Dict[str, ColumnInfo] = {c.name.lower(): c for c in self.columns}
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    def column(self, name: str) -> Optional[ColumnInfo]:
+        """Exact match first, then case-insensitive."""
+        return self._by_name.get(name) or self._by_lower.get(name.lower())
+
+    def has_column(self, name: str) -> bool:
+        return name in self._by_name or name.lower() in self._by_lower
+
+    def __repr__(self) -> str:
+        return f"TableInfo({self.name}, {len(self.columns)} columns)"
+
+
+class SchemaCatalog:
+    """
+    One immutable-by-convention version of the compiled schema.
+
+    SchemaService swaps whole SchemaCatalog objects on reload, so a reader
+    that grabs `schema_service.catalog` once sees a consistent set of
+    tables, columns, FKs and prompt text even while a refresh happens.
+
+    Lookups are hash-based and case-insensitive (returning canonical
+    names), so validation cost per table/column reference stays constant
+    as the schema grows:
+
+        catalog.table("dimproduct")                 -> TableInfo(DimProduct)
+        catalog.column("DimProduct", "productkey")  -> ColumnInfo(...)
+        catalog.tables_with_column("ProductKey")    -> ("DimProduct", ...)
+
+    Attributes:
+        fk_pairs:    {(table1, column1, table2, column2)}, both directions
+        schema_text: compact schema description used in LLM prompts
+        fingerprint: cheap DB/DDL version marker this catalog was built at
+        join_graph:  FK join-path graph (join_graph.JoinGraph), compiled by
+                     SchemaService when the catalog is loaded
+    """
+
+    def __init__(self, fingerprint: str = "", schema_text: str = ""):
+        self._tables: Dict[str, TableInfo] = {}
+        self._tables_lower: Dict[str, TableInfo] = {}
+        # lower-cased column name -> tables that have it (inverted index)
+        self._tables_by_column: Dict[str, List[str]] = {}
+        self.fk_pairs: Set[Tuple[str, str, str, str]] = set()
+        self.schema_text = schema_text
+        self.fingerprint = fingerprint
+        self.join_graph = None
+        self._views: Optional[tuple] = None
+
+    # -----------------------------------------------------
+    # Building
+    # -----------------------------------------------------
+
+    def add_table(self, name: str, col_defs: Iterable[Tuple[str, str, bool]]) -> TableInfo:
+        """Add a table from (column, type, nullable) tuples, in column order."""
+        name = sys.intern(name)
+        columns = [
+            ColumnInfo(sys.intern(col), name, sys.intern(typ), bool(nullable), i)
+            for i, (col, typ, nullable) in enumerate(col_defs)
+        ]
+        info = TableInfo(name, columns)
+        self._tables[name] = info
+        self._tables_lower[name.lower()] = info
+        for c in columns:
+            self._tables_by_column.setdefault(c.name.lower(), []).append(name)
+        self._views = None
+        return info
+
+    def add_fk(self, table: str, column: str, ref_table: str, ref_column: str) -> None:
+        """Record an FK column pair in both directions."""
+        t, c = sys.intern(table), sys.intern(column)
+        rt, rc = sys.intern(ref_table), sys.intern(ref_column)
+        self.fk_pairs.add((t, c, rt, rc))
+        self.fk_pairs.add((rt, rc, t, c))
+
+    # -----------------------------------------------------
+    # Lookups
+    # -----------------------------------------------------
+
+    def table(self, name: str) -> Optional[TableInfo]:
+        """Exact match first, then case-insensitive."""
+        return self._tables.get(name) or self._tables_lower.get(name.lower())
+
+    def has_table(self, name: str) -> bool:
+        return name in self._tables or name.lower() in self._tables_lower
+
+    def column(self, table: str, column: str) -> Optional[ColumnInfo]:
+        info = self.table(table)
+        return info.column(column) if info is not None else None
+
+    def has_column(self, table: str, column: str) -> bool:
+        info = self.table(table)
+        return info is not None and info.has_column(column)
+
+    def tables_with_column(self, column: str) -> Tuple[str, ...]:
+        return tuple(self._tables_by_column.get(column.lower(), ()))
+
+    def iter_tables(self) -> Iterator[TableInfo]:
+        return iter(self._tables.values())
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    # -----------------------------------------------------
+    # Plain-dict views (snapshot files, drift check, retriever)
+    # -----------------------------------------------------
+
+    @property
+    def tables(self) -> KeysView:
+        """Set-like view of canonical table names (exact-case membership)."""
+        return self._tables.keys()
+
+    def _build_views(self) -> tuple:
+        if self._views is None:
+            cols = {t: info.column_names for t, info in self._tables.items()}
+            types = {t: {c.name: c.type for c in info.columns} for t, info in self._tables.items()}
+            nulls = {t: {c.name: c.nullable for c in info.columns} for t, info in self._tables.items()}
+            self._views = (cols, types, nulls)
+        return self._views
+
+    @property
+    def cols_by_table(self) -> Dict[str, List[str]]:
+        return self._build_views()[0]
+
+    @property
+    def col_types(self) -> Dict[str, Dict[str, str]]:
+        return self._build_views()[1]
+
+    @property
+    def col_nullable(self) -> Dict[str, Dict[str, bool]]:
+        return self._build_views()[2]
+
+
+def render_schema_text(
+    catalog: SchemaCatalog,
+    label: str,
+    tables: Optional[Iterable[str]] = None,
+) -> str:
+    """
+    Human-readable schema text for the LLM: one line per table with its
+    columns, then the FK relationships. With `tables`, only those tables
+    (in catalog order) and the FKs between them are included.
+    """
+    keep = None if tables is None else set(tables)
+    lines: List[str] = [
+        f"- {info.name}: {', '.join(info.column_names)}"
+        for info in catalog.iter_tables()
+        if keep is None or info.name in keep
+    ]
+
+    schema_parts: List[str] = []
+
+    schema_parts.append(f"Known tables & columns ({label}):")
+    schema_parts.append("\n".join(lines))
+
+    fk_pairs = [
+        p for p in catalog.fk_pairs
+        if keep is None or (p[0] in keep and p[2] in keep)
+    ]
+
+    # Add a FK section if we found any
+    if fk_pairs:
+        rel_lines: List[str] = []
+        # sort for deterministic output
+        for t1, c1, t2, c2 in sorted(fk_pairs):
+            rel_lines.append(f"- {t1}.{c1} → {t2}.{c2}")
+
+        schema_parts.append("\nKnown foreign-key relationships:")
+        schema_parts.append("\n".join(rel_lines))
+
+    # Join into a single text blob
+    return "\n".join(schema_parts)
@@ -0,0 +1,286 @@
+# schema_ddl.py
+
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+@dataclass
+class DdlColumn:
+    """
+    One column parsed from a CREATE TABLE statement.
+
+    Fields:
+        name:     column name without brackets (e.g. "OrderDateKey")
+        type:     SQL Server type as written, lower-cased
+                  (e.g. "int", "nvarchar(50)", "decimal(18, 4)")
+        nullable: False when the column is declared NOT NULL
+    """
+    name: str
+    type: str
+    nullable: bool = True
+
+
+@dataclass
+class DdlForeignKey:
+    """
+    A (possibly composite) foreign key: table.columns → ref_table.ref_columns.
+    Columns are positionally paired, as in the DDL.
+    """
+    table: str
+    columns: List[str]
+    ref_table: str
+    ref_columns: List[str]
+
+
+@dataclass
+class DdlSchema:
+    """
+    Everything we could compile out of a directory of DDL scripts.
+
+    `tables` keeps the CREATE TABLE order per file (files are read sorted
+    by name), so output is deterministic.
+    """
+    tables: Dict[str, List[DdlColumn]] = field(default_factory=dict)
+    foreign_keys: List[DdlForeignKey] = field(default_factory=list)
+
+
+# ---------------------------------------------------------
+# Regexes
+# ---------------------------------------------------------
+
+# [dbo].[DimProduct] / dbo.DimProduct / DimProduct
+_IDENT = r'(?:\[[^\]]+\]|"[^"]+"|\w+)'
+_QUALIFIED = rf'(?:{_IDENT}\s*\.\s*)*{_IDENT}'
+
+GO_SPLIT_RE = re.compile(r'^\s*GO\s*$', re.I | re.M)
+BLOCK_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+LINE_COMMENT_RE = re.compile(r'--[^\n]*')
+
+CREATE_TABLE_RE = re.compile(
+    rf'\bCREATE\s+TABLE\s+({_QUALIFIED})\s*\(',
+    re.I,
+)
+
+ALTER_FK_RE = re.compile(
+    rf'\bALTER\s+TABLE\s+({_QUALIFIED})\s+'
+    r'(?:WITH\s+(?:NO)?CHECK\s+)?ADD\s+'
+    rf'(?:CONSTRAINT\s+{_IDENT}\s+)?'
+    r'FOREIGN\s+KEY\s*\(([^)]*)\)\s*'
+    rf'REFERENCES\s+({_QUALIFIED})\s*\(([^)]*)\)',
+    re.I,
+)
+
+INLINE_FK_RE = re.compile(
+    rf'^(?:CONSTRAINT\s+{_IDENT}\s+)?FOREIGN\s+KEY\s*\(([^)]*)\)\s*'
+    rf'REFERENCES\s+({_QUALIFIED})\s*\(([^)]*)\)',
+    re.I,
+)
+
+# [Name] [nvarchar](50) IDENTITY(1,1) NOT NULL
+COLUMN_DEF_RE = re.compile(
+    rf'^({_IDENT})\s+({_QUALIFIED})\s*(\(\s*[\w\s,]+\))?(.*)$',
+    re.I | re.S,
+)
+
+# [Name] AS (expr)  -- computed column, no declared type
+COMPUTED_COL_RE = re.compile(rf'^({_IDENT})\s+AS\b', re.I)
+
+TABLE_CONSTRAINT_PREFIXES = (
+    "constraint", "primary", "unique", "foreign", "check", "index", "period",
+)
+
+
+# ---------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------
+
+def _unquote(ident: str) -> str:
+    ident = ident.strip()
+    if ident[:1] in ('[', '"') and ident[-1:] in (']', '"'):
+        return ident[1:-1]
+    return ident
+
+
+def _last_part(qualified: str) -> str:
+    """[dbo].[DimCustomer] -> DimCustomer"""
+    parts = re.findall(_IDENT, qualified)
+    return _unquote(parts[-1]) if parts else qualified.strip()
+
+
+def _ident_list(text: str) -> List[str]:
+    """'[SalesOrderNumber], [SalesOrderLineNumber]' -> [...] (sort order dropped)"""
+    out: List[str] = []
+    for item in text.split(','):
+        item = re.sub(r'\s+(ASC|DESC)\s*$', '', item.strip(), flags=re.I)
+        if item:
+            out.append(_unquote(item))
+    return out
+
+
+def _balanced_body(text: str, open_idx: int) -> Optional[str]:
+    """
+    Return the text between the '(' at open_idx and its matching ')'.
+    Quoted identifiers and string literals are skipped so brackets inside
+    them don't confuse the depth count.
+    """
+    depth = 0
+    i = open_idx
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "'":
+            i = text.find("'", i + 1)
+            if i == -1:
+                return None
+        elif ch == '[':
+            i = text.find(']', i + 1)
+            if i == -1:
+                return None
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+            if depth == 0:
+                return text[open_idx + 1:i]
+        i += 1
+    return None
+
+
+def _split_top_level(body: str) -> List[str]:
+    """Split a CREATE TABLE body on commas that are not nested in parens."""
+    items: List[str] = []
+    depth = 0
+    start = 0
+    in_bracket = False
+    in_string = False
+    for i, ch in enumerate(body):
+        if in_string:
+            if ch == "'":
+                in_string = False
+            continue
+        if in_bracket:
+            if ch == ']':
+                in_bracket = False
+            continue
+        if ch == "'":
+            in_string = True
+        elif ch == '[':
+            in_bracket = True
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            items.append(body[start:i].strip())
+            start = i + 1
+    tail = body[start:].strip()
+    if tail:
+        items.append(tail)
+    return items
+
+
+def _parse_column(item: str) -> Optional[DdlColumn]:
+    m = COMPUTED_COL_RE.match(item)
+    if m:
+        return DdlColumn(name=_unquote(m.group(1)), type="computed", nullable=True)
+
+    m = COLUMN_DEF_RE.match(item)
+    if not m:
+        return None
+
+    name = _unquote(m.group(1))
+    type_name = _last_part(m.group(2)).lower()
+    args = m.group(3)
+    rest = m.group(4) or ""
+
+    if args:
+        inner = ", ".join(a.strip() for a in args.strip()[1:-1].split(','))
+        type_name = f"{type_name}({inner.lower()})"
+
+    nullable = not re.search(r'\bNOT\s+NULL\b', rest, re.I)
+    return DdlColumn(name=name, type=type_name, nullable=nullable)
+
+
+def _fk_from_match(table: str, cols: str, ref_table: str, ref_cols: str) -> DdlForeignKey:
+    return DdlForeignKey(
+        table=table,
+        columns=_ident_list(cols),
+        ref_table=_last_part(ref_table),
+        ref_columns=_ident_list(ref_cols),
+    )
+
+
+# ---------------------------------------------------------
+# Public API
+# ---------------------------------------------------------
+
+def parse_ddl(text: str, schema: Optional[DdlSchema] = None) -> DdlSchema:
+    """
+    Parse one DDL script (SSMS "Script Table as CREATE" style, with GO
+    batch separators) and add its tables / foreign keys to `schema`.
+
+    Only CREATE TABLE and ALTER TABLE ... FOREIGN KEY are understood;
+    everything else (USE, SET, CHECK CONSTRAINT, indexes, defaults) is
+    ignored.
+    """
+    schema = schema or DdlSchema()
+
+    text = BLOCK_COMMENT_RE.sub(' ', text)
+    text = LINE_COMMENT_RE.sub('', text)
+
+    for batch in GO_SPLIT_RE.split(text):
+        for m in CREATE_TABLE_RE.finditer(batch):
+            table = _last_part(m.group(1))
+            body = _balanced_body(batch, m.end() - 1)
+            if body is None:
+                continue
+
+            columns: List[DdlColumn] = []
+            for item in _split_top_level(body):
+                if not item:
+                    continue
+                if item.split(None, 1)[0].lower() in TABLE_CONSTRAINT_PREFIXES:
+                    fk = INLINE_FK_RE.match(item)
+                    if fk:
+                        schema.foreign_keys.append(
+                            _fk_from_match(table, fk.group(1), fk.group(2), fk.group(3))
+                        )
+                    continue
+
+                col = _parse_column(item)
+                if col is not None:
+                    columns.append(col)
+
+            schema.tables[table] = columns
+
+        for m in ALTER_FK_RE.finditer(batch):
+            schema.foreign_keys.append(
+                _fk_from_match(_last_part(m.group(1)), m.group(2), m.group(3), m.group(4))
+            )
+
+    return schema
+
+
+def load_ddl_dir(path: str) -> DdlSchema:
+    """
+    Compile every *.sql file under `path` (sorted by file name) into a
+    single DdlSchema. Files are read as UTF-8, falling back to UTF-16 for
+    scripts saved by SSMS with a BOM.
+    """
+    schema = DdlSchema()
+    root = Path(path)
+    if not root.is_dir():
+        raise FileNotFoundError(f"Schema DDL directory not found: {root}")
+
+    for sql_file in sorted(root.glob("*.sql")):
+        raw = sql_file.read_bytes()
+        if raw.startswith((b'\xff\xfe', b'\xfe\xff')):
+            text = raw.decode("utf-16")
+        else:
+            text = raw.decode("utf-8-sig", errors="replace")
+        parse_ddl(text, schema)
+
+    return schema
+
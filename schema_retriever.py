@@ -0,0 +1,257 @@
+# schema_retriever.py
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import SCHEMA_PRUNING, SCHEMA_PRUNE_TOP_K
+from schema_catalog import SchemaCatalog, render_schema_text
+from schema_service import schema_service
+
+
+# ---------------------------------------------------------
+# Mapping hints (same rules the generation prompt spells out)
+# ---------------------------------------------------------
+
+# (question phrases, tables they imply)
+TABLE_HINTS: List[Tuple[Tuple[str, ...], Tuple[str, ...]]] = [
+    (("internet sales", "online sales", "internet order", "internet profit"),
+     ("FactInternetSales",)),
+    (("reseller sales", "reseller orders", "reseller"), ("FactResellerSales",)),
+    (("sales quota", "quota"), ("FactSalesQuota",)),
+    (("survey", "survey responses"), ("FactSurveyResponse",)),
+    (("inventory", "stock", "balance"), ("FactProductInventory",)),
+    (("product", "products"), ("DimProduct",)),
+    (("product category", "product categories"),
+     ("DimProduct", "DimProductSubcategory", "DimProductCategory")),
+    (("city", "cities", "state", "customer country"), ("DimCustomer", "DimGeography")),
+    (("income", "education", "gender", "customer"), ("DimCustomer",)),
+    (("year", "month", "monthly", "quarter", "day", "daily", "date", "season"),
+     ("DimDate",)),
+]
+
+YEAR_RE = re.compile(r"\b(19|20)\d{2}\b")
+WORD_RE = re.compile(r"[a-z0-9]+")
+CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+# Words that carry no table signal in analytics questions
+STOPWORDS = {
+    "a", "an", "and", "the", "of", "for", "by", "in", "on", "to", "per", "with",
+    "top", "all", "over", "between", "vs", "versus", "total", "number", "show",
+    "list", "what", "which", "how", "many", "much", "is", "are", "each", "me",
+    "amount", "key", "id",
+}
+
+# Table-name tokens count more than column-name tokens
+TABLE_NAME_WEIGHT = 3
+
+
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _identifier_tokens(name: str) -> List[str]:
+    """EnglishProductCategoryName -> ['english', 'product', 'category', 'name']"""
+    return [_stem(t.lower()) for t in CAMEL_RE.findall(name)]
+
+
+def _question_tokens(question: str) -> List[str]:
+    return [
+        _stem(w) for w in WORD_RE.findall(question.lower())
+        if w not in STOPWORDS
+    ]
+
+
+# ---------------------------------------------------------
+# Retriever
+# ---------------------------------------------------------
+
+class SchemaRetriever:
+    """
+    Picks the tables a question needs from one SchemaCatalog:
+
+      1. BM25 over table + column name tokens, plus TABLE_HINTS phrases
+      2. top-k candidates expanded along the FK graph, so the bridge
+         tables on the join path (e.g. DimProductSubcategory between
+         DimProduct and DimProductCategory) come along
+    """
+
+    def __init__(self, catalog: SchemaCatalog, k1: float = 1.2, b: float = 0.75):
+        self.catalog = catalog
+        self.k1 = k1
+        self.b = b
+
+        self.doc_tf: Dict[str, Counter] = {}
+        for info in catalog.iter_tables():
+            tf: Counter = Counter()
+            for tok in _identifier_tokens(info.name):
+                tf[tok] += TABLE_NAME_WEIGHT
+            for col in info.columns:
+                tf.update(_identifier_tokens(col.name))
+            self.doc_tf[info.name] = tf
+
+        self.doc_len = {t: sum(tf.values()) for t, tf in self.doc_tf.items()}
+        self.avg_len = (sum(self.doc_len.values()) / len(self.doc_len)) if self.doc_len else 0.0
+
+        df: Counter = Counter()
+        for tf in self.doc_tf.values():
+            df.update(tf.keys())
+        n = len(self.doc_tf)
+        self.idf = {
+            tok: math.log(1 + (n - d + 0.5) / (d + 0.5)) for tok, d in df.items()
+        }
+
+        self.adjacency: Dict[str, Set[str]] = defaultdict(set)
+        for t1, _, t2, _ in catalog.fk_pairs:
+            if t1 != t2:
+                self.adjacency[t1].add(t2)
+
+    # -----------------------------------------------------
+    # Scoring
+    # -----------------------------------------------------
+
+    def score(self, question: str) -> Dict[str, float]:
+        """BM25 score per table for the question (tables with score 0 omitted)."""
+        q_tokens = _question_tokens(question)
+        scores: Dict[str, float] = {}
+        for t, tf in self.doc_tf.items():
+            s = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[t] / (self.avg_len or 1))
+            for tok in q_tokens:
+                f = tf.get(tok)
+                if f:
+                    s += self.idf[tok] * f * (self.k1 + 1) / (f + norm)
+            if s > 0:
+                scores[t] = s
+        return scores
+
+    def hinted_tables(self, question: str) -> List[str]:
+        q = question.lower()
+        out: List[str] = []
+        for phrases, tables in TABLE_HINTS:
+            if any(re.search(rf"\b{re.escape(p)}\b", q) for p in phrases):
+                out.extend(t for t in tables if self.catalog.has_table(t))
+        if YEAR_RE.search(q) and self.catalog.has_table("DimDate"):
+            out.append("DimDate")
+        return list(dict.fromkeys(out))
+
+    # -----------------------------------------------------
+    # Selection + FK expansion
+    # -----------------------------------------------------
+
+    def select_tables(
+        self,
+        question: str,
+        extra_tables: Iterable[str] = (),
+        top_k: int = SCHEMA_PRUNE_TOP_K,
+    ) -> List[str]:
+        """
+        Tables to show the LLM for this question, in catalog order.
+        Empty if nothing matched (callers fall back to the full schema).
+        """
+        scores = self.score(question)
+        seeds = self.hinted_tables(question)
+        for t in extra_tables:
+            info = self.catalog.table(t)
+            if info is not None:
+                seeds.append(info.name)
+        ranked = sorted(scores, key=lambda t: (-scores[t], t))
+        seeds += ranked[:top_k]
+        seeds = list(dict.fromkeys(seeds))
+        if not seeds:
+            return []
+
+        selected: Set[str] = {seeds[0]}
+        for target in seeds[1:]:
+            if target in selected:
+                continue
+            selected.update(self._connect(selected, target, scores))
+
+        return [info.name for info in self.catalog.iter_tables() if info.name in selected]
+
+    def _connect(self, selected: Set[str], target: str, scores: Dict[str, float]) -> List[str]:
+        """
+        Cheapest FK path from any already-selected table to `target`.
+        Hops through tables that scored for the question are slightly
+        cheaper, so among equal-length paths the relevant bridge wins.
+        Returns just [target] if it is not reachable.
+        """
+        best = max(scores.values()) if scores else 1.0
+        dist: Dict[str, float] = {t: 0.0 for t in selected}
+        prev: Dict[str, Optional[str]] = {t: None for t in selected}
+        heap = [(0.0, t) for t in selected]
+        heapq.heapify(heap)
+
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if d > dist.get(node, math.inf):
+                continue
+            for nxt in self.adjacency.get(node, ()):
+                step = 1.0 - 0.5 * scores.get(nxt, 0.0) / best
+                nd = d + step
+                if nd < dist.get(nxt, math.inf):
+                    dist[nxt] = nd
+                    prev[nxt] = node
+                    heapq.heappush(heap, (nd, nxt))
+
+        if target not in prev:
+            return [target]
+
+        path: List[str] = []
+        node: Optional[str] = target
+        while node is not None and node not in selected:
+            path.append(node)
+            node = prev[node]
+        return path
+
+
+# ---------------------------------------------------------
+# Prompt helper
+# ---------------------------------------------------------
+
+_cached: Tuple[Optional[SchemaCatalog], Optional[SchemaRetriever]] = (None, None)
+_cache_lock = threading.Lock()
+
+
+def get_retriever(catalog: SchemaCatalog) -> SchemaRetriever:
+    """One retriever per catalog version; rebuilt after a schema reload."""
+    global _cached
+    cat, retriever = _cached
+    if cat is catalog and retriever is not None:
+        return retriever
+    with _cache_lock:
+        cat, retriever = _cached
+        if cat is not catalog or retriever is None:
+            retriever = SchemaRetriever(catalog)
+            _cached = (catalog, retriever)
+    return retriever
+
+
+def schema_context(
+    question: str,
+    extra_tables: Iterable[str] = (),
+    prune: Optional[bool] = None,
+) -> str:
+    """
+    Schema text for a prompt. With pruning on (SCHEMA_PRUNING, or `prune`),
+    only the question's tables and their FK bridges are included;
+    otherwise, or if retrieval finds nothing, the full schema_text.
+    """
+    catalog = schema_service.catalog
+    if not (SCHEMA_PRUNING if prune is None else prune):
+        return catalog.schema_text
+
+    tables = get_retriever(catalog).select_tables(question, extra_tables)
+    if not tables:
+        return catalog.schema_text
+
+    return render_schema_text(catalog, "relevant to this question", tables)
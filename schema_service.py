@@ -1,77 +1,451 @@
 # schema_service.py
 
-from sqlalchemy import inspect
-from typing import Dict, List, Set
+import logging
+import os
+import threading
+from sqlalchemy import inspect, text
+from typing import Dict, Iterable, KeysView, List, Optional, Set, Tuple
 
 from db import engine
-from config import MAX_SCHEMA_TABLES, MAX_SCHEMA_COLS_PER_TABLE
+from config import (
+    MAX_SCHEMA_TABLES,
+    MAX_SCHEMA_COLS_PER_TABLE,
+    SCHEMA_SOURCE,
+    SCHEMA_DDL_DIR,
+    SCHEMA_DRIFT_CHECK,
+    SCHEMA_SNAPSHOT_PATH,
+    SCHEMA_REFRESH_SECONDS,
+)
+from schema_catalog import SchemaCatalog, render_schema_text
+from schema_ddl import load_ddl_dir
+from join_graph import JoinGraph, JoinStep
+from schema_snapshot import db_fingerprint, ddl_fingerprint, load_snapshot, save_snapshot
+
+logger = logging.getLogger(__name__)
+
+EXCLUDED_TABLES = ("DatabaseLog", "sysdiagrams")
+
+# (column_name, type, nullable)
+ColumnDef = Tuple[str, str, bool]
+# (table, [columns], referred_table, [referred_columns])
+ForeignKeyDef = Tuple[str, List[str], str, List[str]]
+
+
+# Set-based catalog reads for SCHEMA_SOURCE='bulk': one query for every
+# column of every table, one for every FK column pair. `:schema` NULL means
+# the caller's default schema (same as sqlalchemy.inspect without schema=).
+BULK_COLUMNS_SQL = """
+WITH tbl AS (
+    SELECT TOP (:max_tables) t.object_id, t.name
+    FROM sys.tables AS t
+    WHERE t.is_ms_shipped = 0
+      AND t.schema_id = SCHEMA_ID(COALESCE(:schema, SCHEMA_NAME()))
+      AND t.name NOT IN ('DatabaseLog', 'sysdiagrams')
+    ORDER BY t.name
+)
+SELECT tbl.name AS table_name,
+       c.name AS column_name,
+       ty.name AS type_name,
+       c.max_length,
+       c.precision,
+       c.scale,
+       c.is_nullable
+FROM tbl
+JOIN sys.columns AS c ON c.object_id = tbl.object_id
+JOIN sys.types AS ty ON ty.user_type_id = c.user_type_id
+ORDER BY tbl.name, c.column_id;
+"""
+
+BULK_FOREIGN_KEYS_SQL = """
+SELECT pt.name AS table_name,
+       pc.name AS column_name,
+       rt.name AS ref_table,
+       rc.name AS ref_column,
+       fkc.constraint_object_id AS fk_id
+FROM sys.foreign_key_columns AS fkc
+JOIN sys.tables AS pt ON pt.object_id = fkc.parent_object_id
+JOIN sys.columns AS pc
+     ON pc.object_id = fkc.parent_object_id AND pc.column_id = fkc.parent_column_id
+JOIN sys.tables AS rt ON rt.object_id = fkc.referenced_object_id
+JOIN sys.columns AS rc
+     ON rc.object_id = fkc.referenced_object_id AND rc.column_id = fkc.referenced_column_id
+WHERE pt.schema_id = SCHEMA_ID(COALESCE(:schema, SCHEMA_NAME()))
+ORDER BY pt.name, fkc.constraint_object_id, fkc.constraint_column_id;
+"""
+
+# Types whose max_length is in bytes but declared in characters
+_DOUBLE_BYTE_TYPES = ("nchar", "nvarchar")
+_LENGTH_TYPES = ("char", "varchar", "binary", "varbinary", "nchar", "nvarchar")
+_PRECISION_TYPES = ("decimal", "numeric")
+_SCALE_TYPES = ("datetime2", "datetimeoffset", "time")
 
 
 class SchemaService:
-    def __init__(self, engine):
+    def __init__(
+        self,
+        engine,
+        source: str = SCHEMA_SOURCE,
+        ddl_dir: str = SCHEMA_DDL_DIR,
+        schema: Optional[str] = None,
+        max_tables: int = MAX_SCHEMA_TABLES,
+        snapshot_path: Optional[str] = None,
+    ):
         self.engine = engine
-        self.tables: Set[str] = set()
-        self.cols_by_table: Dict[str, List[str]] = {}
-        # fk_pairs holds tuples of (table1, column1, table2, column2)
-        self.fk_pairs: Set[tuple] = set()
-        self.schema_text: str = ""
+        self.source = source
+        self.ddl_dir = ddl_dir
+        # DB schema to read (None = the connection's default schema)
+        self.schema = schema
+        self.max_tables = max_tables
+        # Where the compiled catalog is persisted (None = no snapshot)
+        self.snapshot_path = snapshot_path
+        # Current catalog version; replaced as a whole on reload
+        self.catalog: SchemaCatalog = SchemaCatalog()
+        self._reload_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._stop_refresher = threading.Event()
         self._load_schema()
 
+    # Read-only views of the current catalog, so callers can keep using
+    # schema_service.tables / .cols_by_table / .fk_pairs / .schema_text.
+
+    @property
+    def tables(self) -> KeysView:
+        return self.catalog.tables
+
+    @property
+    def cols_by_table(self) -> Dict[str, List[str]]:
+        return self.catalog.cols_by_table
+
+    @property
+    def col_types(self) -> Dict[str, Dict[str, str]]:
+        return self.catalog.col_types
+
+    @property
+    def col_nullable(self) -> Dict[str, Dict[str, bool]]:
+        return self.catalog.col_nullable
+
+    @property
+    def fk_pairs(self) -> Set[tuple]:
+        return self.catalog.fk_pairs
+
+    @property
+    def schema_text(self) -> str:
+        return self.catalog.schema_text
+
+    @property
+    def fingerprint(self) -> str:
+        return self.catalog.fingerprint
+
+    def join_chain(self, tables: Iterable[str]) -> Tuple[List[JoinStep], List[str]]:
+        """
+        JOIN steps (via FK bridges) connecting `tables`, plus any tables that
+        can't be reached. See JoinGraph.join_chain.
+        """
+        return self.catalog.join_graph.join_chain(tables)
+
     def _load_schema(self) -> None:
         """
-        Introspect the live DB and build a compact schema description
-        for the LLM: tables, columns, and foreign-key relationships.
+        Build a compact schema description for the LLM: tables, columns,
+        and foreign-key relationships.
 
         This avoids dumping full DDL, which is noisy and can confuse
         the model, while staying perfectly consistent with what the
         validator uses.
+
+        The catalog comes from SCHEMA_SOURCE:
+          - 'live': introspect the DB through sqlalchemy.inspect
+          - 'bulk': read sys.tables / sys.columns / sys.foreign_key_columns
+                    in two set-based queries (same result as 'live')
+          - 'ddl':  compile the CREATE TABLE / ALTER TABLE ... FOREIGN KEY
+                    scripts in SCHEMA_DDL_DIR (no DB connection needed)
+
+        With a snapshot_path, a matching snapshot file is loaded instead
+        and no introspection happens at all; freshness is then checked by
+        the refresher (or once, synchronously, if no refresher is used).
         """
+        if self.snapshot_path:
+            cached = load_snapshot(self.snapshot_path, self._snapshot_key())
+            if cached is not None:
+                cached.join_graph = JoinGraph(cached)
+                self.catalog = cached
+                return
+
+        self.catalog = self._compile(self._fingerprint())
+        self._save_snapshot()
+
+    def _compile(self, fingerprint: str) -> SchemaCatalog:
+        if self.source == "live":
+            table_defs, fk_defs = self._read_inspector()
+            label = "from live DB"
+        elif self.source == "bulk":
+            table_defs, fk_defs = self._read_catalog_views()
+            label = "from live DB"
+        elif self.source == "ddl":
+            table_defs, fk_defs = self._read_ddl()
+            label = "from DDL scripts"
+        else:
+            raise ValueError(f"Unknown SCHEMA_SOURCE: {self.source}")
+
+        catalog = self._build(table_defs, fk_defs, label)
+        catalog.fingerprint = fingerprint
+        catalog.join_graph = JoinGraph(catalog)
+        return catalog
+
+    # -----------------------------------------------------
+    # Snapshot + hot reload
+    # -----------------------------------------------------
+
+    def _snapshot_key(self) -> Dict[str, object]:
+        return {
+            "source": self.source,
+            "schema": self.schema,
+            "ddl_dir": os.path.abspath(self.ddl_dir) if self.source == "ddl" else None,
+            "max_tables": self.max_tables,
+            "max_cols": MAX_SCHEMA_COLS_PER_TABLE,
+        }
+
+    def _fingerprint(self) -> str:
+        if self.source == "ddl":
+            return ddl_fingerprint(self.ddl_dir)
+        return db_fingerprint(self.engine)
+
+    def _save_snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+        try:
+            save_snapshot(self.snapshot_path, self.catalog, self._snapshot_key())
+        except OSError as ex:
+            logger.warning("Could not write schema snapshot %s: %s", self.snapshot_path, ex)
+
+    def refresh(self) -> bool:
+        """
+        Recompile the catalog if the schema fingerprint changed.
+
+        The new catalog is built off to the side and swapped in with a
+        single assignment, so in-flight requests keep reading the version
+        they started with. Returns True if a new catalog was installed.
+        """
+        with self._reload_lock:
+            fingerprint = self._fingerprint()
+            if fingerprint == self.catalog.fingerprint:
+                return False
+
+            catalog = self._compile(fingerprint)
+            self.catalog = catalog
+            self._save_snapshot()
+
+        logger.info("Schema catalog reloaded (fingerprint %s).", fingerprint)
+        return True
+
+    def start_refresher(self, interval_seconds: float) -> None:
+        """Poll the fingerprint every interval_seconds in a daemon thread."""
+        if self._refresher is not None:
+            return
+
+        def _loop() -> None:
+            # First check right away: a snapshot may be older than the DB
+            while True:
+                try:
+                    self.refresh()
+                except Exception as ex:
+                    logger.warning("Schema refresh failed: %s", ex)
+                if self._stop_refresher.wait(interval_seconds):
+                    return
+
+        self._refresher = threading.Thread(
+            target=_loop, name="schema-refresher", daemon=True
+        )
+        self._refresher.start()
+
+    def stop_refresher(self) -> None:
+        self._stop_refresher.set()
+
+    # -----------------------------------------------------
+    # Catalog readers
+    # -----------------------------------------------------
+
+    def _read_inspector(self) -> Tuple[Dict[str, List[ColumnDef]], List[ForeignKeyDef]]:
+        """Read tables, columns and FKs from the live DB, one call per table."""
         insp = inspect(self.engine)
         tables = [
-            t for t in insp.get_table_names()
-            if t not in ("DatabaseLog", "sysdiagrams")
+            t for t in insp.get_table_names(schema=self.schema)
+            if t not in EXCLUDED_TABLES
         ]
 
-        lines: List[str] = []
+        table_defs: Dict[str, List[ColumnDef]] = {}
+        fk_defs: List[ForeignKeyDef] = []
 
-        # 1) Table + column listing (bounded by MAX_* config values)
-        for t in tables[:MAX_SCHEMA_TABLES]:
-            cols = [c["name"] for c in insp.get_columns(t)][:MAX_SCHEMA_COLS_PER_TABLE]
-            self.cols_by_table[t] = cols
-            self.tables.add(t)
-            lines.append(f"- {t}: {', '.join(cols)}")
-
-            # 2) Collect foreign-key relationships
-            for fk in insp.get_foreign_keys(t) or []:
+        for t in tables[:self.max_tables]:
+            table_defs[t] = [
+                (c["name"], str(c["type"]).lower(), bool(c.get("nullable", True)))
+                for c in insp.get_columns(t, schema=self.schema)
+            ]
+            for fk in insp.get_foreign_keys(t, schema=self.schema) or []:
                 rt = fk.get("referred_table")
                 lc = fk.get("constrained_columns") or []
                 rc = fk.get("referred_columns") or []
                 if rt and lc and rc:
-                    for c1 in lc:
-                        for c2 in rc:
-                            # store both directions to help the LLM reason
-                            self.fk_pairs.add((t, c1, rt, c2))
-                            self.fk_pairs.add((rt, c2, t, c1))
+                    fk_defs.append((t, list(lc), rt, list(rc)))
+
+        return table_defs, fk_defs
+
+    def _read_catalog_views(self) -> Tuple[Dict[str, List[ColumnDef]], List[ForeignKeyDef]]:
+        """
+        Read tables, columns and FKs from the SQL Server catalog views in
+        two round trips, regardless of how many tables there are.
+        """
+        params = {"schema": self.schema, "max_tables": self.max_tables}
+        with self.engine.connect() as conn:
+            col_rows = conn.execute(text(BULK_COLUMNS_SQL), params).all()
+            fk_rows = conn.execute(text(BULK_FOREIGN_KEYS_SQL), params).all()
+
+        table_defs: Dict[str, List[ColumnDef]] = {}
+        for r in col_rows:
+            table_defs.setdefault(r.table_name, []).append(
+                (r.column_name, _format_sys_type(r), bool(r.is_nullable))
+            )
+
+        # Regroup FK column rows into one (possibly composite) FK per constraint
+        grouped: Dict[int, ForeignKeyDef] = {}
+        for r in fk_rows:
+            if r.table_name not in table_defs:
+                continue
+            fk = grouped.setdefault(r.fk_id, (r.table_name, [], r.ref_table, []))
+            fk[1].append(r.column_name)
+            fk[3].append(r.ref_column)
+
+        return table_defs, list(grouped.values())
+
+    def _read_ddl(self) -> Tuple[Dict[str, List[ColumnDef]], List[ForeignKeyDef]]:
+        """Read tables, columns and FKs from the DDL scripts in ddl_dir."""
+        ddl = load_ddl_dir(self.ddl_dir)
+        tables = [t for t in ddl.tables if t not in EXCLUDED_TABLES]
+
+        table_defs: Dict[str, List[ColumnDef]] = {
+            t: [(c.name, c.type, c.nullable) for c in ddl.tables[t]]
+            for t in tables[:self.max_tables]
+        }
+        fk_defs: List[ForeignKeyDef] = [
+            (fk.table, fk.columns, fk.ref_table, fk.ref_columns)
+            for fk in ddl.foreign_keys
+            if fk.table in table_defs
+        ]
+        return table_defs, fk_defs
+
+    # -----------------------------------------------------
+    # Catalog + prompt text
+    # -----------------------------------------------------
+
+    def _build(
+        self,
+        table_defs: Dict[str, List[ColumnDef]],
+        fk_defs: List[ForeignKeyDef],
+        label: str,
+    ) -> SchemaCatalog:
+        catalog = SchemaCatalog()
+
+        # 1) Table + column listing (bounded by MAX_* config values)
+        for t, col_defs in table_defs.items():
+            catalog.add_table(t, col_defs[:MAX_SCHEMA_COLS_PER_TABLE])
+
+        # 2) Collect foreign-key relationships
+        for t, lc, rt, rc in fk_defs:
+            # composite keys pair up positionally; add_fk stores both
+            # directions to help the LLM reason
+            for c1, c2 in zip(lc, rc):
+                catalog.add_fk(t, c1, rt, c2)
 
         # 3) Human-readable schema text for the LLM
-        schema_parts: List[str] = []
+        catalog.schema_text = render_schema_text(catalog, label)
+        return catalog
+
+    # -----------------------------------------------------
+    # Drift check (DDL catalog vs. live DB)
+    # -----------------------------------------------------
+
+    def check_drift(self) -> List[str]:
+        """
+        Compare this catalog with the live DB and return human-readable
+        differences (missing/extra tables and columns, nullability, base
+        type and FK changes). An empty list means no drift.
+        """
+        live = SchemaService(
+            self.engine, source="bulk", schema=self.schema, max_tables=self.max_tables
+        )
+        diffs: List[str] = []
 
-        schema_parts.append("Known tables & columns (from live DB):")
-        schema_parts.append("\n".join(lines))
+        for t in sorted(self.tables - live.tables):
+            diffs.append(f"table {t} is not in the live DB")
+        for t in sorted(live.tables - self.tables):
+            diffs.append(f"table {t} is missing from the catalog")
 
-        # Add a FK section if we found any
-        if self.fk_pairs:
-            rel_lines: List[str] = []
-            # sort for deterministic output
-            for t1, c1, t2, c2 in sorted(self.fk_pairs):
-                rel_lines.append(f"- {t1}.{c1} → {t2}.{c2}")
+        for t in sorted(self.tables & live.tables):
+            ours = set(self.cols_by_table.get(t, []))
+            theirs = set(live.cols_by_table.get(t, []))
+            for c in sorted(ours - theirs):
+                diffs.append(f"column {t}.{c} is not in the live DB")
+            for c in sorted(theirs - ours):
+                diffs.append(f"column {t}.{c} is missing from the catalog")
+            for c in sorted(ours & theirs):
+                if self.col_nullable[t][c] != live.col_nullable[t][c]:
+                    diffs.append(f"column {t}.{c} nullability differs")
+                if _base_type(self.col_types[t][c]) != _base_type(live.col_types[t][c]):
+                    diffs.append(
+                        f"column {t}.{c} type differs: "
+                        f"{self.col_types[t][c]} vs live {live.col_types[t][c]}"
+                    )
 
-            schema_parts.append("\nKnown foreign-key relationships:")
-            schema_parts.append("\n".join(rel_lines))
+        for t1, c1, t2, c2 in sorted(self.fk_pairs ^ live.fk_pairs):
+            where = "catalog" if (t1, c1, t2, c2) in self.fk_pairs else "live DB"
+            diffs.append(f"foreign key {t1}.{c1} → {t2}.{c2} only in {where}")
 
-        # Join into a single text blob
-        self.schema_text = "\n".join(schema_parts)
+        return diffs
+
+
+def _base_type(type_name: str) -> str:
+    """'nvarchar(50) collate "..."' -> 'nvarchar'"""
+    return type_name.split("(", 1)[0].split(" ", 1)[0].strip().lower()
+
+
+def _format_sys_type(row) -> str:
+    """Render a sys.columns/sys.types row like the DDL: nvarchar(50), decimal(18, 4)."""
+    name = row.type_name.lower()
+    if name in _LENGTH_TYPES:
+        if row.max_length == -1:
+            return f"{name}(max)"
+        length = row.max_length // 2 if name in _DOUBLE_BYTE_TYPES else row.max_length
+        return f"{name}({length})"
+    if name in _PRECISION_TYPES:
+        return f"{name}({row.precision}, {row.scale})"
+    if name in _SCALE_TYPES:
+        return f"{name}({row.scale})"
+    return name
+
+
+def _log_drift(service: SchemaService) -> None:
+    try:
+        diffs = service.check_drift()
+    except Exception as ex:
+        logger.warning("Schema drift check failed: %s", ex)
+        return
+    if diffs:
+        logger.warning(
+            "Schema catalog differs from live DB (%d differences):\n%s",
+            len(diffs), "\n".join(f"  - {d}" for d in diffs),
+        )
+    else:
+        logger.info("Schema catalog matches live DB.")
 
 
 # Singleton instance used by the rest of the app
-schema_service = SchemaService(engine)
+schema_service = SchemaService(engine, snapshot_path=SCHEMA_SNAPSHOT_PATH or None)
+
+if SCHEMA_REFRESH_SECONDS > 0:
+    schema_service.start_refresher(SCHEMA_REFRESH_SECONDS)
+elif schema_service.snapshot_path:
+    # No background refresher: make sure a loaded snapshot isn't stale
+    schema_service.refresh()
+
+if SCHEMA_DRIFT_CHECK and schema_service.source == "ddl":
+    # Don't hold up startup on the live round trips
+    threading.Thread(target=_log_drift, args=(schema_service,), daemon=True).start()
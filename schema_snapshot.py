@@ -0,0 +1,100 @@
+# schema_snapshot.py
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from schema_catalog import SchemaCatalog
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Any CREATE/ALTER bumps some object's modify_date; DROP lowers the count.
+DB_FINGERPRINT_SQL = """
+SELECT CONVERT(varchar(33), MAX(modify_date), 126) AS max_modify_date,
+       COUNT(*) AS object_count
+FROM sys.objects
+WHERE is_ms_shipped = 0;
+"""
+
+
+# ---------------------------------------------------------
+# Fingerprints
+# ---------------------------------------------------------
+
+def db_fingerprint(engine) -> str:
+    """One cheap round trip that changes whenever the DB schema changes."""
+    with engine.connect() as conn:
+        row = conn.execute(text(DB_FINGERPRINT_SQL)).one()
+    return f"db:{row.max_modify_date}|{row.object_count}"
+
+
+def ddl_fingerprint(ddl_dir: str) -> str:
+    """Content hash of the *.sql files a DDL catalog is compiled from."""
+    h = hashlib.sha1()
+    for sql_file in sorted(Path(ddl_dir).glob("*.sql")):
+        h.update(sql_file.name.encode("utf-8"))
+        h.update(sql_file.read_bytes())
+    return f"ddl:{h.hexdigest()}"
+
+
+# ---------------------------------------------------------
+# Snapshot file
+# ---------------------------------------------------------
+
+def save_snapshot(path: str, catalog: SchemaCatalog, key: Dict[str, Any]) -> None:
+    """
+    Serialize a catalog to `path`. Written to a temp file and renamed over
+    the old snapshot, so concurrent readers never see a partial file.
+
+    `key` describes how the catalog was built (source, schema, limits); a
+    snapshot is only reused by a service configured the same way.
+    """
+    payload = {
+        "format": SNAPSHOT_FORMAT_VERSION,
+        "key": key,
+        "fingerprint": catalog.fingerprint,
+        "tables": {
+            info.name: [[c.name, c.type, c.nullable] for c in info.columns]
+            for info in catalog.iter_tables()
+        },
+        "fk_pairs": sorted(list(p) for p in catalog.fk_pairs),
+        "schema_text": catalog.schema_text,
+    }
+
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp, target)
+
+
+def load_snapshot(path: str, key: Dict[str, Any]) -> Optional[SchemaCatalog]:
+    """
+    Load a catalog saved by save_snapshot. Returns None if the file is
+    missing, unreadable, from another format version, or built with a
+    different key.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if payload.get("format") != SNAPSHOT_FORMAT_VERSION or payload.get("key") != key:
+        return None
+
+    catalog = SchemaCatalog(
+        fingerprint=payload.get("fingerprint", ""),
+        schema_text=payload.get("schema_text", ""),
+    )
+    for t, col_defs in payload.get("tables", {}).items():
+        catalog.add_table(t, [(c, typ, bool(n)) for c, typ, n in col_defs])
+    for t1, c1, t2, c2 in payload.get("fk_pairs", []):
+        catalog.add_fk(t1, c1, t2, c2)
+
+    return catalog
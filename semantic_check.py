@@ -0,0 +1,1153 @@
+# semantic_check.py
+
+import datetime as dt
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from schema_catalog import ColumnInfo, TableInfo
+from schema_service import schema_service
+from sql_parser import ParsedSql, Token, SYSTEM_SCHEMAS, parse_sql
+
+
+# ---------------------------------------------------------
+# 1) Verdicts
+# ---------------------------------------------------------
+
+VALID = "valid"
+INVALID = "invalid"
+UNSURE = "unsure"
+
+
+@dataclass(frozen=True)
+class Verdict:
+    """
+    status:  "valid" (compiles; preflight can be skipped), "invalid"
+             (definitely fails; message says why) or "unsure" (needs
+             the SQL Server preflight)
+    message: error for "invalid", the construct that made it "unsure"
+    """
+    status: str
+    message: str = ""
+
+
+class _Unsure(Exception):
+    pass
+
+
+class _Invalid(Exception):
+    pass
+
+
+# ---------------------------------------------------------
+# 2) Vocabulary
+# ---------------------------------------------------------
+
+# Type classes an expression can have; only pairings known to compile are
+# accepted, everything else is unsure
+T_INT = "int"            # int / bigint / smallint / tinyint
+T_NUM = "num"            # decimal, numeric, money, float, real
+T_BIT = "bit"
+T_STR = "str"            # char / varchar / nchar / nvarchar value
+T_STRLIT = "strlit"      # string literal (implicitly converts)
+T_DATE = "date"          # date, datetime2, datetimeoffset
+T_DATETIME = "datetime"  # datetime, smalldatetime (allow + / - numbers)
+T_TIME = "time"
+T_NULL = "null"
+T_BOOL = "bool"          # predicate, only where a condition goes
+T_OTHER = "other"        # binary, text, xml, ...: only selected / counted
+
+NUMERIC = frozenset({T_INT, T_NUM, T_BIT})
+STRINGS = frozenset({T_STR, T_STRLIT})
+DATES = frozenset({T_DATE, T_DATETIME})
+
+# SQL type name -> (type class, allowed arguments: None, "len", "prec", "float", "frac")
+SQL_TYPES: Dict[str, Tuple[str, Optional[str]]] = {
+    "int": (T_INT, None), "bigint": (T_INT, None), "smallint": (T_INT, None), "tinyint": (T_INT, None),
+    "bit": (T_BIT, None),
+    "decimal": (T_NUM, "prec"), "numeric": (T_NUM, "prec"), "money": (T_NUM, None),
+    "smallmoney": (T_NUM, None), "float": (T_NUM, "float"), "real": (T_NUM, None),
+    "char": (T_STR, "len"), "varchar": (T_STR, "len"), "nchar": (T_STR, "len"), "nvarchar": (T_STR, "len"),
+    "date": (T_DATE, None), "datetime2": (T_DATE, "frac"), "datetimeoffset": (T_DATE, "frac"),
+    "datetime": (T_DATETIME, None), "smalldatetime": (T_DATETIME, None),
+    "time": (T_TIME, "frac"),
+}
+
+# Date part keywords -> canonical part
+DATEPARTS = {
+    "year": "year", "yy": "year", "yyyy": "year",
+    "quarter": "quarter", "qq": "quarter", "q": "quarter",
+    "month": "month", "mm": "month", "m": "month",
+    "dayofyear": "dayofyear", "dy": "dayofyear", "y": "dayofyear",
+    "day": "day", "dd": "day", "d": "day",
+    "week": "week", "wk": "week", "ww": "week",
+    "weekday": "weekday", "dw": "weekday", "w": "weekday",
+    "hour": "hour", "hh": "hour",
+    "minute": "minute", "mi": "minute", "n": "minute",
+    "second": "second", "ss": "second", "s": "second",
+    "millisecond": "millisecond", "ms": "millisecond",
+    "microsecond": "microsecond", "mcs": "microsecond",
+    "nanosecond": "nanosecond", "ns": "nanosecond",
+    "tzoffset": "tzoffset", "tz": "tzoffset",
+    "iso_week": "iso_week", "isowk": "iso_week", "isoww": "iso_week",
+}
+_TIME_PARTS = {"hour", "minute", "second", "millisecond", "microsecond"}
+_ARITH_PARTS = {"year", "quarter", "month", "dayofyear", "day", "week", "nanosecond"} | _TIME_PARTS
+
+# Function -> date parts it accepts
+DATEPART_FUNCTIONS = {
+    "DATEPART": frozenset(DATEPARTS.values()),
+    "DATENAME": frozenset(DATEPARTS.values()),
+    "DATEADD": frozenset(_ARITH_PARTS | {"weekday"}),
+    "DATEDIFF": frozenset(_ARITH_PARTS),
+    "DATEDIFF_BIG": frozenset(_ARITH_PARTS),
+    "DATETRUNC": frozenset((_ARITH_PARTS - {"nanosecond"}) | {"iso_week"}),
+}
+
+# Built-ins we know the signature of; any other function call -> unsure.
+#   name -> (min args, max args, argument kinds, result)
+# Argument kinds, one letter per position ("*" repeats the last one):
+#   n number, i integer, s string, d date, p date part, b condition,
+#   a any value, A any value incl. binary, x number or date/time
+# Results: a type class, "0" type of the first argument, "u" / "u1"
+# common type of all / all but the first argument, "dl" date type of the
+# last argument
+FUNCTIONS: Dict[str, Tuple[int, int, str, str]] = {
+    "ABS": (1, 1, "n", "0"), "CEILING": (1, 1, "n", "0"), "FLOOR": (1, 1, "n", "0"),
+    "ROUND": (2, 3, "nii", "0"), "SIGN": (1, 1, "n", "0"),
+    "POWER": (2, 2, "nn", T_NUM), "SQRT": (1, 1, "n", T_NUM), "SQUARE": (1, 1, "n", T_NUM),
+    "LOG": (1, 2, "nn", T_NUM), "LOG10": (1, 1, "n", T_NUM), "EXP": (1, 1, "n", T_NUM),
+    "LEN": (1, 1, "s", T_INT), "DATALENGTH": (1, 1, "A", T_INT),
+    "LEFT": (2, 2, "si", T_STR), "RIGHT": (2, 2, "si", T_STR), "SUBSTRING": (3, 3, "sii", T_STR),
+    "UPPER": (1, 1, "s", T_STR), "LOWER": (1, 1, "s", T_STR), "LTRIM": (1, 1, "s", T_STR),
+    "RTRIM": (1, 1, "s", T_STR), "TRIM": (1, 1, "s", T_STR), "REVERSE": (1, 1, "s", T_STR),
+    "REPLACE": (3, 3, "sss", T_STR), "REPLICATE": (2, 2, "si", T_STR),
+    "CHARINDEX": (2, 3, "ssi", T_INT), "PATINDEX": (2, 2, "ss", T_INT),
+    "CONCAT": (2, 254, "a*", T_STR), "CONCAT_WS": (3, 254, "sa*", T_STR),
+    "STUFF": (4, 4, "siis", T_STR), "FORMAT": (2, 3, "xss", T_STR), "STR": (1, 3, "nii", T_STR),
+    "QUOTENAME": (1, 2, "ss", T_STR),
+    "ISNULL": (2, 2, "aa", "0"), "NULLIF": (2, 2, "aa", "0"), "COALESCE": (2, 254, "a*", "u"),
+    "IIF": (3, 3, "baa", "u1"),
+    "GETDATE": (0, 0, "", T_DATETIME), "GETUTCDATE": (0, 0, "", T_DATETIME),
+    "SYSDATETIME": (0, 0, "", T_DATE), "SYSUTCDATETIME": (0, 0, "", T_DATE),
+    "YEAR": (1, 1, "d", T_INT), "MONTH": (1, 1, "d", T_INT), "DAY": (1, 1, "d", T_INT),
+    "DATEPART": (2, 2, "pd", T_INT), "DATENAME": (2, 2, "pd", T_STR),
+    "DATEADD": (3, 3, "pid", "dl"), "DATEDIFF": (3, 3, "pdd", T_INT), "DATEDIFF_BIG": (3, 3, "pdd", T_INT),
+    "DATETRUNC": (2, 2, "pd", "dl"), "EOMONTH": (1, 2, "di", T_DATE), "DATEFROMPARTS": (3, 3, "iii", T_DATE),
+}
+
+AGGREGATES = frozenset({
+    "SUM", "COUNT", "COUNT_BIG", "AVG", "MIN", "MAX", "STDEV", "STDEVP",
+    "VAR", "VARP", "STRING_AGG", "APPROX_COUNT_DISTINCT",
+})
+
+# Constants usable without parentheses
+NILADIC = frozenset({"NULL", "CURRENT_TIMESTAMP", "CURRENT_USER", "SESSION_USER", "SYSTEM_USER"})
+
+# Keywords with a known role inside an expression
+EXPR_KEYWORDS = frozenset({
+    "AND", "OR", "NOT", "IS", "IN", "LIKE", "BETWEEN", "ESCAPE",
+    "CASE", "WHEN", "THEN", "ELSE", "END", "AS", "DISTINCT",
+}) | NILADIC
+
+# Other T-SQL reserved words: seeing one where a column could be -> unsure
+TSQL_RESERVED = frozenset({
+    "ADD", "ALL", "ALTER", "ANY", "ASC", "BACKUP", "BEGIN", "BROWSE", "BULK",
+    "BY", "CHECK", "COLLATE", "COLUMN", "COMPUTE", "CONTAINS", "CROSS",
+    "CURRENT", "CURSOR", "DATABASE", "DECLARE", "DEFAULT", "DELETE", "DESC",
+    "DROP", "EXCEPT", "EXEC", "EXECUTE", "EXISTS", "EXTERNAL", "FETCH",
+    "FOR", "FREETEXT", "FROM", "FULL", "FUNCTION", "GROUP", "HAVING",
+    "IDENTITY", "INNER", "INSERT", "INTERSECT", "INTO", "JOIN", "KEY",
+    "MERGE", "OF", "OFF", "OFFSETS", "ON", "OPEN", "OPENQUERY", "OPENROWSET",
+    "OPTION", "ORDER", "OUTER", "OVER", "PERCENT", "PIVOT", "PLAN",
+    "PRIMARY", "PROCEDURE", "RIGHT", "LEFT", "SCHEMA", "SELECT", "SET",
+    "SOME", "TABLE", "TABLESAMPLE", "TOP", "UNION", "UNIQUE", "UNPIVOT",
+    "UPDATE", "USER", "VALUES", "VIEW", "WHERE", "WITH", "WITHIN",
+    "OFFSET", "ROWS", "ONLY", "NEXT", "TIES", "APPLY",
+})
+
+# Words that make a parenthesized group a condition rather than a value
+PREDICATE_WORDS = frozenset({"AND", "OR", "NOT", "IS", "IN", "LIKE", "BETWEEN", "EXISTS"})
+
+COMPARISONS = frozenset({"=", "<>", "!=", "<", ">", "<=", ">="})
+
+JOIN_WORDS = frozenset({"INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "JOIN"})
+
+# Top-level clauses, in the only order we analyze
+CLAUSE_ORDER = ("SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER")
+
+# Clauses whose expression is a condition
+CONDITION_CLAUSES = frozenset({"WHERE", "ON", "HAVING"})
+
+
+def _is_name(tok: Token) -> bool:
+    return tok.kind == "ident" or (
+        tok.kind == "word"
+        and tok.upper not in TSQL_RESERVED
+        and tok.upper not in EXPR_KEYWORDS
+        and not tok.value.startswith(("@", "#"))
+    )
+
+
+def _literal_body(text: str) -> str:
+    return text[2:-1] if text[:1] in "Nn" else text[1:-1]
+
+
+def _numeric_literal(text: str) -> bool:
+    try:
+        float(_literal_body(text).strip())
+        return True
+    except ValueError:
+        return False
+
+
+def _date_literal(text: str) -> bool:
+    """'2004-01-01', '20040101', '2004-01-01 10:00:00' (unambiguous formats only)."""
+    body = _literal_body(text).strip()
+    try:
+        if re.fullmatch(r"\d{8}", body):
+            dt.datetime.strptime(body, "%Y%m%d")
+        elif re.fullmatch(r"\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d{1,7})?)?)?", body):
+            dt.datetime.fromisoformat(body[:26])
+        else:
+            return False
+        return True
+    except ValueError:
+        return False
+
+
+def _type_class(sql_type: str) -> str:
+    """Type class of a catalog column type like nvarchar(50)."""
+    spec = SQL_TYPES.get(sql_type.split("(")[0].strip().lower())
+    return spec[0] if spec is not None else T_OTHER
+
+
+# ---------------------------------------------------------
+# 3) Expression analysis
+# ---------------------------------------------------------
+
+@dataclass
+class _ColumnUse:
+    table: TableInfo
+    column: ColumnInfo
+    text: str
+    in_aggregate: bool
+
+
+@dataclass
+class _Expr:
+    canonical: str = ""
+    uses: List[_ColumnUse] = field(default_factory=list)
+    has_aggregate: bool = False
+
+    @property
+    def plain_column(self) -> Optional[Tuple[str, str]]:
+        """(table, column) if the expression is exactly one column."""
+        if len(self.uses) == 1 and self.canonical == self._key(self.uses[0]):
+            return self.uses[0].table.name, self.uses[0].column.name
+        return None
+
+    @staticmethod
+    def _key(use: _ColumnUse) -> str:
+        return f"{use.table.name}.{use.column.name}".upper()
+
+
+@dataclass
+class _SelectItem:
+    expr: Optional[_Expr]  # None for * / alias.*
+    alias: Optional[str]
+
+
+@dataclass
+class _Value:
+    """Type of one parsed (sub)expression."""
+    cls: str
+    column: Optional[_ColumnUse] = None  # set when it is exactly one column
+    literal: Optional[str] = None        # set when it is exactly one string literal
+
+
+class _ExprParser:
+    """
+    Recursive-descent parser for one expression over tokens [lo, hi) that
+    types every operand. Anything it can't fully check (unknown functions,
+    OVER, subqueries, comparisons whose implicit conversion may fail, ...)
+    raises _Unsure; errors it can prove raise _Invalid.
+
+      condition := and_cond { OR and_cond }
+      and_cond  := not_cond { AND not_cond }
+      not_cond  := NOT not_cond | ( condition ) | predicate
+      predicate := value ( cmp value | [NOT] BETWEEN value AND value
+                         | [NOT] IN ( value, ... ) | [NOT] LIKE value [ESCAPE 'c']
+                         | IS [NOT] NULL )
+      value     := term { +|- term }
+      term      := factor { *|/|% factor }
+      factor    := +|- factor | primary
+      primary   := number | string | NULL | CASE ... END | CAST / CONVERT
+                   | function ( args ) | ( value ) | column
+    """
+
+    def __init__(self, analyzer: "_Analyzer", lo: int, hi: int, clause: str):
+        self.analyzer = analyzer
+        self.toks = analyzer.toks
+        self.k = lo
+        self.hi = hi
+        self.clause = clause
+        self.canon: List[str] = []
+        self.uses: List[_ColumnUse] = []
+        self.has_aggregate = False
+        self.in_aggregate = False
+
+    # -----------------------------------------------------
+    # Tokens
+    # -----------------------------------------------------
+
+    def peek(self, off: int = 0) -> Optional[Token]:
+        k = self.k + off
+        return self.toks[k] if k < self.hi else None
+
+    def word(self, off: int = 0) -> str:
+        t = self.peek(off)
+        return t.upper if t is not None and t.kind == "word" else ""
+
+    def at_op(self, *ops: str) -> bool:
+        t = self.peek()
+        return t is not None and t.kind == "op" and t.value in ops
+
+    def take(self) -> Token:
+        t = self.toks[self.k]
+        self.k += 1
+        self.canon.append(t.upper if t.kind == "word" else t.value)
+        return t
+
+    def expect_op(self, op: str, what: str) -> None:
+        if not self.at_op(op):
+            raise _Unsure(f"{what}: expected {op!r}")
+        self.take()
+
+    def parse(self) -> None:
+        if self.k >= self.hi:
+            raise _Unsure(f"empty expression in {self.clause}")
+        if self.clause in CONDITION_CLAUSES:
+            self.condition()
+        else:
+            self.value()
+        if self.k < self.hi:
+            raise _Unsure(f"unexpected {self.toks[self.k].value!r} in {self.clause}")
+
+    # -----------------------------------------------------
+    # Conditions
+    # -----------------------------------------------------
+
+    def condition(self) -> None:
+        self.and_cond()
+        while self.word() == "OR":
+            self.take()
+            self.and_cond()
+
+    def and_cond(self) -> None:
+        self.not_cond()
+        while self.word() == "AND":
+            self.take()
+            self.not_cond()
+
+    def not_cond(self) -> None:
+        if self.word() == "NOT":
+            self.take()
+            self.not_cond()
+        elif self.word() == "EXISTS":
+            raise _Unsure("EXISTS")
+        elif self.at_op("(") and self._condition_group():
+            self.take()
+            self.condition()
+            self.expect_op(")", "condition")
+        else:
+            self.predicate()
+
+    def _condition_group(self) -> bool:
+        """Is the parenthesized group at self.k a condition (vs. a value)?"""
+        open_tok = self.toks[self.k]
+        case_depth = 0
+        for t in self.toks[self.k + 1:self.hi]:
+            if t.depth <= open_tok.depth:
+                break
+            if t.depth != open_tok.depth + 1:
+                continue
+            if t.upper == "CASE":
+                case_depth += 1
+            elif t.upper == "END":
+                case_depth -= 1
+            elif case_depth == 0 and (
+                t.upper in PREDICATE_WORDS or (t.kind == "op" and t.value in COMPARISONS)
+            ):
+                return True
+        return False
+
+    def predicate(self) -> None:
+        left = self.value()
+        negated = self.word() == "NOT" and self.word(1) in ("IN", "LIKE", "BETWEEN")
+        if negated:
+            self.take()
+        w = self.word()
+
+        if w == "IS" and not negated:
+            self.take()
+            if self.word() == "NOT":
+                self.take()
+            if self.word() != "NULL":
+                raise _Unsure("IS without NULL")
+            self.take()
+        elif w == "IN":
+            self.take()
+            self.expect_op("(", "IN")
+            while True:
+                self.compare(left, self.value())
+                if not self.at_op(","):
+                    break
+                self.take()
+            self.expect_op(")", "IN list")
+        elif w == "BETWEEN":
+            self.take()
+            self.compare(left, self.value())
+            if self.word() != "AND":
+                raise _Unsure("BETWEEN without AND")
+            self.take()
+            self.compare(left, self.value())
+        elif w == "LIKE":
+            self.take()
+            pattern = self.value()
+            if left.cls not in STRINGS or pattern.cls not in STRINGS:
+                raise _Unsure(f"LIKE on {left.cls} / {pattern.cls}")
+            if self.word() == "ESCAPE":
+                self.take()
+                if self.value().cls != T_STRLIT:
+                    raise _Unsure("ESCAPE")
+        elif self.at_op(*COMPARISONS) and not negated:
+            self.take()
+            self.compare(left, self.value())
+        else:
+            raise _Unsure("expected a comparison")
+
+    def compare(self, a: _Value, b: _Value) -> None:
+        """a and b must compare without a failing implicit conversion."""
+        if T_NULL in (a.cls, b.cls):
+            return
+        if a.cls in NUMERIC and b.cls in NUMERIC:
+            return
+        if a.cls in STRINGS and b.cls in STRINGS:
+            if a.cls == b.cls == T_STR:
+                raise _Unsure("string comparison between two values (collation)")
+            return
+        if a.cls in DATES and b.cls in DATES or a.cls == b.cls == T_TIME:
+            return
+        for x, y in ((a, b), (b, a)):
+            if y.cls != T_STRLIT:
+                continue
+            if x.cls in NUMERIC:
+                if _numeric_literal(y.literal):
+                    return
+                # x.OrderDateKey = '2004-01-01': varchar -> int conversion fails
+                if x.cls == T_INT and x.column is not None:
+                    raise _Invalid(
+                        f"Conversion failed when converting the varchar value {y.literal} "
+                        f"to data type {x.column.column.type.split('(')[0].lower()} ({x.column.text})."
+                    )
+            elif x.cls in DATES and _date_literal(y.literal):
+                return
+        raise _Unsure(f"comparison of {a.cls} with {b.cls}")
+
+    # -----------------------------------------------------
+    # Values
+    # -----------------------------------------------------
+
+    def value(self) -> _Value:
+        left = self.term()
+        while self.at_op("+", "-"):
+            op = self.take().value
+            left = self.arith(op, left, self.term())
+        return left
+
+    def term(self) -> _Value:
+        left = self.factor()
+        while self.at_op("*", "/", "%"):
+            op = self.take().value
+            left = self.arith(op, left, self.factor())
+        return left
+
+    def factor(self) -> _Value:
+        if self.at_op("+", "-"):
+            self.take()
+            v = self.factor()
+            if v.cls not in NUMERIC:
+                raise _Unsure(f"sign on {v.cls}")
+            return _Value(T_INT if v.cls == T_BIT else v.cls)
+        return self.primary()
+
+    def arith(self, op: str, a: _Value, b: _Value) -> _Value:
+        if a.cls == T_NULL or b.cls == T_NULL:
+            other = b if a.cls == T_NULL else a
+            if other.cls in (T_BOOL, T_OTHER):
+                raise _Unsure(f"{op} on {other.cls}")
+            return _Value(other.cls)
+        if a.cls in NUMERIC and b.cls in NUMERIC:
+            if op == "%" and T_NUM in (a.cls, b.cls):
+                raise _Unsure("% on non-integers")
+            return _Value(T_NUM if T_NUM in (a.cls, b.cls) else T_INT)
+        if op == "+" and a.cls in STRINGS and b.cls in STRINGS:
+            return _Value(T_STR)
+        if op in ("+", "-") and (
+            (a.cls == T_DATETIME and b.cls in NUMERIC | {T_DATETIME})
+            or (op == "+" and a.cls in NUMERIC and b.cls == T_DATETIME)
+        ):
+            return _Value(T_DATETIME)
+        raise _Unsure(f"{op} on {a.cls} and {b.cls}")
+
+    def primary(self) -> _Value:
+        t = self.peek()
+        if t is None:
+            raise _Unsure(f"{self.clause} expression ends early")
+        nxt = self.peek(1)
+        call = nxt is not None and nxt.kind == "op" and nxt.value == "("
+
+        if t.kind == "number":
+            self.take()
+            return _Value(T_NUM if any(c in t.value for c in ".eE") else T_INT)
+        if t.kind == "string":
+            self.take()
+            return _Value(T_STRLIT, literal=t.value)
+        if t.kind == "op" and t.value == "(":
+            self.take()
+            v = self.value()
+            self.expect_op(")", "parenthesized value")
+            return _Value(v.cls, literal=v.literal)
+        if t.kind == "word":
+            if t.upper == "NULL":
+                self.take()
+                return _Value(T_NULL)
+            if t.upper == "CURRENT_TIMESTAMP":
+                self.take()
+                return _Value(T_DATETIME)
+            if t.upper == "CASE":
+                return self.case()
+            if call and t.upper in ("CAST", "TRY_CAST", "CONVERT", "TRY_CONVERT"):
+                return self.cast()
+            if call:
+                return self.call()
+        if _is_name(t):
+            return self.column()
+        raise _Unsure(f"token {t.value!r}")
+
+    def column(self) -> _Value:
+        toks, j = self.toks, self.k + 1
+        parts = [toks[self.k].value]
+        while j + 1 < self.hi and toks[j].value == "." and toks[j + 1].kind in ("word", "ident"):
+            parts.append(toks[j + 1].value)
+            j += 2
+        table, col = self.analyzer.resolve(parts)
+        use = _ColumnUse(table, col, ".".join(parts), self.in_aggregate)
+        self.uses.append(use)
+        self.canon.append(f"{table.name}.{col.name}".upper())
+        self.k = j
+        return _Value(_type_class(col.type), column=use)
+
+    def case(self) -> _Value:
+        self.take()  # CASE
+        operand = self.value() if self.word() != "WHEN" else None
+        if self.word() != "WHEN":
+            raise _Unsure("CASE without WHEN")
+        results = []
+        while self.word() == "WHEN":
+            self.take()
+            if operand is None:
+                self.condition()
+            else:
+                self.compare(operand, self.value())
+            if self.word() != "THEN":
+                raise _Unsure("WHEN without THEN")
+            self.take()
+            results.append(self.value())
+        if self.word() == "ELSE":
+            self.take()
+            results.append(self.value())
+        if self.word() != "END":
+            raise _Unsure("CASE without END")
+        self.take()
+        return self.common_type(results, "CASE")
+
+    def common_type(self, values: List[_Value], what: str) -> _Value:
+        """Result type of CASE / COALESCE / IIF branches; unsure unless one family."""
+        classes = {v.cls for v in values} - {T_NULL}
+        if not classes:
+            raise _Unsure(f"{what} of only NULLs")
+        if classes <= NUMERIC:
+            return _Value(T_NUM if T_NUM in classes else T_INT if T_INT in classes else T_BIT)
+        if classes <= STRINGS:
+            return _Value(T_STR)
+        if classes <= DATES:
+            return _Value(T_DATETIME if classes == {T_DATETIME} else T_DATE)
+        if classes == {T_TIME}:
+            return _Value(T_TIME)
+        raise _Unsure(f"{what} mixes {', '.join(sorted(classes))}")
+
+    # -----------------------------------------------------
+    # Conversions and calls
+    # -----------------------------------------------------
+
+    def type_name(self) -> str:
+        t = self.peek()
+        spec = SQL_TYPES.get(t.value.lower()) if t is not None and t.kind == "word" else None
+        if spec is None:
+            raise _Unsure(f"type {t.value if t is not None else ''!r}")
+        self.take()
+        cls, arg_kind = spec
+        if not self.at_op("("):
+            return cls
+        if arg_kind is None:
+            raise _Unsure(f"arguments to type {t.value}")
+        self.take()
+        args: List = []
+        while True:
+            a = self.peek()
+            if a is not None and a.kind == "number" and a.value.isdigit():
+                args.append(int(a.value))
+            elif a is not None and a.upper == "MAX" and not args:
+                args.append("MAX")
+            else:
+                raise _Unsure(f"arguments to type {t.value}")
+            self.take()
+            if not self.at_op(","):
+                break
+            self.take()
+        self.expect_op(")", f"type {t.value}")
+
+        name, n = t.value.lower(), args[0]
+        if arg_kind == "len":
+            ok = len(args) == 1 and (
+                (n == "MAX" and name.startswith(("var", "nvar")))
+                or (n != "MAX" and 1 <= n <= (4000 if name.startswith("n") else 8000))
+            )
+        elif arg_kind == "prec":
+            ok = n != "MAX" and len(args) <= 2 and 1 <= n <= 38 and (len(args) == 1 or 0 <= args[1] <= n)
+        elif arg_kind == "float":
+            ok = len(args) == 1 and n != "MAX" and 1 <= n <= 53
+        else:
+            ok = len(args) == 1 and n != "MAX" and 0 <= n <= 7
+        if not ok:
+            raise _Unsure(f"arguments to type {t.value}")
+        return cls
+
+    def cast(self) -> _Value:
+        name = self.take().upper
+        self.take()  # (
+        if name in ("CAST", "TRY_CAST"):
+            src = self.value()
+            if self.word() != "AS":
+                raise _Unsure(f"{name} without AS")
+            self.take()
+            target = self.type_name()
+        else:
+            target = self.type_name()
+            self.expect_op(",", name)
+            src = self.value()
+            if self.at_op(","):
+                self.take()
+                style = self.peek()
+                if style is None or style.kind != "number" or not style.value.isdigit():
+                    raise _Unsure(f"{name} style")
+                self.take()
+        self.expect_op(")", name)
+
+        s = src.cls
+        if s == T_STRLIT:
+            ok = (
+                target in STRINGS
+                or (target in NUMERIC and _numeric_literal(src.literal))
+                or (target in DATES and _date_literal(src.literal))
+            )
+        else:
+            ok = (
+                s in (T_NULL, T_STR)
+                or (s in NUMERIC and (target in NUMERIC or target == T_STR))
+                or (s in (T_INT, T_NUM) and target == T_DATETIME)
+                or (s in DATES and (target in DATES or target == T_STR))
+                or (s == T_DATETIME and target in (T_INT, T_NUM))
+                or (s == T_TIME and target in (T_TIME, T_STR))
+            )
+        if not ok:
+            raise _Unsure(f"{name} of {s} to {target}")
+        return _Value(target)
+
+    def call(self) -> _Value:
+        name_tok = self.peek()
+        name = name_tok.value.upper()
+        if name in AGGREGATES:
+            return self.aggregate(name)
+        spec = FUNCTIONS.get(name)
+        if spec is None:
+            raise _Unsure(f"function {name_tok.value}")
+        min_args, max_args, kinds, result = spec
+        self.take()
+        self.take()  # (
+
+        args: List[_Value] = []
+        if not self.at_op(")"):
+            while True:
+                pos = len(args)
+                base = kinds.rstrip("*")
+                if pos < len(base):
+                    kind = base[pos]
+                elif kinds.endswith("*"):
+                    kind = base[-1]
+                else:
+                    raise _Unsure(f"{name}() with more than {max_args} arguments")
+                args.append(self.argument(name, kind))
+                if not self.at_op(","):
+                    break
+                self.take()
+        self.expect_op(")", name)
+        if not min_args <= len(args) <= max_args:
+            raise _Unsure(f"{name}() with {len(args)} arguments")
+
+        if name in ("ISNULL", "NULLIF"):
+            self.compare(args[0], args[1])
+        if result == "0":
+            if args[0].cls == T_NULL:
+                raise _Unsure(f"{name}(NULL, ...)")
+            return _Value(T_INT if args[0].cls == T_BIT and name != "ISNULL" else args[0].cls)
+        if result == "u":
+            return self.common_type(args, name)
+        if result == "u1":
+            return self.common_type(args[1:], name)
+        if result == "dl":
+            last = args[-1].cls
+            return _Value(last if last in DATES else T_DATETIME)
+        return _Value(result)
+
+    def argument(self, name: str, kind: str) -> _Value:
+        if kind == "p":
+            t = self.peek()
+            part = DATEPARTS.get(t.value.lower()) if t is not None and t.kind == "word" else None
+            if part is None or part not in DATEPART_FUNCTIONS[name]:
+                raise _Unsure(f"date part {t.value if t is not None else ''!r} for {name}")
+            self.take()
+            return _Value(T_OTHER)
+        if kind == "b":
+            self.condition()
+            return _Value(T_BOOL)
+
+        v = self.value()
+        c = v.cls
+        if kind == "d":
+            if c in DATES or c == T_NULL or (c == T_STRLIT and _date_literal(v.literal)):
+                return v
+            # YEAR(x.OrderDateKey), DATEPART(month, x.DueDateKey), ...
+            if c == T_INT and v.column is not None and v.column.column.name.lower().endswith("datekey"):
+                raise _Invalid(
+                    f"{name}() applied to {v.column.text}, an int yyyymmdd key, not a date: "
+                    f"join DimDate on DateKey and use its date columns instead."
+                )
+            ok = False
+        elif kind == "n":
+            ok = c in NUMERIC or c == T_NULL
+        elif kind == "i":
+            ok = c in (T_INT, T_BIT, T_NULL)
+        elif kind == "s":
+            ok = c in STRINGS or c == T_NULL
+        elif kind == "x":
+            ok = c in NUMERIC or c in DATES or c == T_TIME
+        elif kind == "a":
+            ok = c not in (T_BOOL, T_OTHER)
+        else:
+            ok = c != T_BOOL
+        if not ok:
+            raise _Unsure(f"{c} argument to {name}()")
+        return v
+
+    def aggregate(self, name: str) -> _Value:
+        if self.in_aggregate:
+            raise _Unsure("nested aggregate")
+        if self.clause in ("WHERE", "ON", "GROUP BY"):
+            raise _Invalid(f"An aggregate may not appear in the {self.clause} clause.")
+        self.has_aggregate = True
+        self.take()
+        self.take()  # (
+
+        if name in ("COUNT", "COUNT_BIG") and self.at_op("*"):
+            self.take()
+            self.expect_op(")", name)
+            return _Value(T_INT)
+        if self.word() in ("ALL", "DISTINCT"):
+            if name in ("STRING_AGG", "APPROX_COUNT_DISTINCT"):
+                raise _Unsure(f"{self.word()} in {name}")
+            self.take()
+
+        self.in_aggregate = True
+        try:
+            arg = self.value()
+            c = arg.cls
+            if name in ("COUNT", "COUNT_BIG", "APPROX_COUNT_DISTINCT"):
+                ok, result = c != T_BOOL, T_INT
+            elif name in ("SUM", "AVG"):
+                ok, result = c in (T_INT, T_NUM), c
+            elif name in ("MIN", "MAX"):
+                ok, result = c in STRINGS | DATES | {T_INT, T_NUM, T_TIME}, T_STR if c == T_STRLIT else c
+            elif name == "STRING_AGG":
+                ok, result = c in STRINGS, T_STR
+                self.expect_op(",", name)
+                ok = ok and self.value().cls == T_STRLIT
+            else:  # STDEV, STDEVP, VAR, VARP
+                ok, result = c in (T_INT, T_NUM), T_NUM
+        finally:
+            self.in_aggregate = False
+        if not ok:
+            raise _Unsure(f"{name}() of {c}")
+        self.expect_op(")", name)
+        return _Value(result)
+
+
+class _Analyzer:
+    def __init__(self, parsed: ParsedSql):
+        self.parsed = parsed
+        self.toks = parsed.tokens
+        self.catalog = schema_service.catalog
+        self.scope: Dict[str, TableInfo] = {}
+
+    # -----------------------------------------------------
+    # Scope
+    # -----------------------------------------------------
+    def build_scope(self) -> None:
+        for ref in self.parsed.tables:
+            if ref.is_cte or (ref.schema or "").lower() in SYSTEM_SCHEMAS:
+                raise _Unsure("CTE or system table")
+            info = self.catalog.table(ref.name)
+            if info is None:
+                raise _Unsure(f"unknown table {ref.name}")
+            key = ref.ref_name.lower()
+            if key in self.scope:
+                raise _Invalid(
+                    f"The correlation name '{ref.ref_name}' is specified multiple times in a FROM clause."
+                )
+            self.scope[key] = info
+
+    def resolve(self, parts: List[str]) -> Tuple[TableInfo, ColumnInfo]:
+        text = ".".join(parts)
+        if len(parts) > 2:
+            raise _Unsure(f"multi-part name {text}")
+        if len(parts) == 2:
+            table = self.scope.get(parts[0].lower())
+            if table is None:
+                raise _Invalid(f'The multi-part identifier "{text}" could not be bound.')
+            col = table.column(parts[1])
+            if col is None:
+                raise _Invalid(f"Invalid column name '{parts[1]}'.")
+            return table, col
+
+        matches = [(t, t.column(parts[0])) for t in self.scope.values()]
+        matches = [(t, c) for t, c in matches if c is not None]
+        if not matches:
+            raise _Invalid(f"Invalid column name '{parts[0]}'.")
+        if len(matches) > 1:
+            raise _Invalid(f"Ambiguous column name '{parts[0]}'.")
+        return matches[0]
+
+    # -----------------------------------------------------
+    # Expressions
+    # -----------------------------------------------------
+
+    def expr(self, lo: int, hi: int, clause: str) -> _Expr:
+        """
+        Analyze tokens [lo, hi) as one expression (a condition in WHERE /
+        ON / HAVING, a value elsewhere): resolve and type its columns, note
+        aggregates and check every operator and call against the operand
+        types. Anything not fully checked raises _Unsure.
+        """
+        p = _ExprParser(self, lo, hi, clause)
+        p.parse()
+        return _Expr(canonical=" ".join(p.canon), uses=p.uses, has_aggregate=p.has_aggregate)
+
+    # -----------------------------------------------------
+    # Clauses
+    # -----------------------------------------------------
+
+    def split(self, lo: int, hi: int) -> List[Tuple[int, int]]:
+        """Top-level comma-separated items in [lo, hi)."""
+        base = self.toks[lo].depth if lo < hi else 0
+        items, start = [], lo
+        for k in range(lo, hi):
+            if self.toks[k].value == "," and self.toks[k].depth == base:
+                items.append((start, k))
+                start = k + 1
+        items.append((start, hi))
+        for a, b in items:
+            if a >= b:
+                raise _Unsure("empty list item")
+        return items
+
+    def select_items(self, lo: int, hi: int) -> Tuple[List[_SelectItem], bool]:
+        toks = self.toks
+        distinct = False
+        if lo < hi and toks[lo].upper in ("ALL", "DISTINCT"):
+            distinct = toks[lo].upper == "DISTINCT"
+            lo += 1
+        if lo < hi and toks[lo].upper == "TOP":
+            lo += 1
+            if lo < hi and toks[lo].kind == "number":
+                lo += 1
+            elif lo + 2 < hi and toks[lo].value == "(" and toks[lo + 1].kind == "number" and toks[lo + 2].value == ")":
+                lo += 3
+            else:
+                raise _Unsure("TOP expression")
+            if lo < hi and toks[lo].upper == "PERCENT":
+                lo += 1
+            if lo + 1 < hi and toks[lo].upper == "WITH" and toks[lo + 1].upper == "TIES":
+                lo += 2
+
+        items: List[_SelectItem] = []
+        for a, b in self.split(lo, hi):
+            n = b - a
+            if n == 1 and toks[a].value == "*":
+                items.append(_SelectItem(None, None))
+                continue
+            if n == 3 and toks[a + 1].value == "." and toks[a + 2].value == "*":
+                if toks[a].value.lower() not in self.scope:
+                    raise _Invalid(f'The multi-part identifier "{toks[a].value}" could not be bound.')
+                items.append(_SelectItem(None, None))
+                continue
+
+            alias = None
+            if n >= 3 and _is_name(toks[a]) and toks[a + 1].value == "=":
+                alias, a = toks[a].value, a + 2
+            elif n >= 3 and toks[b - 2].upper == "AS":
+                last = toks[b - 1]
+                if not (_is_name(last) or last.kind == "string"):
+                    raise _Unsure("column alias")
+                alias, b = last.value.strip("'"), b - 2
+            elif n >= 2 and _is_name(toks[b - 1]):
+                prev = toks[b - 2]
+                if prev.value == ")" or prev.upper == "END" or prev.kind in ("number", "string", "ident") or _is_name(prev):
+                    alias, b = toks[b - 1].value, b - 1
+            items.append(_SelectItem(self.expr(a, b, "SELECT"), alias))
+        return items, distinct
+
+    def from_clause(self, lo: int, hi: int) -> None:
+        """table [AS a] { [INNER|LEFT|RIGHT|FULL [OUTER]|CROSS] JOIN table [AS a] [ON cond] }."""
+        toks = self.toks
+        refs = {r.start: r for r in self.parsed.tables}
+        k = lo
+
+        def table_at(k: int) -> int:
+            ref = refs.get(toks[k].start) if k < hi else None
+            if ref is None:
+                raise _Unsure("FROM item that isn't a table")
+            while k < hi and toks[k].end <= ref.end:
+                k += 1
+            if k < hi and toks[k].upper == "WITH":
+                raise _Unsure("table hint")
+            return k
+
+        k = table_at(k)
+        while k < hi:
+            kind = []
+            while k < hi and toks[k].upper in JOIN_WORDS and toks[k].upper != "JOIN":
+                kind.append(toks[k].upper)
+                k += 1
+            if k >= hi or toks[k].upper != "JOIN":
+                raise _Unsure("FROM clause shape")
+            k = table_at(k + 1)
+            if kind and kind[0] == "CROSS":
+                continue
+            if k >= hi or toks[k].upper != "ON":
+                raise _Unsure("JOIN without ON")
+            start = k + 1
+            k = start
+            while k < hi and not (toks[k].depth == toks[start].depth and toks[k].upper in JOIN_WORDS):
+                k += 1
+            self.expr(start, k, "ON")
+
+    # -----------------------------------------------------
+    # Whole statement
+    # -----------------------------------------------------
+
+    def run(self) -> None:
+        parsed, toks = self.parsed, self.toks
+        if parsed.statement_kind != "SELECT" or not parsed.is_simple_select:
+            raise _Unsure("not a single SELECT")
+
+        end = len(toks)
+        if end and toks[-1].value == ";":
+            end -= 1
+
+        # Top-level clause boundaries, in canonical order
+        bounds: List[Tuple[str, int]] = []
+        for k in range(end):
+            t = toks[k]
+            if t.kind == "word" and t.depth == 0 and t.upper in ("SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "UNION", "EXCEPT", "INTERSECT", "OPTION", "INTO", "FOR"):
+                if t.upper not in CLAUSE_ORDER:
+                    raise _Unsure(f"{t.upper} clause")
+                bounds.append((t.upper, k))
+        names = [b[0] for b in bounds]
+        if not names or names[0] != "SELECT" or bounds[0][1] != 0 or "FROM" not in names:
+            raise _Unsure("clause layout")
+        if len(set(names)) != len(names) or names != sorted(names, key=CLAUSE_ORDER.index):
+            raise _Unsure("clause order")
+
+        region: Dict[str, Tuple[int, int]] = {}
+        for i, (name, k) in enumerate(bounds):
+            stop = bounds[i + 1][1] if i + 1 < len(bounds) else end
+            start = k + 1
+            if name in ("GROUP", "ORDER"):
+                if start >= stop or toks[start].upper != "BY":
+                    raise _Unsure(f"{name} without BY")
+                start += 1
+            if start >= stop:
+                raise _Unsure(f"empty {name} clause")
+            region[name] = (start, stop)
+
+        self.build_scope()
+        self.from_clause(*region["FROM"])
+
+        select, distinct = self.select_items(*region["SELECT"])
+        has_star = any(item.expr is None for item in select)
+        aliases: Dict[str, List[_SelectItem]] = {}
+        for item in select:
+            if item.alias:
+                aliases.setdefault(item.alias.lower(), []).append(item)
+
+        if "WHERE" in region:
+            self.expr(*region["WHERE"], "WHERE")
+
+        group: List[_Expr] = []
+        if "GROUP" in region:
+            a, b = region["GROUP"]
+            if toks[a].upper == "ALL":
+                raise _Unsure("GROUP BY ALL")
+            group = [self.expr(x, y, "GROUP BY") for x, y in self.split(a, b)]
+
+        having = self.expr(*region["HAVING"], "HAVING") if "HAVING" in region else None
+
+        order: List[Tuple[str, Optional[_Expr], Optional[int]]] = []
+        written: Set[Tuple[str, str]] = set()  # ORDER BY items as written
+        targets: Set[str] = set()              # what they sort by
+        if "ORDER" in region:
+            for x, y in self.split(*region["ORDER"]):
+                if toks[y - 1].upper in ("ASC", "DESC"):
+                    y -= 1
+                if y - x == 1 and toks[x].kind == "number":
+                    pos = int(float(toks[x].value))
+                    order.append(("position", None, pos))
+                    item = select[pos - 1] if 1 <= pos <= len(select) else None
+                    key = ("position", str(pos))
+                    target = item.expr.canonical if item is not None and item.expr is not None else f"#{pos}"
+                elif y - x == 1 and _is_name(toks[x]) and toks[x].value.lower() in aliases:
+                    matches = aliases[toks[x].value.lower()]
+                    if len(matches) > 1:
+                        if len({m.expr.canonical for m in matches}) > 1:
+                            raise _Invalid(f"Ambiguous column name '{toks[x].value}'.")
+                        raise _Unsure(f"ORDER BY alias {toks[x].value} names several select items")
+                    order.append(("alias", None, None))
+                    key = ("alias", toks[x].value.lower())
+                    target = matches[0].expr.canonical
+                else:
+                    e = self.expr(x, y, "ORDER BY")
+                    order.append(("expr", e, None))
+                    key = ("expr", e.canonical)
+                    target = e.canonical
+
+                if key in written:
+                    raise _Invalid(
+                        "A column has been specified more than once in the order by list. "
+                        "Columns in the order by list must be unique."
+                    )
+                if target in targets:
+                    raise _Unsure("ORDER BY repeats a select item through a position or alias")
+                written.add(key)
+                targets.add(target)
+
+        # ORDER BY positions
+        for kind, _, pos in order:
+            if kind == "position":
+                if has_star:
+                    raise _Unsure("ORDER BY position with *")
+                if not 1 <= pos <= len(select):
+                    raise _Invalid(
+                        f"The ORDER BY position number {pos} is out of range of the number of items in the select list."
+                    )
+
+        select_canon = {item.expr.canonical for item in select if item.expr is not None}
+
+        # SELECT DISTINCT ... ORDER BY: items must be in the select list
+        if distinct:
+            for kind, e, _ in order:
+                if kind == "expr" and e.canonical not in select_canon:
+                    if has_star:
+                        raise _Unsure("DISTINCT * with ORDER BY")
+                    raise _Invalid("ORDER BY items must appear in the select list if SELECT DISTINCT is specified.")
+
+        # Grouping: non-aggregated columns must be grouped
+        grouped = bool(group) or any(item.expr is not None and item.expr.has_aggregate for item in select)
+        grouped = grouped or (having is not None) or any(e is not None and e.has_aggregate for _, e, _ in order)
+        if not grouped:
+            return
+        if has_star:
+            raise _Unsure("* in a grouped query")
+
+        group_cols = {g.plain_column for g in group if g.plain_column is not None}
+        group_canon = {g.canonical for g in group}
+
+        def check(e: _Expr, where: str, also_ok: Set[str] = frozenset()) -> None:
+            if e.canonical in group_canon or e.canonical in also_ok:
+                return
+            for use in e.uses:
+                if not use.in_aggregate and (use.table.name, use.column.name) not in group_cols:
+                    raise _Invalid(
+                        f"Column '{use.text}' is invalid in the {where} because it is not contained "
+                        f"in either an aggregate function or the GROUP BY clause."
+                    )
+
+        for item in select:
+            check(item.expr, "select list")
+        if having is not None:
+            check(having, "HAVING clause")
+        for kind, e, _ in order:
+            if kind == "expr":
+                check(e, "ORDER BY clause", select_canon)
+
+
+# ---------------------------------------------------------
+# 4) Public API
+# ---------------------------------------------------------
+
+_stats = Counter()
+
+
+def check_semantics(sql: str) -> Verdict:
+    """
+    Static check of a single SELECT against the catalog: column existence
+    per resolved alias, ambiguous unqualified columns, GROUP BY coverage,
+    date functions / text comparisons on int *DateKey columns and ORDER BY
+    references. Every expression is parsed and typed: function arity and
+    argument types, date parts, CAST / CONVERT target types, CASE ... END,
+    IN (...), BETWEEN ... AND and the operand types of each operator.
+
+    "valid" is only returned when every construct in the query was
+    understood (one SELECT, known tables, known built-ins, plain joins)
+    and every operand pairing is known to compile; CTEs, subqueries,
+    window functions, unknown functions, implicit conversions that may
+    fail and the like give "unsure" so SQL Server gets the final word.
+    """
+    try:
+        _Analyzer(parse_sql(sql)).run()
+        verdict = Verdict(VALID)
+    except _Invalid as ex:
+        verdict = Verdict(INVALID, str(ex))
+    except _Unsure as ex:
+        verdict = Verdict(UNSURE, str(ex))
+    except Exception as ex:  # analyzer bug: never block the pipeline on it
+        _stats["errors"] += 1
+        verdict = Verdict(UNSURE, f"analyzer error: {ex}")
+    _stats[verdict.status] += 1
+    return verdict
+
+
+def semantic_check_metrics() -> Dict:
+    return dict(_stats)
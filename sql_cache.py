@@ -0,0 +1,286 @@
+# sql_cache.py
+
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple
+
+from config import (
+    SQL_CACHE_ENABLED,
+    SQL_CACHE_MAX_ENTRIES,
+    SQL_CACHE_TTL_SECONDS,
+    SQL_CACHE_SIMILARITY,
+    SQL_CACHE_SIMILARITY_THRESHOLD,
+)
+from schema_retriever import get_retriever
+from schema_service import schema_service
+
+
+# ---------------------------------------------------------
+# 1) Question normalization
+# ---------------------------------------------------------
+
+NUMBER_WORDS = {
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4",
+    "five": "5", "six": "6", "seven": "7", "eight": "8", "nine": "9",
+    "ten": "10", "eleven": "11", "twelve": "12", "fifteen": "15",
+    "twenty": "20", "fifty": "50", "hundred": "100",
+}
+
+THOUSANDS_RE = re.compile(r"(?<=\d),(?=\d{3}\b)")
+DECIMAL_ZERO_RE = re.compile(r"\b(\d+)\.0+\b")
+PUNCT_RE = re.compile(r"[^\w\s]")
+NUMBER_RE = re.compile(r"\b\d+\b")
+
+# Words a near match may add, drop or reorder; every other word (including
+# negations like "not" / "no" / "without") must be in both questions
+STOPWORDS = frozenset({
+    "a", "an", "the", "of", "for", "in", "on", "at", "by", "to", "from",
+    "with", "and", "is", "are", "was", "were", "be", "been", "do", "does",
+    "did", "what", "which", "who", "how", "me", "us", "show", "list",
+    "give", "get", "find", "tell", "please", "i", "we", "you", "there",
+    "that", "this", "these", "those", "it", "its", "their", "as", "have",
+    "has", "can", "could", "would", "should",
+})
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form for the exact-match tier:
+
+        "  Total Internet Sales Amount for 2,004?" ->
+        "total internet sales amount for 2004"
+
+    Case, whitespace and punctuation are dropped; numbers lose thousands
+    separators and trailing ".0", and small number words become digits
+    ("top ten" == "top 10").
+    """
+    q = unicodedata.normalize("NFKC", question).lower()
+    q = THOUSANDS_RE.sub("", q)
+    q = DECIMAL_ZERO_RE.sub(r"\1", q)
+    q = PUNCT_RE.sub(" ", q)
+    words = [NUMBER_WORDS.get(w, w) for w in q.split()]
+    words = [w.lstrip("0") or "0" if w.isdigit() else w for w in words]
+    return " ".join(words)
+
+
+Signature = Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]
+
+
+def _signature(normalized: str) -> Signature:
+    """Numbers, hinted tables and content words a near match must share exactly."""
+    numbers = tuple(sorted(NUMBER_RE.findall(normalized)))
+    tables = tuple(sorted(get_retriever(schema_service.catalog).hinted_tables(normalized)))
+    words = tuple(sorted({w for w in normalized.split() if w not in STOPWORDS}))
+    return numbers, tables, words
+
+
+def _ngrams(normalized: str, n: int = 3) -> Counter:
+    padded = f" {normalized} "
+    return Counter(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+# ---------------------------------------------------------
+# 2) Cache
+# ---------------------------------------------------------
+
+@dataclass
+class CacheEntry:
+    question: str
+    sql: str
+    created_at: float
+    grams: Counter = field(repr=False)
+    signature: Signature = ((), (), ())
+    hits: int = 0
+
+
+class SqlCache:
+    """
+    Question → validated SQL cache in front of generate_sql.
+
+      - exact tier: dict lookup on normalize_question()
+      - similarity tier (optional): cosine similarity of char-trigram
+        TF-IDF vectors, via an inverted index over the cached questions.
+        A near match must also mention exactly the same numbers, hit the
+        same TABLE_HINTS and use the same content words (everything but
+        STOPWORDS, negations included), so "sales in 2003" never reuses the
+        SQL for "sales in 2004", "male customers" the one for "female
+        customers", nor "not married" the one for "married". The tier
+        thus only absorbs filler words, word order and punctuation.
+
+    Only SQL that passed validation (and preflight) should be put().
+    Entries are evicted LRU beyond max_entries and after ttl seconds, and
+    the whole cache is dropped when the schema fingerprint changes.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SQL_CACHE_MAX_ENTRIES,
+        ttl: float = SQL_CACHE_TTL_SECONDS,
+        similarity: bool = SQL_CACHE_SIMILARITY,
+        threshold: float = SQL_CACHE_SIMILARITY_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.threshold = threshold
+
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._postings: Dict[str, Set[str]] = {}
+        self._df: Counter = Counter()
+        self._fingerprint: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self._stats = Counter()
+
+    # -----------------------------------------------------
+    # Bookkeeping
+    # -----------------------------------------------------
+
+    def _check_schema(self) -> None:
+        fp = schema_service.catalog.fingerprint
+        if fp != self._fingerprint:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._clear()
+            self._fingerprint = fp
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._postings.clear()
+        self._df.clear()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        for g in entry.grams:
+            self._df[g] -= 1
+            if self._df[g] <= 0:
+                del self._df[g]
+            keys = self._postings.get(g)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[g]
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return self.ttl > 0 and now - entry.created_at > self.ttl
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    # -----------------------------------------------------
+    # Lookups
+    # -----------------------------------------------------
+
+    def get(self, question: str) -> Optional[Tuple[str, str]]:
+        """(sql, "exact" | "similar") for a cached question, else None."""
+        key = normalize_question(question)
+        now = time.monotonic()
+
+        with self._lock:
+            self._check_schema()
+
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._remove(key)
+                self._stats["expired"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                self._stats["hits_exact"] += 1
+                return entry.sql, "exact"
+
+            if self.similarity:
+                match = self._most_similar(key, now)
+                if match is not None:
+                    self._entries.move_to_end(match.question)
+                    match.hits += 1
+                    self._stats["hits_similar"] += 1
+                    return match.sql, "similar"
+
+            self._stats["misses"] += 1
+            return None
+
+    def _weight(self, gram: str, count: int, n_docs: int) -> float:
+        idf = math.log((1 + n_docs) / (1 + self._df.get(gram, 0))) + 1.0
+        return (1.0 + math.log(count)) * idf
+
+    def _most_similar(self, key: str, now: float) -> Optional[CacheEntry]:
+        if not self._entries:
+            return None
+
+        n_docs = len(self._entries)
+        grams = _ngrams(key)
+        q_vec = {g: self._weight(g, c, n_docs) for g, c in grams.items()}
+        q_norm = math.sqrt(sum(w * w for w in q_vec.values())) or 1.0
+        signature = _signature(key)
+
+        candidates: Set[str] = set()
+        for g in grams:
+            candidates.update(self._postings.get(g, ()))
+
+        best: Optional[CacheEntry] = None
+        best_score = self.threshold
+        for cand in candidates:
+            entry = self._entries[cand]
+            if entry.signature != signature or self._expired(entry, now):
+                continue
+            d_vec = {g: self._weight(g, c, n_docs) for g, c in entry.grams.items()}
+            d_norm = math.sqrt(sum(w * w for w in d_vec.values())) or 1.0
+            dot = sum(w * d_vec.get(g, 0.0) for g, w in q_vec.items())
+            score = dot / (q_norm * d_norm)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    # -----------------------------------------------------
+    # Inserts
+    # -----------------------------------------------------
+
+    def put(self, question: str, sql: str) -> None:
+        """Cache SQL that passed validation and preflight for `question`."""
+        key = normalize_question(question)
+        if not key or not sql:
+            return
+
+        with self._lock:
+            self._check_schema()
+            if key in self._entries:
+                self._remove(key)
+
+            grams = _ngrams(key)
+            self._entries[key] = CacheEntry(
+                question=key,
+                sql=sql,
+                created_at=time.monotonic(),
+                grams=grams,
+                signature=_signature(key),
+            )
+            for g in grams:
+                self._df[g] += 1
+                self._postings.setdefault(g, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            out = {
+                "enabled": SQL_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity": self.similarity,
+            }
+            for k in ("hits_exact", "hits_similar", "misses", "evictions", "expired", "invalidations"):
+                out[k] = self._stats[k]
+        return out
+
+
+sql_cache = SqlCache()
@@ -1,20 +1,29 @@
 # sql_generator.py
 
-from typing import Any, Dict
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
 import json
 
+from config import LLM_STREAMING, CANDIDATE_TEMPERATURE
+from example_store import example_store, render_examples
 from llm import get_llm
-from schema_service import schema_service
-from sql_utils import extract_sql  
+from schema_retriever import schema_context
+from sql_utils import astream_sql, extract_sql
 
 
-def generate_sql(question: str) -> str:
+def build_generation_prompt(
+    question: str,
+    prune_schema: Optional[bool] = None,
+    exclude_examples: Iterable[str] = (),
+) -> Tuple[str, str]:
     """
-    Generate a single T-SQL SELECT statement from a natural language question.
-    Ensures we only return the SQL string, even if the model wraps it in JSON.
-    """
-    llm = get_llm()
+    Build the (system, user) prompt pair for a question.
 
+    prune_schema overrides SCHEMA_PRUNING: True sends only the tables
+    relevant to the question (plus FK bridges), False the whole schema.
+    exclude_examples lists questions whose few-shot examples must not be
+    used (eval_gold holds out the question under test).
+    """
     system = (
         "You are a cautious T-SQL assistant for Microsoft SQL Server. "
         "You must generate one safe SELECT query (CTEs allowed) using *only* "
@@ -22,93 +31,9 @@ def generate_sql(question: str) -> str:
         "treating surrogate keys (OrderDateKey, DateKey) as datetime."
     )
 
-    # Anchored examples to steer table selection AND join patterns.
-    examples = r"""
-Example 1
-Question: Total Internet Sales Amount for calendar year 2004
-Answer:
-{
-  "sql": "SELECT SUM(fis.SalesAmount) AS TotalInternetSalesAmount
-          FROM FactInternetSales AS fis
-          JOIN DimDate AS d ON fis.OrderDateKey = d.DateKey
-          WHERE d.CalendarYear = 2004;",
-  "explanation": "Use FactInternetSales joined to DimDate and filter by CalendarYear."
-}
-
-Example 2
-Question: Total Reseller Sales Amount in 2004
-Answer:
-{
-  "sql": "SELECT SUM(frs.SalesAmount) AS TotalResellerSalesAmount
-          FROM FactResellerSales AS frs
-          JOIN DimDate AS d ON frs.OrderDateKey = d.DateKey
-          WHERE d.CalendarYear = 2004;",
-  "explanation": "Use FactResellerSales joined to DimDate and filter by CalendarYear."
-}
-
-Example 3
-Question: Internet Sales Amount by Product Category in 2004
-Answer:
-{
-  "sql": "SELECT pc.EnglishProductCategoryName,
-                 SUM(fis.SalesAmount) AS TotalSalesAmount
-          FROM FactInternetSales AS fis
-          JOIN DimDate AS d ON fis.OrderDateKey = d.DateKey
-          JOIN DimProduct AS p ON fis.ProductKey = p.ProductKey
-          JOIN DimProductSubcategory AS psc
-               ON p.ProductSubcategoryKey = psc.ProductSubcategoryKey
-          JOIN DimProductCategory AS pc
-               ON psc.ProductCategoryKey = pc.ProductCategoryKey
-          WHERE d.CalendarYear = 2004
-          GROUP BY pc.EnglishProductCategoryName
-          ORDER BY TotalSalesAmount DESC;",
-  "explanation": "Product categories come from DimProductCategory via DimProductSubcategory."
-}
-
-Example 4
-Question: Internet Sales Amount by customer education level in 2004
-Answer:
-{
-  "sql": "SELECT c.EnglishEducation,
-                 SUM(fis.SalesAmount) AS TotalSalesAmount
-          FROM FactInternetSales AS fis
-          JOIN DimCustomer AS c ON fis.CustomerKey = c.CustomerKey
-          JOIN DimDate AS d ON fis.OrderDateKey = d.DateKey
-          WHERE d.CalendarYear = 2004
-          GROUP BY c.EnglishEducation
-          ORDER BY TotalSalesAmount DESC;",
-  "explanation": "Education attributes live in DimCustomer, not DimDate."
-}
-
-Example 5
-Question: Top 10 cities by Internet Sales Amount in 2004
-Answer:
-{
-  "sql": "SELECT TOP 10 g.City,
-                 g.StateProvinceName,
-                 g.EnglishCountryRegionName,
-                 SUM(fis.SalesAmount) AS TotalSalesAmount
-          FROM FactInternetSales AS fis
-          JOIN DimCustomer AS c ON fis.CustomerKey = c.CustomerKey
-          JOIN DimGeography AS g ON c.GeographyKey = g.GeographyKey
-          JOIN DimDate AS d ON fis.OrderDateKey = d.DateKey
-          WHERE d.CalendarYear = 2004
-          GROUP BY g.City, g.StateProvinceName, g.EnglishCountryRegionName
-          ORDER BY TotalSalesAmount DESC;",
-  "explanation": "City and geography come from DimGeography, joined via DimCustomer."
-}
-
-Example 6
-Question: Total number of Internet Sales orders in 2004
-Answer:
-{
-  "sql": "SELECT COUNT(DISTINCT fis.SalesOrderNumber) AS OrderCount
-          FROM FactInternetSales AS fis
-          JOIN DimDate AS d ON fis.OrderDateKey = d.DateKey
-          WHERE d.CalendarYear = 2004;",
-  "explanation": "When counting orders, use COUNT(DISTINCT SalesOrderNumber)."
-}
-"""
+    # Examples closest to this question, to steer table selection AND
+    # join patterns
+    examples = render_examples(example_store.select(question, exclude=exclude_examples))
 
     user = f"""{examples}
 
@@ -119,7 +44,7 @@ User question:
 
 Use ONLY the following schema info to choose tables, columns, and joins:
 
-{schema_service.schema_text}
+{schema_context(question, prune=prune_schema)}
 
 Mapping hints (very important):
 - "Internet Sales" / "online sales" → use FactInternetSales (SalesAmount).
@@ -148,9 +73,64 @@ Rules:
 - Never use INSERT/UPDATE/DELETE/ALTER/DROP/TRUNCATE/EXEC/CREATE/MERGE.
 """
 
+    return system, user
+
+
+def generate_sql(
+    question: str,
+    prune_schema: Optional[bool] = None,
+    exclude_examples: Iterable[str] = (),
+) -> str:
+    """
+    Generate a single T-SQL SELECT statement from a natural language question.
+    Ensures we only return the SQL string, even if the model wraps it in JSON.
+    """
+    llm = get_llm()
+
+    system, user = build_generation_prompt(question, prune_schema, exclude_examples)
     raw = llm.generate(system, [{"role": "user", "content": user}])
 
     sql = extract_sql(raw)
     return sql.strip()
 
 
+async def agenerate_sql(
+    question: str,
+    prune_schema: Optional[bool] = None,
+    exclude_examples: Iterable[str] = (),
+) -> str:
+    """
+    Async variant of generate_sql for the async /chat_sql pipeline. With
+    LLM_STREAMING, the completion is streamed and cut off once the SQL
+    is complete.
+    """
+    llm = get_llm()
+
+    system, user = build_generation_prompt(question, prune_schema, exclude_examples)
+    messages = [{"role": "user", "content": user}]
+    if LLM_STREAMING:
+        return await astream_sql(llm, system, messages)
+
+    raw = await llm.agenerate(system, messages)
+
+    sql = extract_sql(raw)
+    return sql.strip()
+
+
+async def agenerate_candidates(
+    question: str,
+    n: int,
+    prune_schema: Optional[bool] = None,
+    temperature: float = CANDIDATE_TEMPERATURE,
+) -> AsyncIterator[str]:
+    """
+    n SQL candidates for one question (one prompt), yielded as each
+    arrives. Closing the iterator cancels generations still running.
+    """
+    llm = get_llm()
+
+    system, user = build_generation_prompt(question, prune_schema)
+    candidates = llm.acandidates(system, [{"role": "user", "content": user}], n, temperature)
+    async with aclosing(candidates):
+        async for raw in candidates:
+            yield extract_sql(raw).strip()
@@ -0,0 +1,406 @@
+# sql_parser.py
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from config import SQL_PARSE_CACHE_SIZE
+
+
+# ---------------------------------------------------------
+# 1) Tokenizer
+# ---------------------------------------------------------
+
+TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<string>[Nn]?'(?:[^']|'')*(?:'|\Z))
+    | (?P<bracket>\[(?:[^\]]|\]\])*(?:\]|\Z))
+    | (?P<dquote>"(?:[^"]|"")*(?:"|\Z))
+    | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+    | (?P<word>[A-Za-z_@#][\w@#$]*)
+    | (?P<op><>|!=|>=|<=|[-+*/%=<>.,;()!&|^~])
+    | (?P<other>.)
+    """,
+    re.S | re.X,
+)
+
+
+class Token(NamedTuple):
+    """
+    kind:  'word' (keyword or bare identifier), 'ident' ([x] / "x"),
+           'string', 'number', 'op' or 'other'
+    value: identifier text without quoting for 'ident', raw text otherwise
+    upper: upper-cased value for 'word' tokens, "" for the rest
+    start, end: character offsets in the SQL string
+    depth: parenthesis depth the token sits at
+    """
+    kind: str
+    value: str
+    upper: str
+    start: int
+    end: int
+    depth: int
+
+
+def tokenize(sql: str) -> List[Token]:
+    """One pass over the SQL; whitespace and comments are dropped."""
+    tokens: List[Token] = []
+    depth = 0
+    for m in TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        text = m.group()
+        if kind in ("ws", "comment"):
+            continue
+        if kind == "bracket":
+            tokens.append(Token("ident", text[1:-1].replace("]]", "]"), "", m.start(), m.end(), depth))
+        elif kind == "dquote":
+            tokens.append(Token("ident", text[1:-1].replace('""', '"'), "", m.start(), m.end(), depth))
+        elif kind == "word":
+            tokens.append(Token("word", text, text.upper(), m.start(), m.end(), depth))
+        elif text == "(":
+            tokens.append(Token("op", text, "", m.start(), m.end(), depth))
+            depth += 1
+        elif text == ")":
+            depth = max(depth - 1, 0)
+            tokens.append(Token("op", text, "", m.start(), m.end(), depth))
+        else:
+            tokens.append(Token(kind, text, "", m.start(), m.end(), depth))
+    return tokens
+
+
+# ---------------------------------------------------------
+# 2) Parsed structure
+# ---------------------------------------------------------
+
+# Words that end a table reference instead of being its alias
+RESERVED = frozenset({
+    "SELECT", "FROM", "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL",
+    "OUTER", "CROSS", "APPLY", "ON", "GROUP", "ORDER", "BY", "HAVING",
+    "UNION", "EXCEPT", "INTERSECT", "WITH", "AS", "AND", "OR", "NOT", "TOP",
+    "DISTINCT", "INTO", "OPTION", "FOR", "WHEN", "THEN", "ELSE", "END",
+    "CASE", "PIVOT", "UNPIVOT", "OFFSET", "FETCH", "USING", "SET", "VALUES",
+})
+
+# Top-level clause keywords recorded in ParsedSql.clauses
+CLAUSE_WORDS = {
+    "SELECT": "SELECT", "FROM": "FROM", "WHERE": "WHERE", "GROUP": "GROUP BY",
+    "HAVING": "HAVING", "ORDER": "ORDER BY", "UNION": "UNION",
+    "EXCEPT": "EXCEPT", "INTERSECT": "INTERSECT", "OPTION": "OPTION",
+}
+
+# Catalog views (sys.all_objects, INFORMATION_SCHEMA.COLUMNS) aren't in the
+# schema snapshot but are valid to read
+SYSTEM_SCHEMAS = frozenset({"sys", "information_schema"})
+
+# Words that end an ON condition
+ON_END = frozenset({
+    "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "OUTER", "WHERE",
+    "GROUP", "ORDER", "HAVING", "UNION", "EXCEPT", "INTERSECT", "OPTION",
+})
+
+
+@dataclass(frozen=True)
+class TableRef:
+    """FROM/JOIN table reference: [schema.]name [AS] alias."""
+    name: str
+    schema: Optional[str]
+    alias: Optional[str]
+    start: int
+    end: int
+    is_cte: bool = False
+
+    @property
+    def ref_name(self) -> str:
+        """How the query refers to it: the alias, or the bare table name."""
+        return self.alias or self.name
+
+
+@dataclass(frozen=True)
+class ColumnRef:
+    """Qualified column reference qualifier.column (e.g. fis.SalesAmount)."""
+    qualifier: str
+    column: str
+    start: int
+    end: int
+
+
+@dataclass(frozen=True)
+class ParsedSql:
+    """
+    Everything the validation stages need from one SQL string, built in a
+    single tokenizer pass (see parse_sql). Offsets index into `sql`.
+
+      statement_kind:  first keyword (SELECT, WITH, ...)
+      keywords:        upper-cased bare words outside literals/comments
+      tables:          FROM/JOIN table references (CTE references flagged)
+      cte_names:       names defined in a leading WITH
+      columns:         qualified column references
+      join_predicates: qualifier.column = qualifier.column pairs in ON clauses
+      clauses:         (clause, offset) for top-level clause keywords
+      select_count:    SELECT keywords at any depth (1 = no subqueries)
+    """
+    sql: str
+    tokens: Tuple[Token, ...]
+    statement_kind: str
+    keywords: FrozenSet[str]
+    tables: Tuple[TableRef, ...]
+    cte_names: FrozenSet[str]
+    columns: Tuple[ColumnRef, ...]
+    join_predicates: Tuple[Tuple[ColumnRef, ColumnRef], ...]
+    clauses: Tuple[Tuple[str, int], ...]
+    select_count: int
+
+    @property
+    def table_names(self) -> FrozenSet[str]:
+        """Real (non-CTE, non-system) tables referenced in FROM/JOIN."""
+        return frozenset(
+            t.name for t in self.tables
+            if not t.is_cte and (t.schema or "").lower() not in SYSTEM_SCHEMAS
+        )
+
+    @property
+    def alias_to_table(self) -> Dict[str, str]:
+        """alias (or bare table name when unaliased) -> table name."""
+        return {t.ref_name: t.name for t in self.tables}
+
+    @property
+    def is_simple_select(self) -> bool:
+        """One SELECT with no CTEs or subqueries."""
+        return self.select_count == 1 and not self.cte_names
+
+    def join_insert_offset(self) -> int:
+        """
+        Where extra JOINs go: before the first top-level WHERE / GROUP BY /
+        ORDER BY / HAVING / set operator / OPTION after the last top-level
+        FROM, else at the end of the statement (before a trailing ';').
+        """
+        last_from = max((off for c, off in self.clauses if c == "FROM"), default=-1)
+        for clause, off in self.clauses:
+            if off > last_from and clause not in ("SELECT", "FROM"):
+                return off
+        end = len(self.sql.rstrip())
+        if self.tokens and self.tokens[-1].value == ";":
+            end = self.tokens[-1].start
+        return end
+
+
+# ---------------------------------------------------------
+# 3) Parser
+# ---------------------------------------------------------
+
+def _is_name(tok: Token) -> bool:
+    return tok.kind == "ident" or (tok.kind == "word" and tok.upper not in RESERVED)
+
+
+def _read_multipart(tokens: List[Token], i: int) -> Tuple[List[str], int]:
+    """name(.name)* starting at i -> (parts, index after it)."""
+    parts = [tokens[i].value]
+    i += 1
+    while (
+        i + 1 < len(tokens)
+        and tokens[i].value == "."
+        and tokens[i + 1].kind in ("word", "ident")
+    ):
+        parts.append(tokens[i + 1].value)
+        i += 2
+    return parts, i
+
+
+def _parse(sql: str) -> ParsedSql:
+    tokens = tokenize(sql)
+    n = len(tokens)
+
+    keywords = frozenset(t.upper for t in tokens if t.kind == "word")
+    statement_kind = next((t.upper for t in tokens if t.kind == "word"), "")
+
+    tables: List[TableRef] = []
+    columns: List[ColumnRef] = []
+    clauses: List[Tuple[str, int]] = []
+    cte_names: List[str] = []
+    select_count = 0
+
+    # token index -> ColumnRef starting / ending there (for ON predicates)
+    col_at_start: Dict[int, ColumnRef] = {}
+    col_at_end: Dict[int, ColumnRef] = {}
+    on_spans: List[Tuple[int, int]] = []
+
+    in_cte_preamble = statement_kind == "WITH"
+    i = 0
+
+    def read_table(i: int) -> int:
+        """Parse one table reference at i (after FROM/JOIN/','), return next index."""
+        if i >= n or not (tokens[i].kind in ("word", "ident") and _is_name(tokens[i])):
+            return i
+        start_tok = tokens[i]
+        parts, j = _read_multipart(tokens, i)
+        if j < n and tokens[j].value == "(":
+            # table-valued function: not a table
+            return i
+        alias = None
+        k = j
+        if k < n and tokens[k].upper == "AS":
+            k += 1
+        if k < n and _is_name(tokens[k]):
+            alias = tokens[k].value
+            k += 1
+        else:
+            k = j
+        name = parts[-1]
+        schema = parts[-2] if len(parts) > 1 else None
+        tables.append(TableRef(
+            name=name,
+            schema=schema,
+            alias=alias,
+            start=start_tok.start,
+            end=tokens[k - 1].end,
+        ))
+        return k
+
+    while i < n:
+        tok = tokens[i]
+
+        if tok.kind == "word":
+            up = tok.upper
+            if up == "SELECT":
+                select_count += 1
+                if tok.depth == 0:
+                    in_cte_preamble = False
+            if tok.depth == 0 and up in CLAUSE_WORDS:
+                clauses.append((CLAUSE_WORDS[up], tok.start))
+
+            if (
+                in_cte_preamble
+                and tok.depth == 0
+                and up not in RESERVED
+                and i + 1 < n
+            ):
+                # WITH name [(cols)] AS (
+                j = i + 1
+                if tokens[j].value == "(":
+                    while j < n and not (tokens[j].value == ")" and tokens[j].depth == 0):
+                        j += 1
+                    j += 1
+                if j + 1 < n and tokens[j].upper == "AS" and tokens[j + 1].value == "(":
+                    cte_names.append(tok.value)
+                    i = j
+                    continue
+
+            if up in ("FROM", "JOIN", "APPLY"):
+                j = i + 1
+                j = read_table(j)
+                if up == "FROM":
+                    # FROM a, b, c
+                    while j < n and tokens[j].value == "," and tokens[j].depth == tok.depth:
+                        nxt = read_table(j + 1)
+                        if nxt == j + 1:
+                            break
+                        j = nxt
+                i = max(j, i + 1)
+                continue
+
+            if up == "ON":
+                j = i + 1
+                while j < n:
+                    t = tokens[j]
+                    if t.depth < tok.depth or t.value == ";":
+                        break
+                    if t.depth == tok.depth and t.upper in ON_END:
+                        break
+                    j += 1
+                on_spans.append((i + 1, j))
+
+        if tok.kind in ("word", "ident") and i + 2 < n and tokens[i + 1].value == "." \
+                and tokens[i + 2].kind in ("word", "ident"):
+            parts, j = _read_multipart(tokens, i)
+            ref = ColumnRef(
+                qualifier=parts[-2],
+                column=parts[-1],
+                start=tok.start,
+                end=tokens[j - 1].end,
+            )
+            columns.append(ref)
+            col_at_start[i] = ref
+            col_at_end[j - 1] = ref
+            i = j
+            continue
+
+        i += 1
+
+    cte_lower = {c.lower() for c in cte_names}
+    if cte_lower:
+        tables = [
+            TableRef(t.name, t.schema, t.alias, t.start, t.end, is_cte=t.name.lower() in cte_lower)
+            for t in tables
+        ]
+
+    predicates: List[Tuple[ColumnRef, ColumnRef]] = []
+    for a, b in on_spans:
+        for k in range(a, b):
+            if tokens[k].value == "=" and (k - 1) in col_at_end and (k + 1) in col_at_start:
+                predicates.append((col_at_end[k - 1], col_at_start[k + 1]))
+
+    return ParsedSql(
+        sql=sql,
+        tokens=tuple(tokens),
+        statement_kind=statement_kind,
+        keywords=keywords,
+        tables=tuple(tables),
+        cte_names=frozenset(cte_names),
+        columns=tuple(columns),
+        join_predicates=tuple(predicates),
+        clauses=tuple(clauses),
+        select_count=select_count,
+    )
+
+
+@lru_cache(maxsize=SQL_PARSE_CACHE_SIZE)
+def parse_sql(sql: str) -> ParsedSql:
+    """
+    Parse once, reuse everywhere: safety, table/column/join validation,
+    the rewriter and local repair all call this with the same string and
+    share the cached result.
+    """
+    return _parse(sql)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Canonical text for cache keys: comments and whitespace runs dropped,
+    keywords and bare identifiers upper-cased (names are case-insensitive
+    under the database collation), literals kept as-is, trailing ';'
+    removed. Two statements with the same normal form compile the same.
+    """
+    parts = [
+        tok.upper if tok.kind == "word" else sql[tok.start:tok.end]
+        for tok in parse_sql(sql).tokens
+    ]
+    while parts and parts[-1] == ";":
+        parts.pop()
+    return " ".join(parts)
+
+
+# ---------------------------------------------------------
+# 4) Rewriting helpers
+# ---------------------------------------------------------
+
+def replace_spans(sql: str, edits: Iterable[Tuple[int, int, str]]) -> str:
+    """Apply (start, end, replacement) edits; spans must not overlap."""
+    out = sql
+    for start, end, text in sorted(edits, key=lambda e: e[0], reverse=True):
+        out = out[:start] + text + out[end:]
+    return out
+
+
+def insert_joins(sql: str, joins: List[str]) -> str:
+    """Add JOIN clauses at the end of the top-level FROM/JOIN block."""
+    if not joins:
+        return sql
+    at = parse_sql(sql).join_insert_offset()
+    head = sql[:at].rstrip()
+    tail = sql[at:].lstrip()
+    block = "\n" + "\n".join(joins)
+    sep = "\n" if tail and not tail.startswith(";") else ""
+    return head + block + sep + tail
@@ -1,14 +1,10 @@
 # sql_rewriter.py
 
-import re
 from typing import Tuple
 
 from column_mappings import COLUMN_MAPPINGS, ColumnMapping
-from sql_validator import _extract_alias_to_table
-
-
-# Used to find where to inject JOINs (before WHERE/GROUP BY/ORDER BY/HAVING)
-JOIN_INSERT_RE = re.compile(r"\b(where|group by|order by|having)\b", re.IGNORECASE)
+from schema_service import schema_service
+from sql_parser import insert_joins, parse_sql, replace_spans
 
 
 def apply_column_mappings(sql: str) -> Tuple[str, bool]:
@@ -31,24 +27,35 @@ def apply_column_mappings(sql: str) -> Tuple[str, bool]:
     Returns:
         (new_sql, changed)
     """
-    alias_to_table = _extract_alias_to_table(sql)
+    alias_to_table = parse_sql(sql).alias_to_table
     if not alias_to_table or not COLUMN_MAPPINGS:
         return sql, False
 
     new_sql = sql
     changed_any = False
 
+    # Resolve each alias to the catalog's canonical table name, so
+    # "dimproduct p" still matches a mapping for DimProduct
+    catalog = schema_service.catalog
+    alias_to_canonical = {}
+    for alias, table_name in alias_to_table.items():
+        info = catalog.table(table_name)
+        alias_to_canonical[alias] = info.name if info is not None else table_name
+
     for mapping in COLUMN_MAPPINGS:
         # For each alias that refers to mapping.table, try to rewrite
-        for alias, table_name in alias_to_table.items():
-            if table_name != mapping.table:
+        for alias, table_name in alias_to_canonical.items():
+            if table_name.lower() != mapping.table.lower():
                 continue
 
-            # Pattern for alias.column (e.g., dc.SalesRepCode)
-            pattern = rf"\b{re.escape(alias)}\.{re.escape(mapping.column)}\b"
-
-            # Quick check: if not present, no need to do work
-            if not re.search(pattern, new_sql):
+            # alias.column references (e.g., dc.SalesRepCode) in the
+            # current SQL; literals and comments are never touched
+            refs = [
+                ref for ref in parse_sql(new_sql).columns
+                if ref.qualifier.lower() == alias.lower()
+                and ref.column.lower() == mapping.column.lower()
+            ]
+            if not refs:
                 continue
 
             # Use a stable extra alias for this mapping & alias combination
@@ -61,19 +68,18 @@ def apply_column_mappings(sql: str) -> Tuple[str, bool]:
                 extra_alias=extra_alias,
             )
 
-            new_sql, n_subs = re.subn(pattern, replacement_expr, new_sql)
-            if n_subs > 0:
-                changed_any = True
+            new_sql = replace_spans(new_sql, [(r.start, r.end, replacement_expr) for r in refs])
+            changed_any = True
 
-                # 2) Inject JOIN if needed
-                if mapping.join_snippet:
-                    join_clause = mapping.join_snippet.format(
-                        alias=alias,
-                        extra_alias=extra_alias,
-                    )
-                    # Avoid injecting the same JOIN twice
-                    if join_clause not in new_sql:
-                        new_sql = _inject_join(new_sql, join_clause)
+            # 2) Inject JOIN if needed
+            if mapping.join_snippet:
+                join_clause = mapping.join_snippet.format(
+                    alias=alias,
+                    extra_alias=extra_alias,
+                )
+                # Avoid injecting the same JOIN twice
+                if join_clause not in new_sql:
+                    new_sql = _inject_join(new_sql, join_clause)
 
     return new_sql, changed_any
 
@@ -83,18 +89,12 @@ def _inject_join(sql: str, join_clause: str) -> str:
     Inject a JOIN clause into the SQL.
 
     Strategy:
-      - Insert the join_clause before the first WHERE/GROUP BY/ORDER BY/HAVING
-        if any of those exist.
+      - Insert the join_clause before the first top-level WHERE/GROUP BY/
+        ORDER BY/HAVING if any of those exist.
       - Otherwise, append at the end of the FROM/JOIN block (i.e., end of SQL).
 
     join_clause should be a complete fragment like:
 
         "LEFT JOIN DimSalesRepCode src ON dc.SalesRepKey = src.SalesRepKey"
     """
-    match = JOIN_INSERT_RE.search(sql)
-    if match:
-        idx = match.start()
-        return sql[:idx].rstrip() + "\n" + join_clause + "\n" + sql[idx:]
-    else:
-        # No WHERE/GROUP BY/etc: append to the end
-        return sql.rstrip() + "\n" + join_clause + "\n"
+    return insert_joins(sql, [join_clause])
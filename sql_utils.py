@@ -1,8 +1,10 @@
 # sql_utils.py
 from __future__ import annotations
 
+from contextlib import aclosing
 from typing import Any
 import json
+import re
 
 
 def _strip_markdown_fences(text: str) -> str:
@@ -166,3 +168,159 @@ def extract_sql(raw: Any, depth: int = 0) -> str:
         sql_part = sql_part[:-1].rstrip()
 
     return sql_part
+
+
+# ---------------------------------------------------------
+# Streaming extraction
+# ---------------------------------------------------------
+
+_SQL_KEY_RE = re.compile(r'"sql"\s*:\s*"', re.IGNORECASE)
+_SQL_START_RE = re.compile(r"\b(with|select)\b", re.IGNORECASE)
+
+
+def _json_string_end(text: str, start: int) -> int:
+    """Index of the closing quote of a JSON string whose body starts at `start`, or -1."""
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == '"':
+            return i
+        i += 1
+    return -1
+
+
+def _statement_end(text: str, start: int) -> int:
+    """
+    End index (exclusive) of the SQL statement starting at `start`: just
+    past the first ';' outside string literals, [identifiers] and
+    comments, or at a closing ``` fence. -1 if it isn't complete yet.
+    """
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "'":
+            j = text.find("'", i + 1)
+            while j != -1 and text.startswith("''", j):
+                j = text.find("'", j + 2)
+            if j == -1:
+                return -1
+            i = j + 1
+            continue
+        if ch == "[":
+            j = text.find("]", i + 1)
+            if j == -1:
+                return -1
+            i = j + 1
+            continue
+        if text.startswith("--", i):
+            j = text.find("\n", i)
+            if j == -1:
+                return -1
+            i = j + 1
+            continue
+        if text.startswith("/*", i):
+            j = text.find("*/", i + 2)
+            if j == -1:
+                return -1
+            i = j + 2
+            continue
+        if ch == ";":
+            return i + 1
+        if text.startswith("```", i):
+            return i
+        i += 1
+    return -1
+
+
+class SqlStreamExtractor:
+    """
+    Incremental extract_sql for a streamed completion.
+
+    feed() each text chunk; it returns the SQL as soon as it is complete,
+    so the caller can cancel the rest of the generation (typically the
+    "explanation" field nobody reads):
+
+      - JSON answers: once the closing quote of the "sql" value arrives
+      - bare / fenced SQL: at the first ';' outside literals and comments,
+        or at the closing ``` fence
+
+    finish() gives extract_sql() of everything received, for streams that
+    end without a recognisable terminator.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.sql: str | None = None
+
+    def feed(self, chunk: str) -> str | None:
+        if self.sql is not None:
+            return self.sql
+        self.buffer += chunk
+        self.sql = self._complete_sql()
+        return self.sql
+
+    def _complete_sql(self) -> str | None:
+        text = self.buffer
+        head = text.lstrip()
+        if not head:
+            return None
+
+        if head[0] in '{"' or _SQL_KEY_RE.search(text):
+            # JSON answer: wait for the end of the "sql" string value
+            m = _SQL_KEY_RE.search(text)
+            if m is None:
+                return None
+            end = _json_string_end(text, m.end())
+            if end == -1:
+                return None
+            raw_value = text[m.end():end]
+            try:
+                value = json.loads(f'"{raw_value}"', strict=False)
+            except ValueError:
+                value = raw_value
+            return extract_sql(value) or None
+
+        m = _SQL_START_RE.search(text)
+        if m is None:
+            return None
+        end = _statement_end(text, m.start())
+        if end == -1:
+            return None
+        return extract_sql(text[:end]) or None
+
+    def finish(self) -> str:
+        if self.sql is not None:
+            return self.sql
+        return extract_sql(self.buffer)
+
+
+_stream_stats = {"streams": 0, "early_stops": 0, "chars_received": 0}
+
+
+def stream_metrics() -> dict:
+    """Counters for streamed SQL generation (see astream_sql)."""
+    return dict(_stream_stats)
+
+
+async def astream_sql(llm: Any, system: str, messages: list) -> str:
+    """
+    Stream a completion through SqlStreamExtractor and stop reading, which
+    cancels the generation, as soon as the SQL is complete.
+    """
+    extractor = SqlStreamExtractor()
+    sql = None
+    _stream_stats["streams"] += 1
+
+    async with aclosing(llm.astream(system, messages)) as chunks:
+        async for chunk in chunks:
+            _stream_stats["chars_received"] += len(chunk)
+            sql = extractor.feed(chunk)
+            if sql is not None:
+                _stream_stats["early_stops"] += 1
+                break
+
+    return (sql or extractor.finish()).strip()
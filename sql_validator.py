@@ -1,10 +1,10 @@
 # sql_validator.py
 
-import re
 from typing import Tuple, List, Dict
 
-from db import run_query
+from db import describe_first_result_set, describe_first_result_sets
 from schema_service import schema_service
+from sql_parser import parse_sql
 
 
 # ---------------------------------------------------------
@@ -14,55 +14,48 @@ from schema_service import schema_service
 SQL_UPPER = (
     " INSERT ", " UPDATE ", " DELETE ", " ALTER ", " DROP ", " TRUNCATE ",
     " CREATE ", " MERGE ", " EXEC ", " EXECUTE ", " GRANT ", " REVOKE ",
-    " BACKUP ", " RESTORE "
+    " BACKUP ", " RESTORE ", " INTO ",
+    # Rowset functions that reach other servers / files
+    " OPENQUERY ", " OPENROWSET ", " OPENDATASOURCE ", " OPENXML ",
 )
 
-SQL_START_RE = re.compile(r"(?is)^\s*(with|select)\b")
+FORBIDDEN_KEYWORDS = frozenset(op.strip() for op in SQL_UPPER)
 
 
 def is_safe_select(sql: str) -> bool:
     """
     Ensure the generated SQL is a SELECT/CTE and does not contain
-    obviously destructive operations.
+    obviously destructive operations, SELECT ... INTO or the OPEN* rowset
+    functions. Keywords are matched on tokens, so 'DROP' inside a string
+    literal or a comment doesn't count.
     """
-    lowered = sql.strip().lower()
-    if not SQL_START_RE.search(lowered):
+    parsed = parse_sql(sql)
+    if parsed.statement_kind not in ("SELECT", "WITH"):
         return False
 
-    padded = " " + lowered + " "
-    return not any(op.lower() in padded for op in SQL_UPPER)
+    return not (parsed.keywords & FORBIDDEN_KEYWORDS)
 
 
 # ---------------------------------------------------------
 # 2. Table Extraction & Validation
 # ---------------------------------------------------------
 
-TABLE_NAME_RE = re.compile(
-    r'\bfrom\s+([\w\.\[\]]+)|\bjoin\s+([\w\.\[\]]+)',
-    re.I
-)
-
-
 def extract_tables(sql: str) -> set:
     """
     Extract table identifiers (without schema) from FROM/JOIN clauses.
     Example: [dbo].[DimCustomer] -> DimCustomer
+    CTE names are not tables and are left out.
     """
-    raw = set()
-    for m in TABLE_NAME_RE.finditer(sql):
-        g = m.group(1) or m.group(2)
-        if g:
-            ident = g.split('.')[-1].strip('[]')
-            raw.add(ident)
-    return raw
+    return set(parse_sql(sql).table_names)
 
 
 def has_unknown_tables(sql: str) -> Tuple[bool, List[str]]:
     """
     True + list if any tables in the SQL are not known to schema_service.
     """
+    catalog = schema_service.catalog
     used = extract_tables(sql)
-    unknown = [t for t in used if t not in schema_service.tables]
+    unknown = [t for t in used if not catalog.has_table(t)]
     return bool(unknown), unknown
 
 
@@ -70,14 +63,6 @@ def has_unknown_tables(sql: str) -> Tuple[bool, List[str]]:
 # 3. Alias Extraction (used for column validation & rewriter)
 # ---------------------------------------------------------
 
-# FROM <table> <alias>
-# JOIN <table> <alias>
-TABLE_ALIAS_RE = re.compile(
-    r'\b(from|join)\s+([\w\.\[\]]+)(?:\s+(?:as\s+)?([\w\[\]]+))?',
-    re.I
-)
-
-
 def _extract_alias_to_table(sql: str) -> Dict[str, str]:
     """
     Map SQL aliases -> actual table names.
@@ -87,34 +72,13 @@ def _extract_alias_to_table(sql: str) -> Dict[str, str]:
       JOIN [dbo].[DimCustomer] AS dc
       FROM DimCustomer           (no alias -> alias == table name)
     """
-    mapping: Dict[str, str] = {}
-
-    for m in TABLE_ALIAS_RE.finditer(sql):
-        table_token = m.group(2)
-        alias_token = m.group(3)
-
-        if not table_token:
-            continue
-
-        table_name = table_token.split('.')[-1].strip('[]')
-        alias = alias_token.strip('[]') if alias_token else table_name
-
-        mapping[alias] = table_name
-
-    return mapping
+    return parse_sql(sql).alias_to_table
 
 
 # ---------------------------------------------------------
 # 4. Column-level Validation
 # ---------------------------------------------------------
 
-# alias.column or table.column
-COLUMN_REF_RE = re.compile(
-    r'([A-Za-z0-9_\[\]]+)\.([A-Za-z0-9_\[\]]+)',
-    re.IGNORECASE,
-)
-
-
 def has_unknown_columns(sql: str) -> Tuple[bool, List[Tuple[str, str, str]]]:
     """
     Detects alias.column references that do not exist in schema_service.
@@ -125,60 +89,128 @@ def has_unknown_columns(sql: str) -> Tuple[bool, List[Tuple[str, str, str]]]:
     Example element:
         ("DimCustomer", "dc", "SalesRepCode")
     """
-    alias_to_table = _extract_alias_to_table(sql)
+    parsed = parse_sql(sql)
+    alias_to_table = parsed.alias_to_table
     unknown: List[Tuple[str, str, str]] = []
 
     if not alias_to_table:
         return False, unknown
 
-    for m in COLUMN_REF_RE.finditer(sql):
-        alias = m.group(1).strip('[]')
-        col = m.group(2).strip('[]')
+    catalog = schema_service.catalog
+    # Aliases are case-insensitive in T-SQL, like table/column names
+    alias_lower = {a.lower(): t for a, t in alias_to_table.items()}
+    cte_lower = {c.lower() for c in parsed.cte_names}
+
+    for ref in parsed.columns:
+        alias = ref.qualifier
+        col = ref.column
 
         # Determine the table behind this alias/prefix
-        if alias in alias_to_table:
-            table_name = alias_to_table[alias]
-        elif alias in schema_service.tables:
-            table_name = alias
-        else:
-            # Could be db/schema prefix; ignore
+        table_name = alias_lower.get(alias.lower())
+        if table_name is None:
+            if catalog.has_table(alias):
+                table_name = alias
+            else:
+                # Could be db/schema prefix; ignore
+                continue
+
+        # CTE columns aren't in the catalog
+        if table_name.lower() in cte_lower:
             continue
 
         # If table unknown, let table-level validation handle it
-        if table_name not in schema_service.tables:
+        table = catalog.table(table_name)
+        if table is None:
             continue
 
-        valid_cols = schema_service.cols_by_table.get(table_name, [])
-
-        if col not in valid_cols:
-            unknown.append((table_name, alias, col))
+        if not table.has_column(col):
+            unknown.append((table.name, alias, col))
 
     return bool(unknown), unknown
 
 
 # ---------------------------------------------------------
-# 5. SQL Server Preflight (compile-only)
+# 5. Join-key Validation (against real FK columns)
 # ---------------------------------------------------------
 
-def _escape_for_tsql_literal(sql: str) -> str:
-    return sql.replace("'", "''")
+def has_bad_join_keys(sql: str) -> Tuple[bool, List[Tuple[str, str, str, str]]]:
+    """
+    Detects JOIN ... ON a.X = b.Y predicates between FK-related tables
+    that don't use the FK columns (e.g. fis.ProductKey = c.CustomerKey).
 
+    Tables without any FK between them are not judged.
 
-def server_preflight_ok(sql: str) -> Tuple[bool, str]:
+    Returns:
+        (has_bad, [(table1, column1, table2, column2), ...])
+    """
+    parsed = parse_sql(sql)
+    alias_to_table = parsed.alias_to_table
+    bad: List[Tuple[str, str, str, str]] = []
+    if not alias_to_table:
+        return False, bad
+
+    catalog = schema_service.catalog
+    graph = catalog.join_graph
+    if graph is None:
+        return False, bad
+
+    alias_lower = {a.lower(): t for a, t in alias_to_table.items()}
+
+    for left, right in parsed.join_predicates:
+        t1 = alias_lower.get(left.qualifier.lower(), left.qualifier)
+        t2 = alias_lower.get(right.qualifier.lower(), right.qualifier)
+        if graph.is_fk_join(t1, left.column, t2, right.column) is False:
+            bad.append((catalog.table(t1).name, left.column, catalog.table(t2).name, right.column))
+
+    return bool(bad), bad
+
+
+def describe_bad_joins(bad: List[Tuple[str, str, str, str]]) -> str:
+    """Validator message for has_bad_join_keys results, with the real FK keys."""
+    graph = schema_service.catalog.join_graph
+    parts = []
+    for t1, c1, t2, c2 in bad:
+        keys = sorted(graph.join_keys(t1, t2)) if graph is not None else []
+        valid = " or ".join(f"{t1}.{k1} = {t2}.{k2}" for k1, k2 in keys)
+        parts.append(f"{t1}.{c1} = {t2}.{c2} (FK join is {valid})")
+    return "Join uses non-FK columns: " + "; ".join(parts)
+
+
+# ---------------------------------------------------------
+# 6. SQL Server Preflight (compile-only)
+# ---------------------------------------------------------
+
+def server_preflight(sql: str) -> Tuple[bool, str, List[Dict]]:
     """
     Uses sp_describe_first_result_set to ask SQL Server to compile the
     query without executing it. Catches syntax / compile-time errors.
+
+    Returns (ok, message, columns) where columns describes the result set
+    ({"name", "type", "nullable"} per column).
+    """
+    try:
+        columns = describe_first_result_set(sql)
+    except Exception as ex:
+        return False, str(ex), []
+    return True, "ok", columns
+
+
+def server_preflight_many(sqls: List[str]) -> List[Tuple[bool, str, List[Dict]]]:
+    """
+    server_preflight for many statements in one DB round trip; one
+    statement failing to compile doesn't affect the others. If the whole
+    batch fails (e.g. the connection drops) every statement gets that error.
     """
     try:
-        tsql = (
-            "DECLARE @q nvarchar(max) = N'"
-            + _escape_for_tsql_literal(sql)
-            + "'; EXEC sp_describe_first_result_set @tsql = @q;"
-        )
-        _ = run_query(tsql)
-        return True, "ok"
+        return describe_first_result_sets(sqls)
     except Exception as ex:
-        return False, str(ex)
+        return [(False, str(ex), []) for _ in sqls]
+
+
+def server_preflight_ok(sql: str) -> Tuple[bool, str]:
+    """server_preflight without the result-set shape."""
+    ok, msg, _ = server_preflight(sql)
+    return ok, msg
 
 
 # ---------------------------------------------------------
@@ -190,6 +222,10 @@ __all__ = [
     "extract_tables",
     "has_unknown_tables",
     "has_unknown_columns",
+    "has_bad_join_keys",
+    "describe_bad_joins",
+    "server_preflight",
+    "server_preflight_many",
     "server_preflight_ok",
     "_extract_alias_to_table",
 ]
@@ -0,0 +1,359 @@
+# validation_cache.py
+
+import asyncio
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    LOCAL_SEMANTIC_CHECK,
+    VALIDATION_CACHE_MAX_ENTRIES,
+    PREFLIGHT_BATCH_SIZE,
+    PREFLIGHT_BATCH_WINDOW_MS,
+)
+from db import run_in_pool
+from schema_service import schema_service
+from semantic_check import UNSURE, VALID, check_semantics
+from sql_parser import normalize_sql
+from sql_validator import (
+    is_safe_select,
+    has_unknown_tables,
+    has_unknown_columns,
+    has_bad_join_keys,
+    describe_bad_joins,
+    server_preflight,
+    server_preflight_many,
+)
+
+
+# SQLSTATE class 42 (syntax error, invalid object / column name, ...) is a
+# property of the SQL and the schema, so the failure is safe to cache.
+# Other errors (timeouts, lost connections, login failures) are not.
+COMPILE_ERROR_RE = re.compile(r"[\['\"]42[0-9A-Z]{3}[\]'\"]")
+
+# Per-statement errors caught inside a preflight batch ("Msg 207: Invalid
+# column name ...") come from compiling that statement, except lock waits
+BATCH_ERROR_RE = re.compile(r"^Msg (\d+):")
+TRANSIENT_ERROR_NUMBERS = {1205, 1222}
+
+
+def _is_compile_error(message: str) -> bool:
+    m = BATCH_ERROR_RE.match(message)
+    if m is not None:
+        return int(m.group(1)) not in TRANSIENT_ERROR_NUMBERS
+    return bool(COMPILE_ERROR_RE.search(message))
+
+
+# ---------------------------------------------------------
+# 1) Validation outcome
+# ---------------------------------------------------------
+
+@dataclass
+class ValidationResult:
+    """
+    Everything the pipeline learns about one SQL statement: local checks
+    (safety, tables, columns, join keys) and, once run, the preflight
+    outcome with the result-set shape SQL Server reported.
+    """
+    safe: bool
+    unknown_tables: List[str] = field(default_factory=list)
+    unknown_columns: List[Tuple[str, str, str]] = field(default_factory=list)
+    bad_joins: List[Tuple[str, str, str, str]] = field(default_factory=list)
+    semantic: str = UNSURE  # check_semantics verdict: valid / invalid / unsure
+    semantic_msg: str = ""
+    preflight_ok: Optional[bool] = None  # None until preflight has run
+    preflight_msg: str = ""
+    columns: List[Dict] = field(default_factory=list)
+
+    @property
+    def local_ok(self) -> bool:
+        return self.safe and not (self.unknown_tables or self.unknown_columns or self.bad_joins)
+
+    @property
+    def error(self) -> Optional[str]:
+        """Message for the first failing local check, None if they all pass."""
+        if not self.safe:
+            return "Blocked: generated SQL is not a safe SELECT statement."
+        if self.unknown_tables:
+            return f"Query referenced unknown tables: {', '.join(self.unknown_tables)}"
+        if self.unknown_columns:
+            pretty = [f"{tbl}.{col} (alias {alias})" for (tbl, alias, col) in self.unknown_columns]
+            return "Query referenced unknown columns: " + ", ".join(pretty)
+        if self.bad_joins:
+            return describe_bad_joins(self.bad_joins)
+        return None
+
+
+def _validate_local(sql: str) -> ValidationResult:
+    if not is_safe_select(sql):
+        return ValidationResult(safe=False)
+    result = ValidationResult(
+        safe=True,
+        unknown_tables=has_unknown_tables(sql)[1],
+        unknown_columns=has_unknown_columns(sql)[1],
+        bad_joins=has_bad_join_keys(sql)[1],
+    )
+    if result.local_ok and LOCAL_SEMANTIC_CHECK:
+        verdict = check_semantics(sql)
+        result.semantic, result.semantic_msg = verdict.status, verdict.message
+    return result
+
+
+# ---------------------------------------------------------
+# 2) Cache
+# ---------------------------------------------------------
+
+class ValidationCache:
+    """
+    Bounded LRU from (normalized SQL, schema fingerprint) to its
+    ValidationResult.
+
+    Repair loops, eval reruns, cached questions and batch jobs validate
+    the same statements over and over; a hit skips the local checks and,
+    above all, the sp_describe_first_result_set round trip. Preflight
+    failures are only cached when they are compile errors (SQLSTATE 42xxx),
+    never for transient DB errors. A schema change drops every entry.
+    """
+
+    def __init__(self, max_entries: int = VALIDATION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ValidationResult]" = OrderedDict()
+        self._fingerprint: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def _key(self, sql: str) -> str:
+        """Call with the lock held."""
+        fp = schema_service.catalog.fingerprint
+        if fp != self._fingerprint:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._fingerprint = fp
+        text = f"{fp}\0{normalize_sql(sql)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _store(self, key: str, result: ValidationResult) -> None:
+        """Call with the lock held."""
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    # -----------------------------------------------------
+    # Local checks
+    # -----------------------------------------------------
+
+    def validate(self, sql: str) -> ValidationResult:
+        """Local checks for `sql` (no DB access), cached."""
+        with self._lock:
+            key = self._key(sql)
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._stats["local_hits"] += 1
+                return result
+            self._stats["local_misses"] += 1
+
+        result = _validate_local(sql)
+        with self._lock:
+            # Keep a preflight outcome another thread may have stored meanwhile
+            existing = self._entries.get(key)
+            if existing is not None:
+                return existing
+            self._store(key, result)
+        return result
+
+    # -----------------------------------------------------
+    # Preflight
+    # -----------------------------------------------------
+
+    def local_verdict(self, sql: str) -> Optional[Tuple[bool, str]]:
+        """
+        (ok, message) when the local semantic check is certain, so the
+        server preflight can be skipped; None when SQL Server must decide.
+        """
+        result = self.validate(sql)
+        with self._lock:
+            self._stats[f"semantic_{result.semantic}"] += 1
+        if result.semantic == UNSURE:
+            return None
+        if result.semantic == VALID:
+            return True, "ok"
+        return False, result.semantic_msg
+
+    def cached_preflight(self, sql: str) -> Optional[ValidationResult]:
+        """The cached result if it already has a preflight outcome (counts hits only)."""
+        with self._lock:
+            key = self._key(sql)
+            result = self._entries.get(key)
+            if result is None or result.preflight_ok is None:
+                return None
+            self._entries.move_to_end(key)
+            self._stats["preflight_hits"] += 1
+            return result
+
+    def preflight(self, sql: str) -> ValidationResult:
+        """
+        Blocking: local checks plus server preflight for `sql`, served from
+        the cache when possible. Call from the DB executor.
+        """
+        hit = self.cached_preflight(sql)
+        if hit is not None:
+            return hit
+
+        with self._lock:
+            self._stats["preflight_misses"] += 1
+        ok, msg, columns = server_preflight(sql)
+        return self._record_preflight(sql, ok, msg, columns)
+
+    def preflight_many(self, sqls: List[str]) -> List[ValidationResult]:
+        """
+        Blocking: preflight for many statements. Cache hits are served
+        directly; the misses go to SQL Server in batches of up to
+        PREFLIGHT_BATCH_SIZE statements, one round trip per batch.
+        """
+        results: List[Optional[ValidationResult]] = [self.cached_preflight(s) for s in sqls]
+        todo = [i for i, r in enumerate(results) if r is None]
+
+        for start in range(0, len(todo), max(1, PREFLIGHT_BATCH_SIZE)):
+            chunk = todo[start:start + max(1, PREFLIGHT_BATCH_SIZE)]
+            with self._lock:
+                self._stats["preflight_misses"] += len(chunk)
+                self._stats["preflight_batches"] += 1
+            outcomes = server_preflight_many([sqls[i] for i in chunk])
+            for i, (ok, msg, columns) in zip(chunk, outcomes):
+                results[i] = self._record_preflight(sqls[i], ok, msg, columns)
+
+        return results
+
+    def _record_preflight(self, sql: str, ok: bool, msg: str, columns: List[Dict]) -> ValidationResult:
+        local = self.validate(sql)
+        result = ValidationResult(
+            safe=local.safe,
+            unknown_tables=local.unknown_tables,
+            unknown_columns=local.unknown_columns,
+            bad_joins=local.bad_joins,
+            semantic=local.semantic,
+            semantic_msg=local.semantic_msg,
+            preflight_ok=ok,
+            preflight_msg=msg,
+            columns=columns,
+        )
+        if ok or _is_compile_error(msg):
+            with self._lock:
+                self._store(self._key(sql), result)
+        return result
+
+    def columns(self, sql: str) -> Optional[List[Dict]]:
+        """Result-set shape from a cached successful preflight, if any (no stats)."""
+        with self._lock:
+            result = self._entries.get(self._key(sql))
+        if result is None or not result.preflight_ok:
+            return None
+        return result.columns
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._entries)
+        for kind in ("local", "preflight"):
+            hits = stats.get(f"{kind}_hits", 0)
+            total = hits + stats.get(f"{kind}_misses", 0)
+            stats[f"{kind}_hit_rate"] = round(hits / total, 3) if total else 0.0
+        # Share of preflights the local semantic check decided on its own
+        decided = stats.get("semantic_valid", 0) + stats.get("semantic_invalid", 0)
+        total = decided + stats.get("semantic_unsure", 0)
+        stats["preflight_skip_rate"] = round(decided / total, 3) if total else 0.0
+        return {"entries": entries, "max_entries": self.max_entries, **stats}
+
+
+validation_cache = ValidationCache()
+
+
+# ---------------------------------------------------------
+# 3) Coalescing concurrent preflights
+# ---------------------------------------------------------
+
+class PreflightBatcher:
+    """
+    Collects preflights requested by concurrent coroutines (batch items,
+    multi-candidate checks) for up to `window` seconds, or until
+    `max_batch` are waiting, and sends them to SQL Server in one
+    preflight_many round trip on the DB executor. Cache hits never wait.
+    """
+
+    def __init__(
+        self,
+        cache: ValidationCache,
+        max_batch: int = PREFLIGHT_BATCH_SIZE,
+        window: float = PREFLIGHT_BATCH_WINDOW_MS / 1000.0,
+    ):
+        self.cache = cache
+        self.max_batch = max(1, max_batch)
+        self.window = window
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._stats = Counter()
+
+    async def preflight(self, sql: str) -> ValidationResult:
+        hit = self.cache.cached_preflight(sql)
+        if hit is not None:
+            return hit
+        if self.window <= 0:
+            return await run_in_pool("preflight", self.cache.preflight, sql)
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((sql, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # Waiters that were cancelled (client went away) need no preflight
+        batch = [(sql, fut) for sql, fut in batch if not fut.done()]
+        if batch:
+            self._stats["batches"] += 1
+            self._stats["statements"] += len(batch)
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            results = await run_in_pool("preflight", self.cache.preflight_many, [sql for sql, _ in batch])
+        except Exception as ex:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(ex)
+            return
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    def metrics(self) -> Dict:
+        batches = self._stats["batches"]
+        return {
+            "batches": batches,
+            "statements": self._stats["statements"],
+            "avg_batch_size": round(self._stats["statements"] / batches, 2) if batches else 0.0,
+            "waiting": len(self._pending),
+        }
+
+
+preflight_batcher = PreflightBatcher(validation_cache)